@@ -6,8 +6,10 @@
 # Description: Superclass for each kind of node (rackspace node, pi node)
 
 # System Imports
+from json import dumps
 from os import path
-from subprocess import call, Popen, DEVNULL
+from shlex import quote
+from subprocess import call, DEVNULL
 from time import sleep, time
 from re import search
 
@@ -15,6 +17,7 @@ from re import search
 
 # Local Imports
 import functions
+import transfer
 from config import IP_BLACK_LIST
 
 class Node:
@@ -97,16 +100,14 @@ class Node:
 
     def pull_cert(self):
         print("Pulling cert from " + self.name)
-        from_path = self.user_name + "@" + self.ip + ":" + self.gvine_path + "node" + str(
-            self.id) + ".cer"
+        from_path = self.gvine_path + "node" + str(self.id) + ".cer"
         to_path = "./keystore/"
-        Popen(['scp', from_path, to_path])
+        transfer.get_files(self.ip, self.user_name, [(from_path, to_path)])
 
     def push_certs(self, path_to_certs):
         print("Pushing cert to " + self.name)
-        command = "scp " + path_to_certs + " " + self.user_name + "@" + self.ip + ":" + \
-                  self.gvine_path
-        call(command, shell=True, stdout=DEVNULL)
+        file_pairs = [(cert, self.gvine_path) for cert in transfer.expand_local_glob(path_to_certs)]
+        transfer.put_files(self.ip, self.user_name, file_pairs)
 
     def load_certs(self, num_nodes):
         print("Loading certs on " + self.name)
@@ -121,17 +122,40 @@ class Node:
     def execute_command(self, command):
         functions.remote_execute(command, self.ip, self.user_name)
 
-    def push_file(self, src_path, dest_path, dest_file_name=None):
+    def execute_batch(self, commands, stop_on_failure=False):
+        """Run commands in order over a single ssh channel
+
+        :param commands: list of shell commands
+        :param stop_on_failure: skip the remaining commands after one exits non-zero
+        :return: list of {"command", "exit_status", "stdout", "stderr"} for each command run
+        """
+        return functions.remote_execute_batch(commands, self.ip, self.user_name, stop_on_failure)
+
+    def stream_command(self, command, lines=True, stop_event=None):
+        """Yield the command's output lines (or byte chunks) while it is still running"""
+        return functions.remote_execute_stream(command, self.ip, self.user_name, lines=lines,
+                                               stop_event=stop_event)
+
+    def push_file(self, src_path, dest_path, dest_file_name=None, sync=False):
+        """Push src_path (a local glob) to dest_path on the node, under dest_file_name if given
+
+        :param sync: skip files whose content is already on the node, see transfer.sync_files
+        """
         if dest_file_name:
             if dest_path[-1] == "/":
                 dest_path = dest_path + dest_file_name
             else:
                 dest_path = dest_path + "/" + dest_file_name
         print("Pushing " + src_path + " to " + self.name + " as " + dest_path)
-        command = "scp " + src_path + " " + self.user_name + "@" + self.ip + ":" + dest_path
-        call(command, shell=True, stdout=DEVNULL)
+        file_pairs = [(src, dest_path) for src in transfer.expand_local_glob(src_path)]
+        if sync:
+            written = transfer.sync_files(self.ip, self.user_name, file_pairs)
+            print(self.name + ": " + str(len(written)) + " of " + str(len(file_pairs)) +
+                  " files changed")
+        else:
+            transfer.put_files(self.ip, self.user_name, file_pairs)
 
-    def push_dir(self, src_path, dest_path, dest_file_name=None):
+    def push_dir(self, src_path, dest_path, dest_file_name=None, sync=False):
         if src_path[-1] != "/":
             src_path += "/"
         if dest_file_name:
@@ -140,13 +164,12 @@ class Node:
             else:
                 dest_path = dest_path + "/" + dest_file_name
         print("Pushing " + src_path + " to " + self.name + " as " + dest_path)
-        command = "scp -r " + src_path + ". " + self.user_name + "@" + self.ip + ":" + dest_path
-        call(command, shell=True, stdout=DEVNULL)
+        written = transfer.put_dir(self.ip, self.user_name, src_path, dest_path, sync=sync)
+        if sync:
+            print(self.name + ": " + str(len(written)) + " files changed")
 
     def pull_file(self, remote_path, local_path):
-        command = "scp " + self.user_name + "@" + self.ip + ":" + remote_path +\
-                  " " + local_path
-        call(command, shell=True)
+        transfer.get_files(self.ip, self.user_name, [(remote_path, local_path)])
 
     def remote_create_dir(self, path_to_folder):
         command = "mkdir " + path_to_folder
@@ -226,8 +249,7 @@ class Node:
     def stop_gvine(self):
         jar_name = "gvapp.jar"
         command = "java -jar " + jar_name + " stop " + str(self.id)
-        functions.remote_execute(command, self.ip, self.user_name)
-        functions.remote_execute("sudo pkill java", self.ip, self.user_name)
+        self.execute_batch([command, "sudo pkill java"])
 
     def refactor_api_command(self, api_command, client_jar, port=22124):
         command = "cd " + self.gvine_path + " && java -jar " + client_jar + " -p " + str(port) + \
@@ -252,18 +274,24 @@ class Node:
         command = "cd " + self.gvine_path + " && java -jar dbreader.jar eventlogs/" + target_dir \
                   + " LaJollaCove eventsql"
         functions.remote_execute(command, self.ip, self.user_name)
+        # The newest eventlogs folder is the current test run's
+        return target_dir.rstrip("/")
 
     def copy_event_db(self, save_file):
-        src = self.user_name + "@" + self.ip + ":" + self.gvine_path + "dbs/eventsql_copy.db"
+        src = self.gvine_path + "dbs/eventsql_copy.db"
         dest = "./stats/events/" + save_file + "/nodedata/eventsql" + str(self.id) + ".db"
-        functions.execute_shell("scp " + src + " " + dest)
+        transfer.get_compressed_file(self.ip, self.user_name, src, dest, decompress=True)
 
     ##### TCPDUMP #####
 
+    def get_capture_ifaces(self):
+        """Interfaces tcpdump captures on, one per member subnet"""
+        return [self.iface_prefix + str(index + self.iface_index)
+                for index in range(len(self.member_subnets))]
+
     def start_tcpdump(self):
         commands = []
-        for index in range(len(self.member_subnets)):
-            iface = self.iface_prefix + str(index + self.iface_index)
+        for iface in self.get_capture_ifaces():
             print("Starting tcpdump on " + self.name + " and iface " + iface)
             command = "sudo nohup tcpdump -i " + iface + " -n udp -w " + self.gvine_path + iface \
                       + ".pcap &>/dev/null &"
@@ -271,11 +299,44 @@ class Node:
         functions.remote_execute_commands(commands, self.ip, self.user_name)
 
     def retrieve_pcaps(self, pcap_folder):
-        for index in range(self.iface_index, len(self.member_subnets) + self.iface_index):
-            iface = self.iface_prefix + str(index)
-            command = "scp " + self.user_name + "@" + self.ip + ":" + self.gvine_path + \
-                      iface + ".pcap " + pcap_folder + self.name + "_" + iface + ".pcap"
-            functions.execute_shell(command)
+        # Kept gzipped locally, packetsuite reads .pcap.gz directly
+        file_pairs = []
+        for iface in self.get_capture_ifaces():
+            file_pairs.append((self.gvine_path + iface + ".pcap",
+                               pcap_folder + self.name + "_" + iface + ".pcap.gz"))
+        transfer.get_compressed_files(self.ip, self.user_name, file_pairs,
+                                      num_streams=len(file_pairs))
+
+    def retrieve_pcap_summary(self, pcap_folder, ipmap):
+        """Summarize the captures on the node with pcapsummary.py and pull just the summary
+
+        :param ipmap: ipmap[ip] = node id for the whole cluster, see statsuite.make_ipmap
+        """
+        scripts = ["./pcapreader.py", "./pcapsummary.py"]
+        transfer.sync_files(self.ip, self.user_name,
+                            [(script, self.gvine_path) for script in scripts])
+        pcap_names = [iface + ".pcap" for iface in self.get_capture_ifaces()]
+        command = "cd " + self.gvine_path + " && python3 pcapsummary.py " + str(self.id) + \
+                  " " + quote(dumps(ipmap)) + " " + " ".join(pcap_names)
+        summary_path = pcap_folder + self.name + ".summary"
+        with open(summary_path, "wb") as file:
+            for chunk in functions.remote_execute_stream(command, self.ip, self.user_name,
+                                                         lines=False):
+                file.write(chunk)
+        with open(summary_path, "rb") as file:
+            if not file.read().endswith(b"# end\n"):
+                raise IOError("pcapsummary.py failed on " + self.name)
+        return summary_path
+
+    def stream_capture(self, iface, stop_event=None):
+        """Yield raw libpcap bytes of a live capture on iface as packets arrive
+
+        Separate from the tcpdump started by start_tcpdump, which keeps writing its file.
+        The remote tcpdump exits on SIGPIPE once the stream is closed or stop_event is set.
+        """
+        command = "sudo tcpdump -i " + iface + " -n udp -U -w - 2>/dev/null"
+        return functions.remote_execute_stream(command, self.ip, self.user_name, lines=False,
+                                               stop_event=stop_event)
 
     def get_ipmap(self):
         ipmap = {}
@@ -302,6 +363,12 @@ class Node:
         remote_path = self.gvine_path + "log_node" + str(self.id) + ".txt"
         self.pull_file(remote_path, folder_name)
 
+    def follow_log_file(self, stop_event=None):
+        """Yield new lines of this node's GrapeVine log as they are written"""
+        log_file = self.gvine_path + "log_node" + str(self.id) + ".txt"
+        return functions.remote_execute_stream("tail -n +1 -F " + log_file, self.ip,
+                                               self.user_name, stop_event=stop_event, get_pty=True)
+
     def check_log_exception(self):
         log_file = "log_node" + str(self.id) + ".txt"
         command = "cd " + self.gvine_path + " && grep " + log_file + " -e 'Exception'"
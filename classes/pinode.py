@@ -71,7 +71,7 @@ class PiNode(Node):
         # Execute the commands
         for command in commands:
             print(command)
-            functions.remote_execute(command, self.ip, self.user_name)
+        self.execute_batch(commands)
 
     def adhoc_config_stop(self, interface, subnet, ip, mask="255.255.255.0"):
         print("Stopping adhoc")
@@ -90,7 +90,7 @@ class PiNode(Node):
         # Execute the commands
         for command in commands:
             print(command)
-            functions.remote_execute(command, self.ip, self.user_name)
+        self.execute_batch(commands)
 
     def ex_command(self, command):
         functions.remote_execute(command, self.ip, self.user_name, True, True)
@@ -7,13 +7,13 @@
 
 # System Imports
 from os import path
-from subprocess import call, Popen, DEVNULL
 from time import sleep
 
 # Third Party Imports
 
 # Local Imports
 import functions
+import transfer
 from classes.node import Node
 
 class RackNode(Node):
@@ -78,33 +78,29 @@ class RackNode(Node):
 
     # Copy default config to topology directory
     def remote_copy_default_config(self, save_folder):
-        command = (
-            "scp ./default_config/* " + self.user_name + "@" + self.ip +
-            ":" + self.topo_dir + save_folder
-        )
-        call(command, shell=True, stdout=DEVNULL)
+        to_dir = self.topo_dir + save_folder + "/"
+        file_pairs = [(src, to_dir) for src in transfer.expand_local_glob("./default_config/*")]
+        transfer.sync_files(self.ip, self.user_name, file_pairs)
 
     # Copy emane_start.sh and emane_stop.sh to each rackspace node in iplist
     def remote_copy_emane_scripts(self, save_folder):
         start_dir = './topologies/' + save_folder + '/emane_start.sh'
         stop_dir = './topologies/' + save_folder + '/emane_stop.sh'
-        to_dir = self.user_name + '@' + self.ip + ':' + self.topo_dir + save_folder + "/"
-        Popen(['scp', start_dir, to_dir])
-        Popen(['scp', stop_dir, to_dir])
+        to_dir = self.topo_dir + save_folder + "/"
+        transfer.sync_files(self.ip, self.user_name, [(start_dir, to_dir), (stop_dir, to_dir)])
 
     # Copy corresponding platform#.xml to corresponding rackspace node in iplist
     def remote_copy_platform_xml(self, save_folder):
         file_name = 'platform' + str(self.id) + '.xml'
         from_dir = './topologies/' + save_folder + '/' + file_name
-        to_dir = self.user_name + "@" + self.ip + ':' + self.topo_dir + save_folder + \
-                 "/platform.xml"
-        Popen(['scp', from_dir, to_dir])
+        to_dir = self.topo_dir + save_folder + "/platform.xml"
+        transfer.sync_files(self.ip, self.user_name, [(from_dir, to_dir)])
 
     # Copy scenario.eel to each rackspace node in iplist
     def remote_copy_scenario(self, save_folder):
         from_dir = './topologies/' + save_folder + '/scenario.eel'
-        to_dir = self.user_name + "@" + self.ip + ':' + self.topo_dir + save_folder + "/"
-        Popen(['scp', from_dir, to_dir])
+        to_dir = self.topo_dir + save_folder + "/"
+        transfer.sync_files(self.ip, self.user_name, [(from_dir, to_dir)])
 
     # Run file on each rackspace node in ip_file file
     def remote_emane(self, save_file, script_file):
@@ -123,40 +119,21 @@ class RackNode(Node):
         super().stop_all()
 
     def generate_emane_stats(self, save):
-        command = (
-            "cd /home/emane-01/emane/topologies/" + save +
-            "/data/ && mkdir stats"
-        )
-        functions.remote_execute(command, self.ip, self.user_name)
-
-        command = (
-            "emanesh " + self.name +
-            " show > /home/emane-01/emane/topologies/" + save +
-            "/data/stats/emane.show"
-        )
-        functions.remote_execute(command, self.ip, self.user_name)
-
-        command = (
-            "emanesh " + self.name + " get stat '*' all"
-            " > /home/emane-01/emane/topologies/" + save +
-            "/data/stats/emane.stats"
-        )
-        functions.remote_execute(command, self.ip, self.user_name)
-
-        command = (
-            "emanesh " + self.name + " get table '*' all"
-            " > /home/emane-01/emane/topologies/" + save +
-            "/data/stats/emane.tables"
-        )
-        functions.remote_execute(command, self.ip, self.user_name)
+        commands = [
+            "cd /home/emane-01/emane/topologies/" + save + "/data/ && mkdir stats",
+            "emanesh " + self.name + " show > /home/emane-01/emane/topologies/" + save +
+            "/data/stats/emane.show",
+            "emanesh " + self.name + " get stat '*' all > /home/emane-01/emane/topologies/" +
+            save + "/data/stats/emane.stats",
+            "emanesh " + self.name + " get table '*' all > /home/emane-01/emane/topologies/" +
+            save + "/data/stats/emane.tables"
+        ]
+        self.execute_batch(commands)
 
     def copy_emane_stats(self, save):
         dest_dir = './stats/emane/' + save + "/" + self.name
-        from_dir = (
-            self.user_name + '@' + self.ip + ':/home/emane-01/emane/topologies/'
-            + save + '/data/stats/*'
-        )
-        Popen(['scp', '-r', from_dir, dest_dir])
+        from_dir = '/home/emane-01/emane/topologies/' + save + '/data/stats'
+        transfer.get_dir(self.ip, self.user_name, from_dir, dest_dir)
 
     ##### IPTABLES #####
 
@@ -195,15 +172,14 @@ class RackNode(Node):
         commands = self.get_block_node_input_commands(other_node_object)
         for command in commands:
             print(self.name + ": " + command)
-            functions.remote_execute(command, self.ip, self.user_name)
+        self.execute_batch(commands)
 
     def block_subnet(self, subnet_name):
         input_command = self.get_block_subnet_command(subnet_name, True)
         output_command = self.get_block_subnet_command(subnet_name, False)
         print(self.name + ": " + input_command)
         print(self.name + ": " + output_command)
-        functions.remote_execute(input_command, self.ip, self.user_name)
-        functions.remote_execute(output_command, self.ip, self.user_name)
+        self.execute_batch([input_command, output_command])
 
     def reset_iptables(self):
         command = "sudo iptables -F"
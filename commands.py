@@ -13,7 +13,6 @@
 from time import sleep, time
 from os import path
 from collections import OrderedDict
-import logging
 import threading
 from subprocess import call
 import queue
@@ -34,15 +33,13 @@ import statsuite
 import autotest
 import packetsuite
 import graphsuite
+import telemetry
+import transfer
 import config
 import constants
 from classes.racknode import RackNode
 from classes.pinode import PiNode
 
-# This suppresses warning messages produced by scapy on module load
-logging.getLogger("scapy.runtime").setLevel(logging.ERROR)
-from scapy.all import rdpcap
-
 # Constants defined in config.py
 NODE_PREFIX = config.NODE_PREFIX
 SAVE_FILE = config.SAVE_FILE
@@ -277,20 +274,24 @@ def setup(save_file, subnets, nodes, node_objects):
         print(save_file + " already configured")
 
     # Multithreaded setup
-    threads = []
-    for node in node_objects:
-        new_thread = threading.Thread(target=node.setup_gvine, args=(save_file,))
-        threads.append(new_thread)
-        new_thread.start()
-    for t in threads:
-        t.join()
+    results = functions.run_on_nodes(node_objects, "setup_gvine", args=(save_file,))
+    functions.print_node_results(results, "setup")
 
-    # Do node certifications
+    # Do node certifications, the relay key first so gvpki's pushes can relay
     if isinstance(node_objects[0], RackNode):
+        setup_relay_key(node_objects)
         gvpki(node_objects)
     print("Done.")
 
 
+def setup_relay_key(node_objects):
+    """Install the relay key that distribute_files' node to node pushes log in with"""
+    public_key = transfer.make_relay_key()
+    deploy = lambda node: transfer.deploy_relay_key(node.ip, node.user_name, public_key)
+    results = functions.run_on_nodes(node_objects, deploy)
+    functions.print_node_results(results, "relay_key")
+
+
 def clean_setup(node_objects):
     threads = []
     for node in node_objects:
@@ -304,13 +305,8 @@ def clean_setup(node_objects):
 
 def update_emane(save_file, subnets, nodes, node_objects):
     configure(save_file, subnets, nodes)
-    threads = []
-    for node in node_objects:
-        new_thread = threading.Thread(target=node.setup_emane, args=(save_file,))
-        threads.append(new_thread)
-        new_thread.start()
-    for t in threads:
-        t.join()
+    results = functions.run_on_nodes(node_objects, "setup_emane", args=(save_file,))
+    functions.print_node_results(results, "update_emane")
 
 
 def change_tx_rate():
@@ -339,14 +335,10 @@ def push_config(node_objects, file_name=None, dest_file_name=None):
         dest_file_name = input("Enter filename to save as (blank for gvine.conf.json): ")
         dest_file_name = dest_file_name if dest_file_name else "gvine.conf.json"
     print("Pushing ./autotestfiles/" + file_name + " to nodes as ~/gvinetest/gvine.conf.json")
-    threads = []
-    for node in node_objects:
-        new_thread = threading.Thread(target=node.push_file, args=(path_to_conf, node.gvine_path,
-                                                                   dest_file_name))
-        threads.append(new_thread)
-        new_thread.start()
-    for t in threads:
-        t.join()
+    push_conf = lambda node: node.push_file(path_to_conf, node.gvine_path, dest_file_name,
+                                           sync=True)
+    results = functions.run_on_nodes(node_objects, push_conf)
+    functions.print_node_results(results, "pushconfig")
 
 
 def push_file(node_objects):
@@ -355,19 +347,40 @@ def push_file(node_objects):
     file_name = input("Input file name (blank for unchanged): ")
     src_path = path.expanduser(src_path)
 
-    threads = []
+    dest_paths = []
     for node in node_objects:
         if(dest_path == "1"):
-            dest_path = node.gvine_path + file_name
+            dest_paths.append(node.gvine_path + file_name)
         elif(dest_path == "2"):
-            dest_path = node.topo_dir + file_name
+            dest_paths.append(node.topo_dir + file_name)
         else:
-            dest_path = path.expanduser(dest_path)
-        new_thread = threading.Thread(target=node.push_file, args=(src_path, dest_path,))
-        threads.append(new_thread)
-        new_thread.start()
-    for t in threads:
-        t.join()
+            dest_paths.append(path.expanduser(dest_path))
+    print("Pushing " + src_path + " to nodes")
+    distribute_files(node_objects, transfer.expand_local_glob(src_path), dest_paths)
+
+
+def distribute_files(node_objects, local_paths, dest_paths):
+    """Push the same files to every node, dest_paths[i] is the destination on node_objects[i]
+
+    Big rack clusters get the files relayed node to node (transfer.relay_files) so they only
+    leave this machine once, pi nodes, small clusters and clusters some nodes of which
+    don't have the relay key (setup_relay_key) are pushed to directly.
+    """
+    targets = [(node.ip, node.user_name, dest_path)
+               for node, dest_path in zip(node_objects, dest_paths)]
+    if len(node_objects) >= config.RELAY_MIN_NODES and \
+            all(isinstance(node, RackNode) for node in node_objects) and \
+            transfer.is_relay_configured(targets):
+        methods = transfer.relay_files(targets, local_paths)
+        num_direct = list(methods.values()).count("direct")
+        print("Relayed to " + str(len(methods) - num_direct - 1) + " nodes, pushed directly to "
+              + str(num_direct + 1))
+        return
+    dest_path_of = dict(zip([node.name for node in node_objects], dest_paths))
+    push = lambda node: transfer.put_files(node.ip, node.user_name, [
+        (local_path, dest_path_of[node.name]) for local_path in local_paths])
+    results = functions.run_on_nodes(node_objects, push)
+    functions.print_node_results(results, "push_file")
 
 
 def push_dir(node_objects):
@@ -382,7 +395,8 @@ def push_dir(node_objects):
             dest_path = node.gvine_path
         elif(dest_path == "2"):
             dest_path = node.topo_dir
-        new_thread = threading.Thread(target=node.push_dir, args=(src_path, dest_path, file_name))
+        new_thread = threading.Thread(target=node.push_dir,
+                                      args=(src_path, dest_path, file_name, True))
         threads.append(new_thread)
         new_thread.start()
     for t in threads:
@@ -413,15 +427,9 @@ def gvpki(node_objects):
         t.join()
     sleep(3)
 
-    push_threads = []
     print("Pushing certs")
-    for node in node_objects:
-        new_thread = threading.Thread(target=node.push_certs, args=("./keystore/*",))
-        push_threads.append(new_thread)
-        new_thread.start()
-    for t in push_threads:
-        t.join()
-    sleep(3)
+    distribute_files(node_objects, transfer.expand_local_glob("./keystore/*"),
+                     [node.gvine_path for node in node_objects])
 
     load_threads = []
     print("Loading certs")
@@ -436,9 +444,8 @@ def gvpki(node_objects):
 
 def gvpki_push_load(node_objects):
     print("Pushing certs")
-    for node in node_objects:
-        node.push_certs("./keystore/*")
-    sleep(2)
+    distribute_files(node_objects, transfer.expand_local_glob("./keystore/*"),
+                     [node.gvine_path for node in node_objects])
     print("Loading certs")
     for node in node_objects:
         node.load_certs(len(node_objects))
@@ -467,26 +474,16 @@ def remove_error_rate(subnets, nodes, iplist):
 
 
 def reset_iptables(node_objects):
-    threads = []
-    for node in node_objects:
-        new_thread = threading.Thread(target=node.reset_iptables, args=())
-        threads.append(new_thread)
-        new_thread.start()
-    for t in threads:
-        t.join()
+    results = functions.run_on_nodes(node_objects, "reset_iptables")
+    functions.print_node_results(results, "reset_iptables")
     print("Done.")
 
 
 # Synchronizes rackspace nodes (not sure what it does, soroush had it),
 # then runs emane_start.sh on each rackspace node in the topology
 def start(save_file, node_objects):
-    threads = []
-    for node in node_objects:
-        new_thread = threading.Thread(target=node.start, args=(save_file,))
-        threads.append(new_thread)
-        new_thread.start()
-    for t in threads:
-        t.join()
+    results = functions.run_on_nodes(node_objects, "start", args=(save_file,))
+    functions.print_node_results(results, "start")
     print("Done.")
 
 
@@ -602,13 +599,8 @@ def start_norm(iplist, subnets, nodes):
 
 # Runs emane_stop.sh on each rackspace node in the topology
 def stop(node_objects):
-    threads = []
-    for node in node_objects:
-        new_thread = threading.Thread(target=node.stop, args=(SAVE_FILE,))
-        threads.append(new_thread)
-        new_thread.start()
-    for t in threads:
-        t.join()
+    results = functions.run_on_nodes(node_objects, "stop", args=(SAVE_FILE,))
+    functions.print_node_results(results, "stop")
     print("Done.")
 
 
@@ -1043,62 +1035,84 @@ def stats_emane(save_file, node_objects):
     # Create directory for stats to go in
     functions.create_dir("./stats/emane/" + save_file)
 
+    rack_nodes = [node for node in node_objects if isinstance(node, RackNode)]
+
     print("\nGenerating EMANE statistics")
-    threads = []
-    for node in node_objects:
-        if isinstance(node, RackNode):
-            new_thread = threading.Thread(target=node.generate_emane_stats, args=(save_file,))
-            threads.append(new_thread)
-            new_thread.start()
-    for t in threads:
-        t.join()
+    results = functions.run_on_nodes(rack_nodes, "generate_emane_stats", args=(save_file,))
+    functions.print_node_results(results, "generate_emane_stats")
 
     print("\nCopying EMANE statistics to this computer")
-    threads = []
-    for node in node_objects:
-        if isinstance(node, RackNode):
-            new_thread = threading.Thread(target=node.copy_emane_stats, args=(save_file,))
-            threads.append(new_thread)
-            new_thread.start()
-    for t in threads:
-        t.join()
+    results = functions.run_on_nodes(rack_nodes, "copy_emane_stats", args=(save_file,))
+    functions.print_node_results(results, "copy_emane_stats")
     print("Done.")
 
 
-def stats_events(save_file, node_objects):
+def stats_events(save_file, node_objects, incremental=False):
+    """Gather every node's event database and combine them
+
+    :param incremental: merge into one database per test run (named after the nodes'
+    eventlogs folder) that only gains the events since the last pull, for pulling
+    repeatedly during a long test, instead of a new database each time
+    """
     print("Creating stats directories")
     functions.create_dir("./stats/")
     functions.create_dir("./stats/events")
     functions.create_dir("./stats/events/" + save_file)
     functions.create_dir("./stats/events/" + save_file + "/nodedata/")
 
-    print("\nGathering Event data")
-    for node in node_objects:
-        node.generate_event_db()
-    sleep(2)
-
-    print("\nCopying Event data")
+    print("\nGathering and copying Event data")
     statsuite.clear_node_event_data(save_file)
-    for node in node_objects:
-        node.copy_event_db(save_file)
+    results = functions.run_on_nodes(node_objects, collect_event_db, args=(save_file,))
+    functions.print_node_results(results, "collect_event_db")
 
     print("\nCombining Event data")
     input_dir = "./stats/events/" + save_file + "/nodedata/"
     output_dir = "./stats/events/" + save_file + "/"
-    statsuite.combine_event_dbs(input_dir, output_dir)
+    db_name = None
+    if incremental:
+        run_names = [result["value"] for result in results.values() if result["status"] == "ok"]
+        if not run_names:
+            print("No event databases were collected")
+            return
+        db_name = max(set(run_names), key=run_names.count)
+    return statsuite.combine_event_dbs(input_dir, output_dir, db_name)
+
+
+def collect_event_db(node, save_file):
+    """Generate a node's event database and copy it here as soon as dbreader.jar is done
 
+    :return: the node's eventlogs folder, which names the test run
+    """
+    run_name = node.generate_event_db()
+    node.copy_event_db(save_file)
+    return run_name
 
-def stats_tcpdump(node_objects, folder_name=SAVE_FILE):
+
+def stats_tcpdump(node_objects, folder_name=SAVE_FILE, full_pcaps=False):
+    """Pull per-second packet summaries made on the nodes into a new dump folder
+
+    :param full_pcaps: copy every node's whole capture instead of summarizing on the node
+    """
     functions.create_dir("./stats/")
     functions.create_dir("./stats/dumps/")
     functions.create_dir("./stats/dumps/" + folder_name)
     output_dir = "./stats/dumps/" + folder_name + "/"
+    if not full_pcaps:
+        return statsuite.copy_dump_summaries(node_objects, output_dir)
     dump_folder = statsuite.copy_dump_files(node_objects, output_dir)
     map_path = dump_folder + "ipmap"
     statsuite.make_ipmap(node_objects, map_path)
+    packetsuite.make_packet_store(dump_folder)
     return dump_folder
 
 
+def stats_live(node_objects, duration=None):
+    """Show each node's traffic by packet type while a test is running, see telemetry.py"""
+    print("Getting interface ips")
+    ipmap = statsuite.get_ipmap(node_objects)
+    return telemetry.watch_cluster(node_objects, ipmap, duration)
+
+
 def pull_logfiles(node_objects):
     node_list = []
     try:
@@ -1146,14 +1160,14 @@ def pull_logfiles(node_objects):
 def print_scapy_packet(chosen_save):
     dump_dirs = glob("./stats/dumps/" + chosen_save + "/*")
     chosen_dir = functions.choose_alphabetic_path(dump_dirs)
-    pcap_files = glob(chosen_dir + "/*.pcap")
+    pcap_files = packetsuite.get_pcap_paths(chosen_dir)
     chosen_pcap = pcap_files[0]
-    packets = rdpcap(chosen_pcap)
+    packets = packetsuite.load_pcap(chosen_pcap)
     chosen_packet = packets[0]
     packetsuite.useful_functions(chosen_packet)
     packetsuite.test_packet_functions(chosen_packet)
     for pcap in pcap_files:
-        packet_list = rdpcap(pcap)
+        packet_list = packetsuite.load_pcap(pcap)
         packetsuite.test_list_of_packets(packet_list)
 
 
@@ -1204,43 +1218,41 @@ def jupyter_pcap_graphs():
         folder_path = paths[index]
         print("PCAP folder path: " + folder_path)
         print("\n".join(statsuite.read_params(folder_path)))
-        seconds_dict = packetsuite.make_type_packets_dict(chosen_dir=folder_path)
-        graphsuite.plot_type_direction(seconds_dict, "sent", bucket_size, False, "tx_each_second")
-        graphsuite.plot_type_direction(seconds_dict, "received", bucket_size, False,
-                                       "rx_each_second")
-        graphsuite.plot_type_direction(seconds_dict, "sent", bucket_size, True, "tx_cumulative")
-        graphsuite.plot_type_direction(seconds_dict, "received", bucket_size, True, "rx_cumulative")
+        histogram = packetsuite.make_packets_histogram(folder_path)
+        graphsuite.plot_type_histogram(histogram, "tx", bucket_size, 0, "tx_each_second")
+        graphsuite.plot_type_histogram(histogram, "rx", bucket_size, 0, "rx_each_second")
+        graphsuite.plot_type_histogram(histogram, "tx", bucket_size, 1, "tx_cumulative")
+        graphsuite.plot_type_histogram(histogram, "rx", bucket_size, 1, "rx_cumulative")
 
 
 def stats_basic_packets(chosen_save=None):
-    chosen_dir = ""
+    chosen_dir = None
     if(chosen_save is not None):
         dump_dirs = glob("./stats/dumps/" + chosen_save + "/*")
         chosen_dir = functions.choose_alphabetic_path(dump_dirs)
 
     init_notebook_mode(connected=True)
-    seconds_dict = packetsuite.make_basic_packets_dict(chosen_dir)
-    graphsuite.plot_basic_direction(seconds_dict, "tx", False, "Sent Cumulative")
-    graphsuite.plot_basic_direction(seconds_dict, "rx", False, "Received Cumulative")
-    graphsuite.plot_basic_direction(seconds_dict, "tx", True, "Sent Average")
-    graphsuite.plot_basic_direction(seconds_dict, "rx", True, "Received Average")
+    histogram = packetsuite.make_packets_histogram(chosen_dir)
+    graphsuite.plot_basic_histogram(histogram, "tx", False, "Sent Cumulative")
+    graphsuite.plot_basic_histogram(histogram, "rx", False, "Received Cumulative")
+    graphsuite.plot_basic_histogram(histogram, "tx", True, "Sent Average")
+    graphsuite.plot_basic_histogram(histogram, "rx", True, "Received Average")
 
 
 def stats_basic_packets_combined(chosen_save=None):
-    chosen_dir = ""
+    chosen_dir = None
     if(chosen_save is not None):
         dump_dirs = glob("./stats/dumps/" + chosen_save + "/*")
         chosen_dir = functions.choose_alphabetic_path(dump_dirs)
 
     init_notebook_mode(connected=True)
-    seconds_dict = packetsuite.make_basic_packets_dict(chosen_dir)
-    combined_dict = packetsuite.make_basic_combined_dict(seconds_dict)
-    graphsuite.plot_basic_combined_direction(combined_dict, "tx", True, False, "Unicast")
-    graphsuite.plot_basic_combined_direction(combined_dict, "tx", False, True, "Tx Cumulative")
-    # graphsuite.plot_basic_combined_direction(combined_dict, "sent", False, False, "Tx Per Second")
-    graphsuite.plot_basic_combined_direction(combined_dict, "rx", True, False, "Rx Average")
-    graphsuite.plot_basic_combined_direction(combined_dict, "rx", False, True, "Rx Cumulative")
-    # graphsuite.plot_basic_combined_direction(combined_dict, "received", False, False, "Rx Per Second")
+    histogram = packetsuite.make_packets_histogram(chosen_dir)
+    graphsuite.plot_basic_combined_histogram(histogram, "tx", True, False, "Unicast")
+    graphsuite.plot_basic_combined_histogram(histogram, "tx", False, True, "Tx Cumulative")
+    # graphsuite.plot_basic_combined_histogram(histogram, "tx", False, False, "Tx Per Second")
+    graphsuite.plot_basic_combined_histogram(histogram, "rx", True, False, "Rx Average")
+    graphsuite.plot_basic_combined_histogram(histogram, "rx", False, True, "Rx Cumulative")
+    # graphsuite.plot_basic_combined_histogram(histogram, "rx", False, False, "Rx Per Second")
 
 
 def stats_type_packets(chosen_save=None):
@@ -1251,13 +1263,13 @@ def stats_type_packets(chosen_save=None):
 
     init_notebook_mode(connected=True)
     bucket_size = int(input("Bucket Size? : "))
-    seconds_dict = packetsuite.make_type_packets_dict(chosen_dir)
-    graphsuite.plot_type_direction(seconds_dict, "tx", bucket_size, False, False, "tx_each_second")
-    graphsuite.plot_type_direction(seconds_dict, "rx", bucket_size, False, False, "rx_each_second")
-    graphsuite.plot_type_direction(seconds_dict, "tx", bucket_size, True, False, "tx_cumulative")
-    graphsuite.plot_type_direction(seconds_dict, "rx", bucket_size, True, False, "rx_cumulative")
-    graphsuite.plot_type_direction(seconds_dict, "tx", bucket_size, False, True, "tx_average")
-    graphsuite.plot_type_direction(seconds_dict, "rx", bucket_size, False, True, "rx_average")
+    histogram = packetsuite.make_packets_histogram(chosen_dir)
+    graphsuite.plot_type_histogram(histogram, "tx", bucket_size, 0, "tx_each_second")
+    graphsuite.plot_type_histogram(histogram, "rx", bucket_size, 0, "rx_each_second")
+    graphsuite.plot_type_histogram(histogram, "tx", bucket_size, 1, "tx_cumulative")
+    graphsuite.plot_type_histogram(histogram, "rx", bucket_size, 1, "rx_cumulative")
+    graphsuite.plot_type_histogram(histogram, "tx", bucket_size, 2, "tx_average")
+    graphsuite.plot_type_histogram(histogram, "rx", bucket_size, 2, "rx_average")
 
 
 def pcap_to_sql(save):
@@ -1269,13 +1281,20 @@ def pcap_to_sql(save):
 def stats_single_graph(save, download=False, refactor=False):
     dump_dirs = glob("./stats/dumps/" + save + "/*")
     chosen_dir = functions.choose_alphabetic_path(dump_dirs)
-    num_nodes = len(glob(chosen_dir + "/*.cap") + glob(chosen_dir + "/*.pcap"))
+    db_path = chosen_dir + "/" + "packets.db"
+    num_nodes = packetsuite.get_dump_num_nodes(chosen_dir)
+    if num_nodes == 0 and not path.exists(db_path):
+        print("ERROR: No captures or pcap summaries in " + chosen_dir)
+        return
     node_number = input("Graph for which node id (1-" + str(num_nodes) + "): ")
     bucket_size = int(input("Bucket Size? : "))
-    db_path = chosen_dir + "/" + "packets.db"
     node_name = NODE_PREFIX + node_number
 
-    packetsuite.make_packets_database(chosen_dir)
+    try:
+        seconds_dict = packetsuite.make_single_dict(node_name, db_path, refactor)
+    except (IOError, ValueError) as error:
+        print("ERROR: " + str(error))
+        return
 
     # Setup to download graphs
     functions.create_dir("./graphs")
@@ -1290,7 +1309,6 @@ def stats_single_graph(save, download=False, refactor=False):
     ]
 
     init_notebook_mode(connected=True)
-    seconds_dict = packetsuite.make_single_dict(node_name, db_path, refactor)
     for cnfg in graph_configs:
         graphsuite.plot_type_direction(seconds_dict, cnfg[0], bucket_size, cnfg[1], cnfg[2], download)
 
@@ -1321,18 +1339,19 @@ def stats_single_graph(save, download=False, refactor=False):
 def stats_multiple_graphs(save, download=False, refactor=False):
     dump_dirs = glob("./stats/dumps/" + save + "/*")
     chosen_dir = functions.choose_alphabetic_path(dump_dirs)
-    num_nodes = functions.get_num_pcap_nodes(chosen_dir)
+    db_path = chosen_dir + "/" + "packets.db"
+    num_nodes = packetsuite.get_dump_num_nodes(chosen_dir)
+    if num_nodes == 0 and not path.exists(db_path):
+        print("ERROR: No captures or pcap summaries in " + chosen_dir)
+        return
     node_list = functions.get_node_list(num_nodes)
     bucket_size = int(input("Bucket Size? : "))
-    db_path = chosen_dir + "/" + "packets.db"
     if download:
         pdf_name = input("Name of pdf file?: ")
         if len(pdf_name) < 5 or pdf_name[-4:] != ".pdf":
             pdf_name = pdf_name + ".pdf"
         print(pdf_name)
 
-    packetsuite.make_packets_database(chosen_dir)
-
     # Setup to download graphs
     functions.create_dir("./graphs")
 
@@ -1351,7 +1370,11 @@ def stats_multiple_graphs(save, download=False, refactor=False):
     pdf_list = []
     for node_number in node_list:
         node_name = NODE_PREFIX + str(node_number)
-        seconds_dict = packetsuite.make_single_dict(node_name, db_path, refactor)
+        try:
+            seconds_dict = packetsuite.make_single_dict(node_name, db_path, refactor)
+        except (IOError, ValueError) as error:
+            print("ERROR: " + str(error))
+            continue
         for cnfg in graph_configs:
             graphsuite.plot_type_direction(seconds_dict, cnfg[0], bucket_size, cnfg[1], cnfg[2], download)
 
@@ -1396,9 +1419,11 @@ def stats_overhead_calc(save):
     chosen_dir = functions.choose_alphabetic_path(dump_dirs)
     db_path = chosen_dir + "/" + "packets.db"
 
-    packetsuite.make_packets_database(chosen_dir)
-
-    total_tx = packetsuite.count_total_tx(db_path)
+    try:
+        total_tx = packetsuite.count_total_tx(db_path)
+    except IOError as error:
+        print("ERROR: " + str(error))
+        return
     print("Total tx is " + str(total_tx))
 
 
@@ -1408,10 +1433,13 @@ def stats_overhead_all(save):
         save = other_save
     dump_dirs = glob("./stats/dumps/" + save + "/*")
     for db_path in dump_dirs:
-        packetsuite.make_packets_database(db_path)
         packet_db = db_path + "/packets.db"
-        total_tx = packetsuite.count_total_tx(packet_db)
         folder_name = db_path.split("/")[-1]
+        try:
+            total_tx = packetsuite.count_total_tx(packet_db)
+        except IOError as error:
+            print("ERROR: " + str(error))
+            continue
         print("Folder " + folder_name + " has total tx of " + str(total_tx))
 
 
@@ -1433,7 +1461,7 @@ def stats_type_comparison(save, download=False):
             trace_names_dict[chosen_path] = trace_name
         user_input = input("Choose path (alphabetic a-z 0-" + num + ") (blank to end) : ")
 
-    num_nodes = len(glob(chosen_dirs[0] + "/*.cap") + glob(chosen_dirs[0] + "/*.pcap"))
+    num_nodes = packetsuite.get_dump_num_nodes(chosen_dirs[0])
     node_number = input("Graph for which node id (1-" + str(num_nodes) + "): ")
     bucket_size = int(input("Bucket Size? : "))
     db_paths = [chosen_dir + "/packets.db" for chosen_dir in chosen_dirs]
@@ -1441,8 +1469,13 @@ def stats_type_comparison(save, download=False):
                         trace_names_dict.items()}
     node_name = NODE_PREFIX + node_number
 
-    for chosen_dir in chosen_dirs:
-        packetsuite.make_packets_database(chosen_dir)
+    seconds_dicts = {}
+    for db_path in db_paths:
+        try:
+            seconds_dicts[db_path] = packetsuite.make_single_dict(node_name, db_path)
+        except (IOError, ValueError) as error:
+            print("ERROR: " + str(error))
+            return
 
     # Setup to download graphs
     functions.create_dir("./graphs")
@@ -1469,7 +1502,7 @@ def stats_type_comparison(save, download=False):
         color_index += 1
         color_index = color_index % len(constants.GRAPH_COLORS)
         graph_color = constants.GRAPH_COLORS[color_index]
-        seconds_dict = packetsuite.make_single_dict(node_name, db_path)
+        seconds_dict = seconds_dicts[db_path]
         for packet_type in constants.PACKET_TYPES:
             for cnfg in graph_configs:
                 traces[packet_type][cnfg[2]][db_path] = \
@@ -1479,18 +1512,18 @@ def stats_type_comparison(save, download=False):
     graphsuite.plot_type_comparison(traces, graph_configs)
 
 def stats_packet_node(save):
-    pcap_path = functions.get_single_node_pcap(save, NODE_PREFIX)
+    try:
+        pcap_path = functions.get_single_node_pcap(save, NODE_PREFIX)
+    except IOError as error:
+        print("ERROR: " + str(error))
+        return
     node_dict = packetsuite.read_pcap(pcap_path)
     print(pcap_path)
     for direction in node_dict.keys():
         print("  " + direction + ": ")
         for packet_type in node_dict[direction].keys():
-            packet_list = node_dict[direction][packet_type]
-            sum = 0
-            for packet in packet_list:
-                num_bytes = len(packet)
-                sum += num_bytes
-            print("    " + packet_type + ": " + str(sum))
+            packet_records = node_dict[direction][packet_type]
+            print("    " + packet_type + ": " + str(int(packet_records["length"].sum())))
 
 
 def stats_packet_statistics(chosen_save=None):
@@ -1500,37 +1533,29 @@ def stats_packet_statistics(chosen_save=None):
     else:
         dump_dirs = packetsuite.get_dump_timestamp_dirs()
         chosen_dir = functions.choose_timestamp_path(dump_dirs)
-    num_nodes = len(glob(chosen_dir))
-    node_dict = packetsuite.get_pcap_node_dict(chosen_dir, num_nodes)
-
-    totals_dict = {
-        "tx": {
-            "beacon": 0,
-            "handshake": 0,
-            "babel": 0,
-            "payload": 0
-        },
-        "rx": {
-            "beacon": 0,
-            "handshake": 0,
-            "babel": 0,
-            "payload": 0
-        }
-    }
+    # The captures or, after stats_tcpdump, the pcap summaries
+    try:
+        histogram = packetsuite.make_packets_histogram(chosen_dir)
+    except IOError as error:
+        print("ERROR: " + str(error))
+        return
+    seconds_dict = packetsuite.make_type_seconds_dict(histogram)
+
+    totals_dict = {}
+    for direction in ("tx", "rx"):
+        totals_dict[direction] = {}
+        for packet_type in constants.PACKET_TYPES:
+            totals_dict[direction][packet_type] = 0
 
     # individual byte amounts
-    for node_name in node_dict.keys():
+    for node_name in histogram["nodes"]:
         print(node_name + ": ")
-        for direction in node_dict[node_name].keys():
+        for direction in totals_dict.keys():
             print("  " + direction + ": ")
-            for packet_type in node_dict[node_name][direction].keys():
-                packet_list = node_dict[node_name][direction][packet_type]
-                sum = 0
-                for packet in packet_list:
-                    num_bytes = len(packet)
-                    sum += num_bytes
-                    totals_dict[node_name][direction][packet_type] += num_bytes
-                print("    " + packet_type + ": " + str(sum))
+            for packet_type in totals_dict[direction].keys():
+                num_bytes = int(sum(seconds_dict[direction][packet_type][node_name].values()))
+                totals_dict[direction][packet_type] += num_bytes
+                print("    " + packet_type + ": " + str(num_bytes))
 
     # total bytes amounts
     for direction in totals_dict.keys():
@@ -1646,13 +1671,8 @@ def clean(node_objects, amt=None):
         clean_amount = int(input("Clean 1) Data 2) Non certs 3) All non .jar : "))
     else:
         clean_amount = amt
-    threads = []
-    for node in node_objects:
-        new_thread = threading.Thread(target=node.clean_gvine, args=(clean_amount,))
-        threads.append(new_thread)
-        new_thread.start()
-    for t in threads:
-        t.join()
+    results = functions.run_on_nodes(node_objects, "clean_gvine", args=(clean_amount,))
+    functions.print_node_results(results, "clean")
     print("Cleaned.")
 
 
@@ -1675,8 +1695,12 @@ def delete(save_file):
 
 
 # Kills EVERY rackspace node
-def kill():
+def kill(node_objects):
     functions.kill_all_instances()
+    # Instances made later may get the same ips, their files aren't the ones we synced
+    for node in node_objects:
+        if isinstance(node, RackNode):
+            transfer.forget_node(node.ip, node.user_name)
 
 
 def usage():
@@ -1697,6 +1721,7 @@ def usage():
     setup["txrate"] = "Change gvine.conf.json TargetTxRateBps"
     setup["fragsize"] = "Change gvine.conf.json FragmentSize"
     setup["gvpki"] = "reload node certifications"
+    setup["relaykey"] = "install the key nodes relay pushes to each other with"
     setup["seterrorrate"] = "set error rate for nodes"
     setup["removeerrorrate"] = "remove error rate for nodes"
 
@@ -1723,6 +1748,7 @@ def usage():
     data["data"] = "print data"
     data["stats"] = "save statistics"
     data["stats_events"] = "get events from nodes and combine into single sqlite db"
+    data["stats_events_incremental"] = "add new events from nodes to this test run's sqlite db"
     data["delays"] = "save grapevine delay statistics"
     data["txpackets"] = "graph sent packets"
     data["rxpackets"] = "graph received packets"
@@ -17,6 +17,45 @@ REMOTE_EMANE_DIR = "~/GrapeVine/topologies/" + SAVE_FILE + "/"
 
 RACK_KEY = "mykey"
 
+# Persistent ssh connections used by functions.remote_execute, see sshpool.py
+SSH_KEY_PATH = "~/.ssh/id_rsa"
+SSH_CONNECT_TIMEOUT_SECONDS = 30
+SSH_KEEPALIVE_SECONDS = 30
+SSH_IDLE_TIMEOUT_SECONDS = 300
+
+# Whole-cluster commands, see functions.run_on_nodes
+NODE_THREAD_LIMIT = 32
+NODE_TIMEOUT_SECONDS = 600
+NODE_RETRIES = 0
+
+# Parallel SFTP channels per node for file transfers, see transfer.py
+TRANSFER_STREAMS = 4
+# gzip level used on the node when pulling pcaps and event dbs
+TRANSFER_COMPRESS_LEVEL = 3
+# Pushes to at least RELAY_MIN_NODES rack nodes upload once and relay node to node. The
+# nodes log into each other with the relay key (setup installs it, see
+# transfer.deploy_relay_key), without it the files are pushed to every node directly
+RELAY_MIN_NODES = 4
+RELAY_KEY_PATH = "./.relay_key"
+RELAY_REMOTE_KEY_PATH = ".ssh/grapevine_relay"
+# Forward this machine's ssh-agent to relaying nodes instead, any rack node can then log in
+# with our keys while a push runs
+RELAY_FORWARD_AGENT = False
+RELAY_SCP_OPTIONS = "-o BatchMode=yes -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null"
+# Remote content hashes per node, lets sync pushes skip unchanged files
+SYNC_MANIFEST_PATH = ".sync.pickle"
+
+# Worker processes for parsing pcaps in packetsuite, None uses every core
+PCAP_PROCESSES = None
+
+# Parsed captures kept across dump dirs, least recently used evicted past the size limit
+CAPTURE_CACHE_DIR = "./stats/cache/"
+CAPTURE_CACHE_MAX_MB = 2048
+
+# Live traffic view (stats_live): seconds averaged over and seconds between redraws
+TELEMETRY_WINDOW = 30
+TELEMETRY_REFRESH = 1
+
 JAR_FILE = "gvine_r504.jar"
 REFACTOR_JAR = "c2net.jar"
 REFACTOR_API_JAR = "GvineApiClient.jar"
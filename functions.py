@@ -8,6 +8,7 @@
 # generating files, etc.
 
 # System Imports
+from collections import OrderedDict
 from json import loads
 from math import asin, cos, sqrt
 from os import listdir, makedirs, path, system
@@ -15,8 +16,11 @@ from shutil import copy
 from subprocess import call, Popen, PIPE, DEVNULL
 from time import sleep, time
 from re import compile, match, split, sub
+from shlex import quote
 from glob import glob
 import threading
+import queue
+import socket
 
 # Third Party Imports
 from paramiko import AutoAddPolicy, RSAKey, SSHClient
@@ -25,11 +29,14 @@ from pyrebase import initialize_app
 
 # Local Imports
 import config
+import sshpool
 from constants import EMANE_FREQS
 
 SUCCESS = '\033[92m'
 FAIL = '\033[91m'
 ENDCOLOR = '\033[0m'
+BATCH_MARKER = "@@RACKSUITE_BATCH"
+STREAM_POLL_SECONDS = 0.5
 
 ##### LOCAL DATA PERSISTENCE #####
 
@@ -1015,49 +1022,152 @@ def remote_remove_error_rate(ip, error_rate, command_template):
 
 
 def remote_execute(command, ip, remote_username, print_stdout=False, print_stderr=False):
-    loc = path.expanduser("~/.ssh/id_rsa")
-    key = RSAKey.from_private_key_file(loc)
-    ssh = SSHClient()
-    ssh.set_missing_host_key_policy(AutoAddPolicy())
-    ssh.connect(ip, username=remote_username, pkey=key)
-    stdin, stdout, stderr = ssh.exec_command(command)
-    if(print_stdout):
-        print(stdout.read().decode())
-    if(print_stderr):
-        print(stderr.read().decode())
-    exit_status = stdout.channel.recv_exit_status()
-    ssh.close()
+    with sshpool.connection(ip, remote_username) as ssh:
+        stdin, stdout, stderr = sshpool.exec_command(ssh, ip, remote_username, command)
+        # Read alongside stdout, a command filling the window with stderr would block
+        stderr_reader = sshpool.StderrReader(stdout.channel, limit=None) \
+            if print_stdout or print_stderr else None
+        if(print_stdout):
+            for line in stream_channel(stdout.channel):
+                print(line)
+        exit_status = stdout.channel.recv_exit_status()
+        if(print_stderr):
+            print(stderr_reader.get_output())
     return exit_status
 
 
 def remote_execute_stdout(command, ip, username):
-    loc = path.expanduser("~/.ssh/id_rsa")
-    key = RSAKey.from_private_key_file(loc)
-    ssh = SSHClient()
-    ssh.set_missing_host_key_policy(AutoAddPolicy())
-    ssh.connect(ip, username=username, pkey=key)
-    stdin, stdout, stderr = ssh.exec_command(command)
-    stdout_decoded = stdout.read().decode()
-    ssh.close()
+    with sshpool.connection(ip, username) as ssh:
+        stdin, stdout, stderr = sshpool.exec_command(ssh, ip, username, command)
+        stdout_decoded = stdout.read().decode()
     return stdout_decoded
 
 
 def remote_execute_commands(commands, ip, remote_username, print_stdout=False, print_stderr=False,
                             print_exit=False):
-    loc = path.expanduser("~/.ssh/id_rsa")
-    key = RSAKey.from_private_key_file(loc)
-    ssh = SSHClient()
-    ssh.set_missing_host_key_policy(AutoAddPolicy())
-    ssh.connect(ip, username=remote_username, pkey=key)
-    for command in commands:
-        stdin, stdout, stderr = ssh.exec_command(command)
-        if(print_stdout):
-            print(stdout.read().decode())
-        if(print_stderr):
-            print(stderr.read().decode())
-        if(print_exit):
-            print(stdout.channel.recv_exit_status())
-    ssh.close()
+    with sshpool.connection(ip, remote_username) as ssh:
+        for command in commands:
+            stdin, stdout, stderr = sshpool.exec_command(ssh, ip, remote_username, command)
+            if(print_stdout):
+                print(stdout.read().decode())
+            if(print_stderr):
+                print(stderr.read().decode())
+            if(print_exit):
+                print(stdout.channel.recv_exit_status())
+
+def remote_execute_stream(command, ip, remote_username, lines=True, chunk_size=32768,
+                          stop_event=None, combine_stderr=False, get_pty=False):
+    """Generator yielding a remote command's stdout as it arrives
+
+    Nothing is buffered beyond the ssh channel window, so a slow consumer makes the remote
+    command block on write instead of piling output up in memory. Closing the generator, or
+    setting stop_event, closes the channel and the remote command gets SIGPIPE (or SIGHUP
+    with get_pty) the next time it writes.
+
+    :param lines: yield decoded lines without the newline, otherwise raw byte chunks
+    :param chunk_size: max bytes read from the channel at once
+    :param stop_event: threading.Event that cancels the stream when set
+    :param combine_stderr: interleave stderr with stdout, otherwise stderr is read and
+    dropped so it never fills the channel window
+    :param get_pty: run the command in a pty, for commands that need one to exit on hangup
+    """
+    with sshpool.connection(ip, remote_username) as ssh:
+        channel = sshpool.open_session(ssh, ip, remote_username)
+        try:
+            if get_pty:
+                channel.get_pty()
+            channel.set_combine_stderr(combine_stderr)
+            channel.exec_command(command)
+            if not combine_stderr:
+                sshpool.StderrReader(channel)
+            for output in stream_channel(channel, lines, chunk_size, stop_event):
+                yield output
+        finally:
+            channel.close()
+
+
+def stream_channel(channel, lines=True, chunk_size=32768, stop_event=None):
+    if stop_event is not None:
+        # Wake up periodically to check if the stream was cancelled
+        channel.settimeout(STREAM_POLL_SECONDS)
+    partial = b""
+    while stop_event is None or not stop_event.is_set():
+        try:
+            chunk = channel.recv(chunk_size)
+        except socket.timeout:
+            continue
+        if not chunk:
+            break
+        if not lines:
+            yield chunk
+            continue
+        partial += chunk
+        complete = partial.split(b"\n")
+        partial = complete.pop()
+        for line in complete:
+            yield line.decode(errors="replace")
+    if lines and partial:
+        yield partial.decode(errors="replace")
+
+
+def remote_execute_batch(commands, ip, remote_username, stop_on_failure=False):
+    """Run an ordered list of commands on one node in a single round trip
+
+    The commands are sent as one bash script over one channel. Each command runs in its own
+    subshell with stdin from /dev/null, so it behaves like a separate remote_execute call.
+
+    :param commands: list of shell commands, run in order
+    :param stop_on_failure: don't run the rest of the commands after a non-zero exit status
+    :return: list of {"command", "exit_status", "stdout", "stderr"} for each command that ran
+    """
+    script = make_batch_script(commands, stop_on_failure)
+    with sshpool.connection(ip, remote_username) as ssh:
+        stdin, stdout, stderr = sshpool.exec_command(ssh, ip, remote_username,
+                                                     "bash -c " + quote(script))
+        output = stdout.read()
+        stdout.channel.recv_exit_status()
+    return parse_batch_output(commands, output)
+
+
+def make_batch_script(commands, stop_on_failure=False):
+    lines = [
+        'out=$(mktemp) && err=$(mktemp) || exit 1',
+        'trap \'rm -f "$out" "$err"\' EXIT'
+    ]
+    for index in range(len(commands)):
+        lines.append("( " + commands[index] + '\n) </dev/null >"$out" 2>"$err"; rc=$?')
+        lines.append("printf '" + BATCH_MARKER + " %d %d %d %d\\n' " + str(index) +
+                     ' $rc $(wc -c <"$out") $(wc -c <"$err")')
+        lines.append('cat "$out" "$err"')
+        if stop_on_failure:
+            lines.append('[ $rc -eq 0 ] || exit 0')
+    return "\n".join(lines) + "\n"
+
+
+def parse_batch_output(commands, output):
+    """Split the output of a make_batch_script script back into per-command results
+
+    Every command's output is prefixed by a header line with its index, exit status and the
+    byte lengths of its stdout and stderr, so output containing the marker can't confuse it.
+    """
+    results = []
+    position = 0
+    while position < len(output):
+        header_end = output.index(b"\n", position)
+        header = output[position:header_end].decode().split(" ")
+        if header[0] != BATCH_MARKER:
+            raise ValueError("Malformed batch output at byte " + str(position))
+        index, exit_status, out_len, err_len = [int(field) for field in header[1:]]
+        out_start = header_end + 1
+        err_start = out_start + out_len
+        results.append({
+            "command": commands[index],
+            "exit_status": exit_status,
+            "stdout": output[out_start:err_start].decode(errors="replace"),
+            "stderr": output[err_start:err_start + err_len].decode(errors="replace")
+        })
+        position = err_start + err_len
+    return results
 
 ##### MESSAGE SEND TIME ESTIMATION #####
 
@@ -1174,6 +1284,105 @@ def wait_for_threads_finish(threads):
                 threads.remove(curr_thread)
 
 
+def run_on_nodes(node_objects, task, args=(), max_threads=None, timeout=None, retries=None):
+    """Run a task on every node with a bounded number of threads
+
+    A node that passes its deadline is reported as "timeout" and its thread is abandoned, so
+    one stuck node never holds up the rest of the cluster.
+
+    :param node_objects: nodes to run the task on
+    :param task: name of a Node method, or a function called as task(node, *args)
+    :param args: arguments passed to the task after the node
+    :param max_threads: max nodes running at once (default config.NODE_THREAD_LIMIT), at
+    least 1
+    :param timeout: seconds each node gets, retries included (default config.NODE_TIMEOUT_SECONDS)
+    :param retries: times to rerun a task that raised (default config.NODE_RETRIES)
+    :return: results[node_name] = {"status", "value", "error", "attempts", "seconds"}, where
+    status is "ok", "error" or "timeout"
+    """
+    max_threads = max(1, config.NODE_THREAD_LIMIT if max_threads is None else max_threads)
+    timeout = config.NODE_TIMEOUT_SECONDS if timeout is None else timeout
+    retries = config.NODE_RETRIES if retries is None else retries
+
+    results = OrderedDict((node.name, None) for node in node_objects)
+    waiting = list(node_objects)
+    running = {}
+    done_queue = queue.Queue()
+
+    while waiting or running:
+        # Fill any free thread slots
+        while waiting and len(running) < max_threads:
+            node = waiting.pop(0)
+            result = {"status": None, "value": None, "error": None, "attempts": 0,
+                      "seconds": 0}
+            new_thread = threading.Thread(target=run_node_task,
+                                          args=(node, task, args, retries, timeout, result,
+                                                done_queue))
+            new_thread.daemon = True
+            running[node.name] = (time(), result)
+            new_thread.start()
+
+        # Wait for a node to finish, but no longer than the nearest deadline
+        wait_time = None
+        if timeout is not None:
+            nearest_deadline = min(start + timeout for start, result in running.values())
+            wait_time = max(nearest_deadline - time(), 0)
+        try:
+            node_name = done_queue.get(timeout=wait_time)
+            if node_name in running:
+                results[node_name] = running.pop(node_name)[1]
+        except queue.Empty:
+            pass
+
+        # Give up on nodes that are past their deadline
+        if timeout is not None:
+            for node_name in list(running.keys()):
+                start, result = running[node_name]
+                if time() - start >= timeout:
+                    running.pop(node_name)
+                    results[node_name] = {"status": "timeout", "value": None,
+                                          "error": None, "attempts": result["attempts"],
+                                          "seconds": time() - start}
+    return results
+
+
+def run_node_task(node, task, args, retries, timeout, result, done_queue):
+    start = time()
+    while True:
+        result["attempts"] += 1
+        try:
+            if callable(task):
+                result["value"] = task(node, *args)
+            else:
+                result["value"] = getattr(node, task)(*args)
+            result["status"] = "ok"
+            result["error"] = None
+            break
+        except Exception as err:
+            result["status"] = "error"
+            result["error"] = err
+            out_of_time = timeout is not None and time() - start >= timeout
+            if result["attempts"] > retries or out_of_time:
+                break
+            print(node.name + ": " + str(err) + ", retrying")
+    result["seconds"] = time() - start
+    done_queue.put(node.name)
+
+
+def print_node_results(results, task_name):
+    num_ok = len([name for name in results.keys() if results[name]["status"] == "ok"])
+    slowest = max([result["seconds"] for result in results.values()] + [0])
+    for node_name, result in results.items():
+        if result["status"] == "error":
+            print(FAIL + node_name + " " + task_name + " failed after " +
+                  str(result["attempts"]) + " attempt(s): " + str(result["error"]) + ENDCOLOR)
+        elif result["status"] == "timeout":
+            print(FAIL + node_name + " " + task_name + " timed out after " +
+                  "{:.1f}".format(result["seconds"]) + " seconds" + ENDCOLOR)
+    print(task_name + ": " + str(num_ok) + "/" + str(len(results)) + " nodes ok, slowest took " +
+          "{:.1f}".format(slowest) + " seconds")
+
+
 ##### PCAP #####
 
 def get_single_node_pcap(save, prefix):
@@ -1182,6 +1391,9 @@ def get_single_node_pcap(save, prefix):
     num_nodes = len(glob(chosen_dir + "/*")) - 1
     node_id = input("Packet stats for which node id (1-" + str(num_nodes) + "): ")
     pcap_paths = glob(chosen_dir + "/" + prefix + node_id + "_*")
+    if not pcap_paths:
+        raise IOError("No capture of " + prefix + node_id + " in " + chosen_dir +
+                      ", this needs the captures pulled with stats_tcpdump_full")
     return pcap_paths[0]
 
 
@@ -10,6 +10,7 @@ import plotly
 
 # Local imports
 import statsuite
+import histograms
 from constants import PACKET_COLORS
 
 def make_trace(x_list, y_list, trace_mode, trace_name, show_legend=True, line_width=2,
@@ -155,6 +156,78 @@ def plot_type_direction(buckets_dict, direction, bucket_size, graph_type, graph_
         plotly.offline.iplot(figure)
 
 
+def plot_basic_histogram(histogram, direction, plot_average, graph_title):
+    """Graph cumulative (or average) bytes of each node straight from a histogram
+
+    :param histogram: see histograms.py
+    :param direction: "tx" or "rx"
+    """
+    direction_index = histograms.DIRECTIONS.index(direction)
+    counts = histograms.node_totals(histogram)[:, direction_index]
+    counts = histograms.average(counts) if plot_average else histograms.cumulative(counts)
+    x = list(range(counts.shape[-1]))
+    node_names = histogram["nodes"]
+    subplot_titles = [graph_title + "_" + node_name for node_name in node_names]
+    figure = plotly.tools.make_subplots(rows=len(node_names), cols=1,
+                                        subplot_titles=subplot_titles, print_grid=False)
+    for index, node_name in enumerate(node_names):
+        figure.append_trace(make_trace(x, counts[index].tolist(), "lines", node_name),
+                            index + 1, 1)
+    figure['layout'].update(height=600*len(node_names), width=1000, title=graph_title)
+    plotly.offline.iplot(figure)
+
+
+def plot_basic_combined_histogram(histogram, direction, plot_average, plot_cumulative,
+                                  graph_title):
+    """Graph bytes of every node together straight from a histogram
+
+    :param histogram: see histograms.py
+    :param direction: "tx" or "rx"
+    """
+    counts = histograms.combined_totals(histogram)[histograms.DIRECTIONS.index(direction)]
+    if plot_average:
+        counts = histograms.average(counts)
+    elif plot_cumulative:
+        counts = histograms.cumulative(counts)
+    trace = make_trace(list(range(counts.shape[-1])), counts.tolist(), "lines", graph_title)
+    figure = plotly.tools.make_subplots(rows=1, cols=1, print_grid=False)
+    figure.append_trace(trace, 1, 1)
+    figure['layout'].update(height=600, width=1000, title=graph_title)
+    plotly.offline.iplot(figure)
+
+
+def plot_type_histogram(histogram, direction, bucket_size, graph_type, graph_title,
+                        download=False):
+    """Graph bytes by packet type straight from a histogram, one subplot per node
+
+    :param histogram: see histograms.py
+    :param direction: "tx" or "rx"
+    :param bucket_size: seconds per bucket, a multiple of the histogram's bucket_size
+    :param graph_type: 0 = each bucket, 1 = cumulative, 2 = average
+    """
+    histogram = histograms.rebucket(histogram, bucket_size)
+    direction_index = histograms.DIRECTIONS.index(direction)
+    counts = histograms.get_view(histogram["bytes"][:, direction_index], graph_type)
+    x = list(range(counts.shape[-1]))
+    node_names = histogram["nodes"]
+    subplot_titles = [graph_title + "_" + node_name for node_name in node_names]
+    figure = plotly.tools.make_subplots(rows=len(node_names), cols=1,
+                                        subplot_titles=subplot_titles, print_grid=False)
+    for node_index, node_name in enumerate(node_names):
+        for type_index, packet_type in enumerate(histogram["types"]):
+            if packet_type == histograms.OTHER_TYPE:
+                continue
+            trace = make_trace(x, counts[node_index, type_index].tolist(), "line",
+                               node_name + "_" + packet_type,
+                               line_color=PACKET_COLORS[packet_type])
+            figure.append_trace(trace, node_index + 1, 1)
+    figure['layout'].update(height=600*len(node_names), width=1000, title=graph_title)
+    if download:
+        plotly.offline.iplot(figure, image="png", filename=graph_title)
+    else:
+        plotly.offline.iplot(figure)
+
+
 def make_figure_same_graph(figure, row, col, traces_dict):
     for key in traces_dict.keys():
         figure.append_trace(traces_dict[key], row, col)
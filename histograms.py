@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+# File: histograms.py
+# Author: Luke Thomas
+# Date: April 19, 2018
+# Description: Array backed per-second traffic histograms. Packet columns are binned with
+# numpy into one dense array instead of nested dicts keyed by str(second), and graphsuite
+# plots straight from it.
+#
+# A histogram is a dict:
+#   "nodes": node names, "types": packet type names (PACKET_TYPES + OTHER_TYPE),
+#   "start_time": second 0 in seconds since 1970, "bucket_size": seconds per bucket,
+#   "bytes": int array [node, direction, packet_type, bucket], directions are DIRECTIONS
+
+# System Imports
+from re import search
+
+# Third Party Imports
+import numpy as np
+
+# Local Imports
+from constants import PACKET_TYPES, REFACTOR_PACKET_TYPES
+
+DIRECTIONS = ("tx", "rx")
+# Packets counted towards node totals that aren't one of the GrapeVine PACKET_TYPES
+OTHER_TYPE = "other"
+
+
+##### BUILDING #####
+
+def make_histogram(node_names, type_names, node_index, direction_index, type_index, timestamps,
+                   sizes, start_time, end_time, bucket_size=1):
+    """Bin packet (or pre-aggregated) columns into a histogram
+
+    :param node_index: int array, index into node_names of each row
+    :param direction_index: int array, index into DIRECTIONS
+    :param type_index: int array, index into type_names
+    :param timestamps: int array of seconds since 1970
+    :param sizes: int array of bytes
+    :param start_time: first second of the histogram, rows outside [start_time, end_time] are
+    dropped
+    :return: histogram dict, see the top of this file
+    """
+    num_buckets = max(0, (end_time - start_time) // bucket_size + 1)
+    shape = (len(node_names), len(DIRECTIONS), len(type_names), num_buckets)
+    buckets = (np.asarray(timestamps, dtype=np.int64) - start_time) // bucket_size
+    keep = (buckets >= 0) & (buckets < num_buckets)
+    flat_index = np.ravel_multi_index((np.asarray(node_index)[keep],
+                                       np.asarray(direction_index)[keep],
+                                       np.asarray(type_index)[keep], buckets[keep]), shape)
+    counts = np.bincount(flat_index, weights=np.asarray(sizes, dtype=np.float64)[keep],
+                         minlength=int(np.prod(shape)))
+    return {
+        "nodes": list(node_names),
+        "types": list(type_names),
+        "start_time": start_time,
+        "bucket_size": bucket_size,
+        "bytes": counts.reshape(shape).round().astype(np.int64)
+    }
+
+
+def from_summaries(summaries_dict, earliest_time, latest_time, bucket_size=1, refactor=False):
+    """Histogram of per-node summary rows, see packetsuite.read_pcap_summaries
+
+    :param summaries_dict: summaries_dict[node_name] = rows of (second, direction,
+    packet_type, bytes, packets), packet_type is the raw type byte or None
+    :param refactor: type bytes index REFACTOR_PACKET_TYPES instead of PACKET_TYPES
+    """
+    node_names = sorted(summaries_dict.keys(), key=get_node_number)
+    type_list = REFACTOR_PACKET_TYPES if refactor else PACKET_TYPES
+    type_names = type_list + [OTHER_TYPE]
+    other_index = len(type_list)
+    node_index = []
+    direction_index = []
+    type_index = []
+    timestamps = []
+    sizes = []
+    for index, node_name in enumerate(node_names):
+        for second, direction, packet_type, byte_count, packet_count in summaries_dict[node_name]:
+            node_index.append(index)
+            direction_index.append(DIRECTIONS.index(direction))
+            if not refactor:
+                type_index.append(get_type_index(packet_type, other_index))
+            elif packet_type is None or not 0 <= packet_type < len(type_list):
+                type_index.append(other_index)
+            else:
+                type_index.append(packet_type)
+            timestamps.append(second)
+            sizes.append(byte_count)
+    return make_histogram(node_names, type_names, np.array(node_index, dtype=np.int64),
+                          np.array(direction_index, dtype=np.int64),
+                          np.array(type_index, dtype=np.int64), timestamps, sizes,
+                          earliest_time, latest_time, bucket_size)
+
+
+def from_store(store, bucket_size=1, refactor=False):
+    """Histogram of a packet store, see packetsuite.load_packet_store
+
+    :param refactor: type bytes index REFACTOR_PACKET_TYPES instead of PACKET_TYPES
+    """
+    type_list = REFACTOR_PACKET_TYPES if refactor else PACKET_TYPES
+    packet_types = np.asarray(store["type"], dtype=np.int64)
+    if refactor:
+        type_index = np.where((packet_types < 0) | (packet_types >= len(type_list)),
+                              len(type_list), packet_types)
+    else:
+        # Same as get_type_index
+        type_index = np.where((packet_types < 0) | (packet_types > len(type_list)),
+                              len(type_list), (packet_types - 1) % len(type_list))
+    start_time = store["first_second"]
+    end_time = store["last_second"]
+    if start_time is None:
+        start_time, end_time = 0, -1
+    return make_histogram(store["nodes"], type_list + [OTHER_TYPE], store["node"],
+                          store["direction"], type_index,
+                          np.floor(store["timestamp"]).astype(np.int64), store["bytes"],
+                          start_time, end_time, bucket_size)
+
+
+def get_type_index(packet_type, other_index):
+    """Index into PACKET_TYPES the way packetsuite.get_gvine_packet_type maps type bytes"""
+    if packet_type is None or packet_type > len(PACKET_TYPES):
+        return other_index
+    # Type byte 0 wraps to the last type, same as PACKET_TYPES[packet_type - 1]
+    return (packet_type - 1) % len(PACKET_TYPES)
+
+
+def get_node_number(node_name):
+    match = search(r'\d+$', node_name)
+    return int(match.group()) if match else 0
+
+
+##### VIEWS #####
+
+def rebucket(histogram, bucket_size):
+    """Histogram with wider buckets, bucket_size must be a multiple of the current one"""
+    factor = bucket_size // histogram["bucket_size"]
+    if factor <= 1:
+        return histogram
+    counts = histogram["bytes"]
+    padding = -counts.shape[-1] % factor
+    counts = np.concatenate([counts, np.zeros(counts.shape[:-1] + (padding,), np.int64)], -1)
+    rebucketed = dict(histogram)
+    rebucketed["bucket_size"] = bucket_size
+    rebucketed["bytes"] = counts.reshape(counts.shape[:-1] + (-1, factor)).sum(axis=-1)
+    return rebucketed
+
+
+def select_nodes(histogram, node_names):
+    """Histogram of just node_names"""
+    selected = dict(histogram)
+    selected["nodes"] = list(node_names)
+    selected["bytes"] = histogram["bytes"][[histogram["nodes"].index(node_name)
+                                            for node_name in node_names]]
+    return selected
+
+
+def node_totals(histogram):
+    """[node, direction, bucket] bytes over every packet type"""
+    return histogram["bytes"].sum(axis=2)
+
+
+def combined_totals(histogram):
+    """[direction, bucket] bytes over every node and packet type"""
+    return histogram["bytes"].sum(axis=(0, 2))
+
+
+def cumulative(counts):
+    """Running total along the bucket (last) axis"""
+    return np.cumsum(counts, axis=-1)
+
+
+def average(counts):
+    """Running average per bucket along the bucket (last) axis"""
+    return np.cumsum(counts, axis=-1) / np.arange(1, counts.shape[-1] + 1)
+
+
+def get_view(counts, graph_type):
+    """graph_type like graphsuite: 0 = each bucket, 1 = cumulative, 2 = average"""
+    if graph_type == 1:
+        return cumulative(counts)
+    elif graph_type == 2:
+        return average(counts)
+    return counts
+
+
+##### DICTS #####
+
+def to_basic_dict(histogram):
+    """:return: seconds_dict[node_name][direction][str(bucket)] = bytes"""
+    totals = node_totals(histogram)
+    seconds_dict = {}
+    for node_index, node_name in enumerate(histogram["nodes"]):
+        seconds_dict[node_name] = {}
+        for direction_index, direction in enumerate(DIRECTIONS):
+            row = totals[node_index, direction_index].tolist()
+            seconds_dict[node_name][direction] = {str(bucket): row[bucket]
+                                                  for bucket in range(len(row))}
+    return seconds_dict
+
+
+def to_type_dict(histogram):
+    """:return: seconds_dict[direction][packet_type][node_name][str(bucket)] = bytes, for the
+    GrapeVine PACKET_TYPES only"""
+    counts = histogram["bytes"]
+    seconds_dict = {}
+    for direction_index, direction in enumerate(DIRECTIONS):
+        seconds_dict[direction] = {}
+        for type_index, packet_type in enumerate(histogram["types"]):
+            if packet_type == OTHER_TYPE:
+                continue
+            seconds_dict[direction][packet_type] = {}
+            for node_index, node_name in enumerate(histogram["nodes"]):
+                row = counts[node_index, direction_index, type_index].tolist()
+                seconds_dict[direction][packet_type][node_name] = {
+                    str(bucket): row[bucket] for bucket in range(len(row))}
+    return seconds_dict
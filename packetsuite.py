@@ -5,21 +5,30 @@
 # Date: August 10, 2017
 
 # System Imports
-from os import path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count, getpid, makedirs, path, remove, replace, stat, utime
+import gzip
+import hashlib
+import json
 import logging
 from glob import glob
-from sqlite3 import connect, IntegrityError, DatabaseError
+from sqlite3 import connect, DatabaseError
 from time import sleep
+from zipfile import BadZipFile
 
 # Third Party Imports
 from re import sub
 import pickle
+import numpy as np
 
 # Local Imports
 import config
 import statsuite
 import graphsuite
 import constants
+import histograms
+import pcapreader
 from functions import choose_timestamp_path
 
 # This suppresses warning messages produced by scapy on module load
@@ -35,6 +44,28 @@ PACKET_BABEL = 4
 PACKET_TYPES = constants.PACKET_TYPES
 REFACTOR_PACKET_TYPES = constants.REFACTOR_PACKET_TYPES
 derpderpderp = False
+PACKETS_DB_CACHE_KB = 262144
+# Bytes hashed at each end of what was ingested from a capture, see get_capture_fingerprint
+FINGERPRINT_BYTES = 65536
+PCAP_HEADER_SIZE = pcapreader.PCAP_HEADER_SIZE
+# Direction codes from IpClassifier, TX/RX index histograms.DIRECTIONS
+DIRECTION_TX = 0
+DIRECTION_RX = 1
+DIRECTION_INVALID = 2
+# Packet store layout, one .npy per column, see load_packet_store
+PACKET_STORE_VERSION = 1
+PACKET_STORE_COLUMNS = [
+    ("timestamp", np.float64),
+    ("node", np.uint16),
+    ("direction", np.uint8),
+    ("type", np.int16),
+    ("bytes", np.uint32)
+]
+# What read_pcap keeps of each packet, see make_packet_records
+PACKET_RECORD_DTYPE = np.dtype([
+    ("time", np.float64),
+    ("length", np.uint32)
+])
 
 ##### TCPDUMP ANALYSIS #####
 
@@ -42,94 +73,304 @@ def get_dump_timestamp_dirs():
     return glob("./stats/dumps/" + SAVE_FILE + "/*")
 
 
+def get_pcap_paths(dump_dir):
+    """Captures in a dump dir, including the gzipped ones from Node.retrieve_pcaps"""
+    return glob(dump_dir + "/*.cap") + glob(dump_dir + "/*.pcap") + glob(dump_dir + "/*.pcap.gz")
+
+
+def require_pcap_paths(dump_dir):
+    """get_pcap_paths for what needs the whole captures, an IOError if there are none"""
+    pcap_paths = get_pcap_paths(dump_dir)
+    if not pcap_paths:
+        raise IOError("No captures in " + dump_dir + ", this needs the captures pulled with "
+                      "stats_tcpdump_full")
+    return pcap_paths
+
+
+def get_dump_node_names(dump_dir):
+    """Nodes with captures or, if there are none, pcap summaries in dump_dir"""
+    file_paths = get_pcap_paths(dump_dir) or get_summary_paths(dump_dir)
+    return sorted(set(get_pcap_node_name(file_path) for file_path in file_paths),
+                  key=statsuite.get_trailing_number)
+
+
+def get_dump_num_nodes(dump_dir):
+    """Highest node number of get_dump_node_names, 0 if there are none"""
+    node_names = get_dump_node_names(dump_dir)
+    return statsuite.get_trailing_number(node_names[-1]) if node_names else 0
+
+
+def load_pcap(pcap_path):
+    """rdpcap that also reads .gz captures without unpacking them to disk"""
+    if pcap_path.endswith(".gz"):
+        with gzip.open(pcap_path, "rb") as file:
+            return rdpcap(file)
+    return rdpcap(pcap_path)
+
+
 def get_pcap_node_dict(dump_dir, num_nodes):
-    cap_paths = glob(dump_dir + "/*.cap") + glob(dump_dir + "/*.pcap")
+    """read_pcap of every capture in dump_dir, a node's interfaces are merged
+
+    :return: node_dict[node_name][direction][packet_type] = packet records
+    """
     node_dict = make_empty_node_dict(num_nodes)
-    for path in cap_paths:
-        node_name = path.split("/")[-1].split(".")[0]
-        node_dict[node_name] = read_pcap(path)
+    for pcap_path in sorted(require_pcap_paths(dump_dir)):
+        node_name = get_pcap_node_name(pcap_path)
+        pcap_dict = read_pcap(pcap_path)
+        if node_name not in node_dict:
+            node_dict[node_name] = pcap_dict
+            continue
+        for direction in pcap_dict:
+            for packet_type in pcap_dict[direction]:
+                node_dict[node_name][direction][packet_type] = concatenate_packet_records(
+                    [node_dict[node_name][direction][packet_type],
+                     pcap_dict[direction][packet_type]])
     return node_dict
 
 
 def read_pcap(pcap_path):
     """Read GrapeVine pcap file and parse packets by direction and packet type
 
+    Only the time and length of each packet are kept, in a numpy record array per
+    direction and type (12 bytes a packet), so the captures of a whole cluster fit in
+    memory. len() is the number of packets, records["length"].sum() the bytes and each
+    row has .time and .length.
+
     :param pcap_path: Path to the pcap file to be parsed
-    :return: node_dict[direction][packet_type] = packets
+    :return: node_dict[direction][packet_type] = packet records, see make_packet_records
     """
-    ipmap = statsuite.read_ipmap(chosen_dir + "/ipmap")
-    node_name = pcap_path.split("/")[-1].split(".")[0]
-    node_dict = {}
-    node_dict["tx"] = {}
-    node_dict["rx"] = {}
-    for direction in node_dict.keys():
+    classifier = load_ip_classifier(path.dirname(pcap_path))
+    node_number = statsuite.get_trailing_number(get_pcap_node_name(pcap_path))
+    times = {}
+    lengths = {}
+    for direction in histograms.DIRECTIONS:
         for packet_type in PACKET_TYPES:
-            node_dict[direction][packet_type] = []
+            times[direction, packet_type] = []
+            lengths[direction, packet_type] = []
     # Fill dictionary
-    packets = rdpcap(pcap_path)
-    for packet in packets:
+    for packet in pcapreader.read_records(pcap_path):
+        if pcapreader.is_dhcp(packet):
+            continue
         try:
             type = get_gvine_packet_type(packet)
         except:
             print("ERROR: PACKET WITHOUT A PAYLOAD")
             continue
-        direction = "rx"
-        if is_packet_sender(packet, statsuite.get_trailing_number(node_name), ipmap):
-            direction = "tx"
-        node_dict[direction][type].append(packet)
+        direction = classifier.get_direction(packet.src_ip, node_number)
+        if direction == DIRECTION_INVALID:
+            continue
+        key = (histograms.DIRECTIONS[direction], type)
+        times[key].append(packet.time)
+        lengths[key].append(packet.length)
+    node_dict = {direction: {} for direction in histograms.DIRECTIONS}
+    for direction, packet_type in times:
+        node_dict[direction][packet_type] = make_packet_records(
+            times[direction, packet_type], lengths[direction, packet_type])
     return node_dict
 
 
+def make_packet_records(times, lengths):
+    """Record array of PACKET_RECORD_DTYPE, one row per packet"""
+    records = np.zeros(len(times), dtype=PACKET_RECORD_DTYPE)
+    records["time"] = times
+    records["length"] = lengths
+    return records.view(np.recarray)
+
+
+def concatenate_packet_records(records_list):
+    """Packet records in order, empty lists (see make_empty_node_dict) are skipped"""
+    records_list = [records for records in records_list if len(records)]
+    if not records_list:
+        return make_packet_records([], [])
+    return np.concatenate(records_list).view(np.recarray)
+
+
 def make_packets_database(dump_dir):
+    """Load the captures of dump_dir into dump_dir/packets.db
+
+    Ingestion is incremental: ingested_files records how far into each capture the packets
+    table goes and a fingerprint of what was read, so re-running only parses records
+    appended since, and a capture is re-ingested from scratch only if it changed.
+    """
     db_path = dump_dir + "/packets.db"
-    if path.exists(db_path):
-        #print(db_path + " already exists, returning")
-        return
     connection = connect(db_path)
+    # Bulk load settings, the database is rebuilt from the pcaps if a crash corrupts it
+    connection.execute("PRAGMA journal_mode=WAL;")
+    connection.execute("PRAGMA synchronous=OFF;")
+    connection.execute("PRAGMA cache_size=-" + str(PACKETS_DB_CACHE_KB) + ";")
+    create_packets_tables(connection)
+    insert_stmt = "INSERT INTO packets (senderid, receiverid, packettype, bytesize, " \
+                  "timestamp, sourcefile) VALUES (?, ?, ?, ?, ?, ?);"
+
+    ingested = {row[0]: row[1:] for row in connection.execute(
+        "SELECT sourcefile, offset, size, mtime_ns, fingerprint FROM ingested_files;")}
+    pcap_paths = sorted(get_pcap_paths(dump_dir))
+    source_files = [path.basename(pcap_path) for pcap_path in pcap_paths]
+    file_stats = [stat(pcap_path) for pcap_path in pcap_paths]
+    start_offsets = [get_ingest_offset(pcap_path, file_stat, ingested.get(source_file))
+                     for pcap_path, source_file, file_stat in
+                     zip(pcap_paths, source_files, file_stats)]
+    work = [index for index in range(len(pcap_paths)) if start_offsets[index] is not False]
+
+    classifier = load_ip_classifier(dump_dir)
+    # Parsed in parallel, inserted in file order
+    results = map_pcap_files(get_packet_rows, [pcap_paths[index] for index in work],
+                             [classifier] * len(work), [start_offsets[index] for index in work])
+    with connection:
+        for source_file in set(ingested.keys()) - set(source_files):
+            # Capture was deleted
+            delete_source_file(connection, source_file)
+        for index, (rows, end_offset, fingerprint) in zip(work, results):
+            print("working on " + get_pcap_node_name(pcap_paths[index]))
+            if source_files[index] in ingested and \
+                    start_offsets[index] in (None, PCAP_HEADER_SIZE):
+                # Changed, not just appended to
+                delete_source_file(connection, source_files[index])
+            connection.executemany(insert_stmt, [row + (source_files[index],) for row in rows])
+            connection.execute("INSERT OR REPLACE INTO ingested_files (sourcefile, offset, "
+                               "size, mtime_ns, fingerprint) VALUES (?, ?, ?, ?, ?);",
+                               (source_files[index], end_offset, file_stats[index].st_size,
+                                file_stats[index].st_mtime_ns, fingerprint))
+    # Cheaper to build once the rows are in than to maintain during the first load
+    create_packets_indexes(connection)
+    connection.close()
 
-    table_cmd = "CREATE TABLE IF NOT EXISTS packets (senderid TEXT, receiverid TEXT, " \
-                   "packettype INTEGER NOT NULL, bytesize INTEGER NOT NULL, timestamp INTEGER NOT NULL);"
-    connection.execute(table_cmd)
-    insert_template = "INSERT INTO packets (senderid, receiverid, packettype, bytesize, " \
-                      "timestamp) VALUES ("
-
-    ipmap = statsuite.read_ipmap(dump_dir + "/ipmap")
-    for pcap_path in glob(dump_dir + "/*.cap") + glob(dump_dir + "/*.pcap"):
-        node_name = pcap_path.split("/")[-1].split(".")[0].split("_")[0]
-        print("working on " + node_name)
-        node_number = statsuite.get_trailing_number(node_name)
-        packets = rdpcap(pcap_path)
-        for packet in packets:
-            is_sender = is_packet_sender(packet, node_number, ipmap)
-            senderid = "'" + node_name + "'" if is_sender else "NULL"
-            # TODO the lines below were duplicating sent packets
-            # if senderid == "NULL":
-            #     sender_ip = packet.getlayer(IP).src
-            #     senderid = "'" + get_sender_name(sender_ip, ipmap) + "'"
-            receiverid = "'" + node_name + "'" if not is_sender else "NULL"
-            if packet.haslayer(DHCP):
-                continue
-            try:
-                packettype = packet.load[3]
-            except AttributeError as err:
-                print(str(err))
-                print(str(packet.display()))
-                continue
 
-            if packettype < 0 or packettype > len(PACKET_TYPES) + 5:
-                continue  # not a correct packet
-            bytesize = len(packet)
-            timestamp = int(packet.time)
-            insert_values = senderid + ", " + receiverid + ", " + str(packettype) +\
-                            ", " + str(bytesize) + ", " + str(timestamp)
-            insert_stmt = insert_template + insert_values + ");"
-            try:
-                connection.execute(insert_stmt)
-            except IntegrityError as error:
-                print(str(error))
-                pass
-    connection.commit()
-    connection.close()
+def create_packets_tables(connection):
+    """Create the packets and ingested_files tables, replacing a packets table from before
+    ingestion was tracked since its rows can't be matched to their captures"""
+    tables = [row[0] for row in
+              connection.execute("SELECT name FROM sqlite_master WHERE type='table';")]
+    with connection:
+        if "packets" in tables and "ingested_files" not in tables:
+            connection.execute("DROP TABLE packets;")
+        connection.execute("CREATE TABLE IF NOT EXISTS packets (senderid TEXT, receiverid TEXT, "
+                           "packettype INTEGER NOT NULL, bytesize INTEGER NOT NULL, "
+                           "timestamp INTEGER NOT NULL, sourcefile TEXT NOT NULL);")
+        # offset: where the next unread record starts, NULL for captures that are always
+        # read whole (pcapng and .gz), fingerprint: see get_capture_fingerprint
+        connection.execute("CREATE TABLE IF NOT EXISTS ingested_files (sourcefile TEXT "
+                           "PRIMARY KEY, offset INTEGER, size INTEGER NOT NULL, "
+                           "mtime_ns INTEGER NOT NULL, fingerprint TEXT NOT NULL);")
+
+
+def delete_source_file(connection, source_file):
+    connection.execute("DELETE FROM packets WHERE sourcefile=?;", (source_file,))
+    connection.execute("DELETE FROM ingested_files WHERE sourcefile=?;", (source_file,))
+
+
+def get_ingest_offset(pcap_path, file_stat, ingested_file):
+    """Where to start reading a capture for make_packets_database
+
+    :param ingested_file: (offset, size, mtime_ns, fingerprint) from ingested_files or None
+    :return: False if it is up to date, the offset to read appended records from, or
+    PCAP_HEADER_SIZE/None to (re)read all of it, None for captures that can't be read
+    from an offset
+    """
+    start_offset = PCAP_HEADER_SIZE if pcapreader.is_mappable(pcap_path) else None
+    if ingested_file is None:
+        return start_offset
+    offset, size, mtime_ns, fingerprint = ingested_file
+    if file_stat.st_size == size and file_stat.st_mtime_ns == mtime_ns:
+        return False
+    if start_offset is None or offset is None or file_stat.st_size < offset:
+        return start_offset
+    if get_capture_fingerprint(pcap_path, offset) != fingerprint:
+        return start_offset
+    return offset
+
+
+def get_capture_fingerprint(pcap_path, end_offset):
+    """sha1 of the start of a capture and of the bytes just before end_offset
+
+    Cheap to check however big the capture is. A capture that was replaced or rewritten
+    differs in its first packets or where the last ingest stopped, one that only had
+    records appended matches.
+    """
+    sha1 = hashlib.sha1()
+    with open(pcap_path, "rb") as file:
+        sha1.update(file.read(min(FINGERPRINT_BYTES, end_offset)))
+        tail_offset = max(FINGERPRINT_BYTES, end_offset - FINGERPRINT_BYTES)
+        file.seek(tail_offset)
+        sha1.update(file.read(max(0, end_offset - tail_offset)))
+    sha1.update(str(end_offset).encode())
+    return sha1.hexdigest()
+
+
+def create_packets_indexes(connection):
+    """Indexes for make_single_dict's node filters and min/max(timestamp) and type queries"""
+    with connection:
+        connection.execute("CREATE INDEX IF NOT EXISTS packets_sender ON packets "
+                           "(senderid, timestamp);")
+        connection.execute("CREATE INDEX IF NOT EXISTS packets_receiver ON packets "
+                           "(receiverid, timestamp);")
+        connection.execute("CREATE INDEX IF NOT EXISTS packets_type ON packets "
+                           "(packettype, timestamp);")
+        connection.execute("CREATE INDEX IF NOT EXISTS packets_timestamp ON packets "
+                           "(timestamp);")
+
+
+def get_packet_rows(pcap_path, classifier, start_offset=None):
+    """Rows of the packets table for one capture, runs in a worker process
+
+    :param start_offset: offset to read appended records from, see
+    pcapreader.read_appended_records, None reads the whole capture
+    :return: list of (senderid, receiverid, packettype, bytesize, timestamp), offset after
+    the last complete record (None if start_offset is None), fingerprint of what was read
+    """
+    node_name = get_pcap_node_name(pcap_path)
+    node_number = statsuite.get_trailing_number(node_name)
+    end_offset = start_offset
+    if start_offset is None:
+        records = pcapreader.read_records(pcap_path)
+    else:
+        records = pcapreader.read_appended_records(pcap_path, start_offset)
+    rows = []
+    for packet in records:
+        if start_offset is not None:
+            packet, end_offset = packet
+        direction = classifier.get_direction(packet.src_ip, node_number)
+        if direction == DIRECTION_INVALID:
+            continue
+        senderid = node_name if direction == DIRECTION_TX else None
+        # TODO the lines below were duplicating sent packets
+        # if senderid is None:
+        #     senderid = get_sender_name(packet.src, ipmap)
+        receiverid = node_name if direction == DIRECTION_RX else None
+        if pcapreader.is_dhcp(packet):
+            continue
+        packettype = packet.packet_type
+        if packettype is None:
+            continue
+
+        if packettype < 0 or packettype > len(PACKET_TYPES) + 5:
+            continue  # not a correct packet
+        rows.append((senderid, receiverid, packettype, packet.length, int(packet.time)))
+    fingerprint_offset = end_offset if end_offset is not None else stat(pcap_path).st_size
+    return rows, end_offset, get_capture_fingerprint(pcap_path, fingerprint_offset)
+
+
+def get_pcap_node_name(pcap_path):
+    """node1 for .../node1_emane0.pcap, .../node1.pcap.gz etc"""
+    return pcap_path.split("/")[-1].split("_")[0].split(".")[0]
+
+
+def map_pcap_files(function, *iterables):
+    """Generator like map() over per-capture arguments in a pool of PCAP_PROCESSES processes
+
+    Results come back in input order whichever process finishes first. Only twice as many
+    captures as there are processes are parsed ahead of the caller, so however many
+    captures there are only a few results are held at once.
+    """
+    num_processes = config.PCAP_PROCESSES or cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=num_processes) as executor:
+        pending = deque()
+        for arguments in zip(*iterables):
+            pending.append(executor.submit(function, *arguments))
+            if len(pending) >= 2 * num_processes:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 
 def get_sender_name(ip_address, ipmap):
@@ -145,7 +386,7 @@ def read_pcap_bytes(pcap_path):
         for packet_type in PACKET_TYPES:
             node_dict[direction][packet_type] = 0
     # Fill dictionary
-    packets = rdpcap(pcap_path)
+    packets = pcapreader.read_records(pcap_path)
     for packet in packets:
         try:
             type = get_gvine_packet_type(packet)
@@ -153,13 +394,13 @@ def read_pcap_bytes(pcap_path):
             print("ERROR: PACKET WITHOUT A PAYLOAD")
             continue
         direction = "rx"
-        if(packet[IP].src.split(".")[-1] == str(statsuite.get_trailing_number(node_name))):
+        if(str(packet.src).split(".")[-1] == str(statsuite.get_trailing_number(node_name))):
             direction = "tx"
         node_dict[direction][type].append(packet)
 
 
 def get_pcap_packets(path):
-    return rdpcap(path)
+    return load_pcap(path)
 
 
 def get_packet_counts(node_dict):
@@ -170,12 +411,11 @@ def get_packet_counts(node_dict):
     num_packets_dict["babel"] = 0
     num_packets_dict["sent"] = 0
     num_packets_dict["received"] = 0
-    for direction in ("sent", "received"):
-        for type in node_dict[direction].keys():
-            packet = node_dict[direction][type]
-            packet_type = get_gvine_packet_type(packet)
-            num_packets_dict[direction] += len(packet)
-            num_packets_dict[packet_type] += len(packet)
+    for direction, category in (("tx", "sent"), ("rx", "received")):
+        for packet_type in node_dict[direction].keys():
+            num_packets = len(node_dict[direction][packet_type])
+            num_packets_dict[category] += num_packets
+            num_packets_dict[packet_type] += num_packets
     return num_packets_dict
 
 
@@ -237,10 +477,10 @@ def get_sql_node_dict(path_to_input, num_nodes):
     node_dict = make_empty_node_dict(num_nodes)
     for type in received_dict.keys():
         for row in received_dict[type]:
-            node_dict[row[0]]["received"][type].append(row)
+            node_dict[row[0]]["rx"][type].append(row)
     for type in sent_dict.keys():
         for row in sent_dict[type]:
-            node_dict[row[0]]["sent"][type].append(row)
+            node_dict[row[0]]["tx"][type].append(row)
     return node_dict
 
 
@@ -288,39 +528,7 @@ def make_basic_packets_dict(chosen_dir=""):
     if not chosen_dir:
         dump_dirs = get_dump_timestamp_dirs()
         chosen_dir = choose_timestamp_path(dump_dirs)
-    pcap_files = glob(chosen_dir + "/*.pcap")
-    ipmap = statsuite.read_ipmap(chosen_dir + "/ipmap")
-    packets_dict = {}
-
-    for pcap_path in pcap_files:
-        node_name = pcap_path.split("/")[-1].split("_")[0]
-        if "." in node_name:
-            node_name = node_name.split(".")[0]
-        if node_name not in packets_dict.keys():
-            packets_dict[node_name] = rdpcap(pcap_path)
-        else:
-            packets_dict[node_name] += rdpcap(pcap_path)
-    earliest_time, latest_time = get_earliest_latest_packet(packets_dict)
-    seconds_dict = {}
-    for node_name in packets_dict.keys():
-        seconds_dict[node_name] = {}
-        seconds_dict[node_name]["tx"] = {}
-        seconds_dict[node_name]["rx"] = {}
-        for second in range(latest_time - earliest_time + 1):
-            seconds_dict[node_name]["tx"][str(int(second))] = 0
-            seconds_dict[node_name]["rx"][str(int(second))] = 0
-        for packet in packets_dict[node_name]:
-            second = int(packet.time - earliest_time)
-            if(second < latest_time - earliest_time):
-                is_sender = is_packet_sender(packet, statsuite.get_trailing_number(node_name), ipmap)
-                if is_sender == "NOTVALID":
-                    continue
-                # elif not packet.haslayer(UDP):
-                #     print("passing non-UDP packet")
-                #     continue
-                direction = "tx" if is_sender else "rx"
-                seconds_dict[node_name][direction][str(second)] += len(packet)
-    return seconds_dict
+    return make_basic_seconds_dict(make_packets_histogram(chosen_dir))
 
 
 def make_basic_combined_dict(seconds_dict):
@@ -345,44 +553,327 @@ def make_type_packets_dict(chosen_dir=None):
     if(chosen_dir is None):
         dump_dirs = get_dump_timestamp_dirs()
         chosen_dir = choose_timestamp_path(dump_dirs)
-    pcap_files = glob(chosen_dir + "/*.pcap")
-    ipmap = statsuite.read_ipmap(chosen_dir + "/ipmap")
-    packets_dict = {}
-
-    for pcap_path in pcap_files:
-        node_name = pcap_path.split("/")[-1].split("_")[0]
-        if node_name not in packets_dict.keys():
-            packets_dict[node_name] = rdpcap(pcap_path)
-        else:
-            packets_dict[node_name] += rdpcap(pcap_path)
-    earliest_time, latest_time = get_earliest_latest_packet(packets_dict)
-    seconds_dict = make_bucket_template(packets_dict.keys(), earliest_time, latest_time)
-    for node_name in packets_dict.keys():
-        for packet in packets_dict[node_name]:
-            is_sender = is_packet_sender(packet, statsuite.get_trailing_number(node_name), ipmap)
-            if is_sender == "NOTVALID":
-                continue
-            elif not packet.haslayer(UDP):
-                print("passing non-UDP packet")
+    return make_type_seconds_dict(make_packets_histogram(chosen_dir))
+
+
+##### PCAP SUMMARIES #####
+
+def get_summary_paths(dump_dir):
+    """Per-node summaries pulled by stats_tcpdump, see pcapsummary.py"""
+    return glob(dump_dir + "/*.summary")
+
+
+def read_pcap_summary(summary_path):
+    """Read a summary written by pcapsummary.py
+
+    :return: first_second, last_second, rows of (second, direction, packet_type, bytes,
+    packets), packet_type is None for packets without a GrapeVine payload
+    """
+    with open(summary_path, "r") as file:
+        lines = file.read().splitlines()
+    if not lines or not lines[0].startswith("# pcapsummary ") or lines[-1] != "# end":
+        raise ValueError(summary_path + " is not a complete pcap summary")
+    header = lines[0].split()
+    first_second = None if header[4] == "-" else int(header[4])
+    last_second = None if header[5] == "-" else int(header[5])
+    rows = []
+    for line in lines[1:-1]:
+        second, direction, packet_type, byte_count, packet_count = line.split()
+        packet_type = None if packet_type == "-" else int(packet_type)
+        rows.append((int(second), direction, packet_type, int(byte_count), int(packet_count)))
+    return first_second, last_second, rows
+
+
+def read_pcap_summaries(chosen_dir):
+    """Return summaries_dict[node_name] = rows, earliest_time, latest_time over all nodes"""
+    summaries_dict = {}
+    earliest_time = 99999999999999
+    latest_time = -1
+    for summary_path in get_summary_paths(chosen_dir):
+        node_name = summary_path.split("/")[-1].split(".")[0]
+        first_second, last_second, rows = read_pcap_summary(summary_path)
+        if first_second is None:
+            continue
+        summaries_dict[node_name] = rows
+        earliest_time = min(earliest_time, first_second)
+        latest_time = max(latest_time, last_second)
+    return summaries_dict, earliest_time, latest_time
+
+
+def make_packets_histogram(chosen_dir=None, bucket_size=1, refactor=False):
+    """Histogram of a dump dir, see histograms.py
+
+    Read from the packet store if the captures were pulled, otherwise from the per-node
+    summaries stats_tcpdump pulled.
+
+    :param refactor: type bytes index REFACTOR_PACKET_TYPES instead of PACKET_TYPES
+    """
+    if chosen_dir is None:
+        dump_dirs = get_dump_timestamp_dirs()
+        chosen_dir = choose_timestamp_path(dump_dirs)
+    make_packet_store(chosen_dir)
+    if has_packet_store(chosen_dir):
+        return histograms.from_store(load_packet_store(chosen_dir), bucket_size, refactor)
+    if not get_summary_paths(chosen_dir):
+        raise IOError("No captures or pcap summaries in " + chosen_dir)
+    summaries_dict, earliest_time, latest_time = read_pcap_summaries(chosen_dir)
+    return histograms.from_summaries(summaries_dict, earliest_time, latest_time, bucket_size,
+                                     refactor)
+
+
+def make_basic_seconds_dict(histogram):
+    """:return: seconds_dict[node_name][direction][second] = bytes"""
+    histogram = dict(histogram)
+    # The last second is only partly captured and always left out of the basic graphs
+    histogram["bytes"] = histogram["bytes"].copy()
+    histogram["bytes"][..., -1:] = 0
+    return histograms.to_basic_dict(histogram)
+
+
+def make_type_seconds_dict(histogram):
+    """:return: seconds_dict[direction][packet_type][node_name][second] = bytes"""
+    return histograms.to_type_dict(histogram)
+
+
+##### PACKET STORE #####
+
+def get_store_path(dump_dir):
+    return dump_dir + "/packets.columns"
+
+
+def make_packet_store(dump_dir):
+    """Write the captures of dump_dir as a columnar packet store, see load_packet_store
+
+    The captures are parsed once, later calls return straight away unless a capture
+    changed since.
+
+    :return: the store's path, None (and nothing written) if dump_dir has no captures
+    """
+    store_path = get_store_path(dump_dir)
+    pcap_paths = sorted(get_pcap_paths(dump_dir))
+    if not pcap_paths:
+        return None
+    sources = {}
+    for pcap_path in pcap_paths:
+        file_stat = stat(pcap_path)
+        sources[path.basename(pcap_path)] = [file_stat.st_size, file_stat.st_mtime_ns]
+    meta = read_store_meta(store_path)
+    if meta is not None and meta["version"] == PACKET_STORE_VERSION and \
+            meta["sources"] == sources:
+        return store_path
+
+    classifier = load_ip_classifier(dump_dir)
+    pcap_nodes = [get_pcap_node_name(pcap_path) for pcap_path in pcap_paths]
+    node_names = sorted(set(pcap_nodes), key=statsuite.get_trailing_number)
+    results = map_pcap_files(get_cached_packet_columns, pcap_paths,
+                             [classifier] * len(pcap_paths))
+    makedirs(store_path, exist_ok=True)
+    # Each capture's columns are appended to raw files as they arrive, not held until the end
+    raw_files = {name: open(store_path + "/" + name + ".raw", "wb")
+                 for name, dtype in PACKET_STORE_COLUMNS}
+    num_rows = 0
+    first_second = None
+    last_second = None
+    try:
+        for node_name, (file_columns, file_first, file_last) in zip(pcap_nodes, results):
+            if file_first is None:
                 continue
-            direction = "tx" if is_sender else "rx"
+            first_second = file_first if first_second is None else min(first_second, file_first)
+            last_second = file_last if last_second is None else max(last_second, file_last)
+            num_file_rows = len(file_columns["timestamp"])
+            file_columns["node"] = np.full(num_file_rows, node_names.index(node_name))
+            for name, dtype in PACKET_STORE_COLUMNS:
+                raw_files[name].write(np.asarray(file_columns[name], dtype=dtype).tobytes())
+            num_rows += num_file_rows
+    finally:
+        for file in raw_files.values():
+            file.close()
+    evict_capture_cache()
+
+    for name, dtype in PACKET_STORE_COLUMNS:
+        raw_path = store_path + "/" + name + ".raw"
+        column = np.lib.format.open_memmap(store_path + "/" + name + ".npy", mode="w+",
+                                           dtype=dtype, shape=(num_rows,))
+        if num_rows:
+            column[:] = np.memmap(raw_path, dtype=dtype, mode="r", shape=(num_rows,))
+        column.flush()
+        del column
+        remove(raw_path)
+    # Written last, a store without it (or with stale sources) gets rebuilt
+    meta = {
+        "version": PACKET_STORE_VERSION,
+        "nodes": node_names,
+        "first_second": first_second,
+        "last_second": last_second,
+        "sources": sources
+    }
+    with open(store_path + "/meta.json.tmp", "w") as file:
+        json.dump(meta, file)
+    replace(store_path + "/meta.json.tmp", store_path + "/meta.json")
+    return store_path
+
+
+def read_store_meta(store_path):
+    try:
+        with open(store_path + "/meta.json", "r") as file:
+            return json.load(file)
+    except (IOError, ValueError):
+        return None
+
+
+def get_packet_columns(pcap_path, classifier):
+    """Packet store columns of one capture, runs in a worker process
+
+    Packets from IPs that aren't nodes are left out, like the pcap summaries.
+
+    :return: {column name: array} without the node column, first and last second of the
+    capture (None if it is empty)
+    """
+    node_number = statsuite.get_trailing_number(get_pcap_node_name(pcap_path))
+    timestamps = []
+    src_ips = []
+    packet_types = []
+    sizes = []
+    first_second = None
+    last_second = None
+    for packet in pcapreader.read_records(pcap_path):
+        second = int(packet.time)
+        first_second = second if first_second is None else min(first_second, second)
+        last_second = second if last_second is None else max(last_second, second)
+        if packet.src_ip is None:
+            continue
+        packet_type = packet.packet_type
+        if packet_type is None or pcapreader.is_dhcp(packet):
+            packet_type = -1
+        timestamps.append(packet.time)
+        src_ips.append(packet.src_ip)
+        packet_types.append(packet_type)
+        sizes.append(packet.length)
+    directions = classifier.get_directions(src_ips, node_number)
+    valid = directions != DIRECTION_INVALID
+    dtypes = dict(PACKET_STORE_COLUMNS)
+    columns = {
+        "timestamp": np.array(timestamps, dtype=dtypes["timestamp"])[valid],
+        "direction": directions[valid],
+        "type": np.array(packet_types, dtype=dtypes["type"])[valid],
+        "bytes": np.array(sizes, dtype=dtypes["bytes"])[valid]
+    }
+    return columns, first_second, last_second
+
+
+def load_packet_store(dump_dir):
+    """Memory map the packet store of dump_dir, nothing is parsed or copied
+
+    :return: {"nodes": node names, "first_second", "last_second", and a read only array
+    per column: "timestamp" (seconds since 1970), "node" (index into nodes), "direction"
+    (index into histograms.DIRECTIONS), "type" (GrapeVine packet type byte, -1 for other
+    packets), "bytes"}
+    """
+    store_path = get_store_path(dump_dir)
+    meta = read_store_meta(store_path)
+    if meta is None:
+        raise IOError("No packet store in " + dump_dir + ", see make_packet_store")
+    store = {
+        "nodes": meta["nodes"],
+        "first_second": meta["first_second"],
+        "last_second": meta["last_second"]
+    }
+    for name, dtype in PACKET_STORE_COLUMNS:
+        store[name] = np.load(store_path + "/" + name + ".npy", mmap_mode="r")
+    return store
+
+
+def has_packet_store(dump_dir):
+    """True for a store of at least one node's captures, empty stores count as missing"""
+    meta = read_store_meta(get_store_path(dump_dir))
+    return meta is not None and meta["version"] == PACKET_STORE_VERSION and \
+        bool(meta["nodes"])
+
+
+##### CAPTURE CACHE #####
+
+def get_cache_key(pcap_path, classifier):
+    """sha1 of everything get_packet_columns' result depends on: the capture's content, the
+    node it belongs to, the ipmap and the parser and store versions"""
+    sha1 = hashlib.sha1()
+    with open(pcap_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1048576), b""):
+            sha1.update(chunk)
+    sha1.update(get_pcap_node_name(pcap_path).encode())
+    sha1.update(classifier.get_key())
+    sha1.update(("parser " + str(pcapreader.PARSER_VERSION) + " store " +
+                 str(PACKET_STORE_VERSION)).encode())
+    return sha1.hexdigest()
+
+
+def get_cached_packet_columns(pcap_path, classifier):
+    """get_packet_columns through the capture cache, runs in a worker process
+
+    Unchanged captures are a cache hit wherever they are, e.g. the same benchmark captures
+    in another dump dir or a dump dir whose packet store was deleted.
+    """
+    cache_path = config.CAPTURE_CACHE_DIR + get_cache_key(pcap_path, classifier) + ".npz"
+    try:
+        with np.load(cache_path) as cached:
+            columns = {name: cached[name] for name in cached.files if name != "seconds"}
+            seconds = cached["seconds"].tolist()
+        # Most recently used is kept longest, see evict_capture_cache
+        utime(cache_path)
+        if not seconds:
+            return columns, None, None
+        return columns, seconds[0], seconds[1]
+    except (IOError, ValueError, KeyError, BadZipFile):
+        pass
+
+    columns, first_second, last_second = get_packet_columns(pcap_path, classifier)
+    seconds = [] if first_second is None else [first_second, last_second]
+    makedirs(config.CAPTURE_CACHE_DIR, exist_ok=True)
+    # Another process may be caching the same capture
+    temp_path = cache_path + "." + str(getpid()) + ".tmp"
+    with open(temp_path, "wb") as file:
+        np.savez(file, seconds=np.array(seconds, dtype=np.int64), **columns)
+    replace(temp_path, cache_path)
+    return columns, first_second, last_second
+
+
+def evict_capture_cache(max_bytes=None):
+    """Delete the least recently used cached captures until the cache fits in max_bytes"""
+    if max_bytes is None:
+        max_bytes = config.CAPTURE_CACHE_MAX_MB * 1024 * 1024
+    entries = []
+    for cache_path in glob(config.CAPTURE_CACHE_DIR + "*.npz"):
+        try:
+            file_stat = stat(cache_path)
+        except IOError:
+            continue
+        entries.append((file_stat.st_mtime, file_stat.st_size, cache_path))
+    total_bytes = 0
+    for mtime, size, cache_path in sorted(entries, reverse=True):
+        total_bytes += size
+        if total_bytes > max_bytes:
             try:
-                packet_type = get_gvine_packet_type(packet)
-            except IndexError:
-                continue
-            except AttributeError:
-                print("pass on bad packet")
-                continue
-            second = int(packet.time - earliest_time)
-            seconds_dict[direction][packet_type][node_name][str(second)] += len(packet)
-    return seconds_dict
+                remove(cache_path)
+            except IOError:
+                pass
 
 
 def make_single_dict(node_name, db_path, refactor=False):
+    """seconds_dict[direction][packet_type][node_name][second] = bytes of one node
+
+    From the captures or pcap summaries of db_path's dump dir, packets.db itself is only
+    read for dump dirs that have neither.
+    """
+    dump_dir = path.dirname(db_path)
+    if has_packet_store(dump_dir) or get_pcap_paths(dump_dir) or get_summary_paths(dump_dir):
+        histogram = make_packets_histogram(dump_dir, refactor=refactor)
+        if node_name not in histogram["nodes"]:
+            raise ValueError("No packets of " + node_name + " in " + dump_dir)
+        return histograms.to_type_dict(histograms.select_nodes(histogram, [node_name]))
+    if not path.exists(db_path):
+        raise IOError("No captures, pcap summaries or packets.db in " + dump_dir)
     conn = connect(db_path)
-    query = "SELECT * from packets where senderid='" + node_name + \
-            "' or receiverid='" + node_name + "';"
-    cursor = conn.execute(query)
+    query = "SELECT * from packets where senderid=? or receiverid=?;"
+    cursor = conn.execute(query, (node_name, node_name))
     table_data = cursor.fetchall()
     earliest_time = conn.execute("select min(timestamp) from packets;").fetchall()[0][0]
     latest_time = conn.execute("select max(timestamp) from packets;").fetchall()[0][0]
@@ -405,16 +896,27 @@ def make_single_dict(node_name, db_path, refactor=False):
 
 
 def count_total_tx(db_path):
+    dump_dir = path.dirname(db_path)
+    if has_packet_store(dump_dir):
+        store = load_packet_store(dump_dir)
+        packet_types = store["type"]
+        # Same packets as the packets table
+        sent = (store["direction"] == DIRECTION_TX) & (packet_types >= 0) & \
+               (packet_types <= len(PACKET_TYPES) + 5)
+        return int(store["bytes"][sent].sum(dtype=np.int64))
+    if not get_pcap_paths(dump_dir) and get_summary_paths(dump_dir):
+        summaries_dict, earliest_time, latest_time = read_pcap_summaries(dump_dir)
+        return sum(byte_count for rows in summaries_dict.values()
+                   for second, direction, packet_type, byte_count, packet_count in rows
+                   if direction == "tx" and packet_type is not None and
+                   0 <= packet_type <= len(PACKET_TYPES) + 5)
+    if not path.exists(db_path):
+        raise IOError("No captures, pcap summaries or packets.db in " + dump_dir)
     conn = connect(db_path)
-    query = "SELECT * from packets where senderid is not null;"
-    cursor = conn.execute(query)
-    table_data = cursor.fetchall()
-
-    sum = 0
-    for row in table_data:
-        bytesize = row[3]
-        sum += bytesize
-    return sum
+    query = "SELECT sum(bytesize) from packets where senderid is not null;"
+    total = conn.execute(query).fetchone()[0]
+    conn.close()
+    return total if total is not None else 0
 
 
 def make_bucket_template(node_names, earliest_time, latest_time, refactor=False):
@@ -451,20 +953,69 @@ def get_earliest_latest_packet(packets_dict):
 
 
 def get_gvine_packet_type(packet):
-    return PACKET_TYPES[packet.load[3] - 1]
+    """:param packet: pcapreader.PcapRecord"""
+    return PACKET_TYPES[packet.packet_type - 1]
     
 
-def is_packet_sender(packet, node_number, ipmap):
-    if ipmap is None:
-        if(str(packet[IP].src.split(".")[-1]) == str(node_number)):
-            return True
-    elif packet.haslayer(IP):
-        if str(packet[IP].src) in ipmap.keys():
-            if(str(ipmap[str(packet[IP].src)]) == str(node_number)):
-                return True
-        else:
-            return "NOTVALID"
-    else:
-        print("No IP layer")
-        return "NOTVALID"
-    return False
+##### IP CLASSIFIER #####
+
+class IpClassifier:
+    """Which node sent a packet, from integer source IPs (PcapRecord.src_ip)
+
+    Built once per dump dir from its ipmap, see load_ip_classifier. Lookups are a dict get
+    for one packet and a binary search over a sorted table for whole arrays of packets.
+    Without an ipmap the last octet of the IP is the node id.
+    """
+    def __init__(self, ipmap):
+        self.by_last_octet = ipmap is None
+        node_ids = {ip_to_int(ip): int(node_id) for ip, node_id in (ipmap or {}).items()}
+        self.node_ids = node_ids
+        self.ips = np.array(sorted(node_ids.keys()), dtype=np.uint32)
+        self.ids = np.array([node_ids[ip] for ip in sorted(node_ids.keys())], dtype=np.int32)
+
+    def get_node_id(self, src_ip):
+        """Node id of a source IP, None if it isn't a node's"""
+        if src_ip is None:
+            return None
+        if self.by_last_octet:
+            return src_ip & 0xff
+        return self.node_ids.get(src_ip)
+
+    def get_direction(self, src_ip, node_number):
+        """DIRECTION_TX/DIRECTION_RX for a packet in node_number's capture, DIRECTION_INVALID
+        if the source isn't a node"""
+        node_id = self.get_node_id(src_ip)
+        if node_id is None:
+            return DIRECTION_INVALID
+        return DIRECTION_TX if node_id == node_number else DIRECTION_RX
+
+    def get_node_ids(self, src_ips):
+        """get_node_id over an array of source IPs, -1 where it isn't a node's"""
+        src_ips = np.asarray(src_ips, dtype=np.uint32)
+        if self.by_last_octet:
+            return (src_ips & 0xff).astype(np.int32)
+        if not len(self.ips):
+            return np.full(len(src_ips), -1, dtype=np.int32)
+        index = np.minimum(np.searchsorted(self.ips, src_ips), len(self.ips) - 1)
+        return np.where(self.ips[index] == src_ips, self.ids[index], -1).astype(np.int32)
+
+    def get_directions(self, src_ips, node_numbers):
+        """get_direction over arrays, node_numbers can be one node number for all of them"""
+        node_ids = self.get_node_ids(src_ips)
+        directions = np.where(node_ids == np.asarray(node_numbers), DIRECTION_TX, DIRECTION_RX)
+        directions[node_ids < 0] = DIRECTION_INVALID
+        return directions.astype(np.uint8)
+
+    def get_key(self):
+        """What the classification depends on, for cache keys"""
+        return str(self.by_last_octet).encode() + self.ips.tobytes() + self.ids.tobytes()
+
+
+def ip_to_int(ip_address):
+    """"11.0.1.2" -> 0x0b000102, like PcapRecord.src_ip"""
+    octets = [int(octet) for octet in ip_address.split(".")]
+    return (octets[0] << 24) | (octets[1] << 16) | (octets[2] << 8) | octets[3]
+
+
+def load_ip_classifier(dump_dir):
+    return IpClassifier(statsuite.read_ipmap(dump_dir + "/ipmap"))
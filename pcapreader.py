@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+
+# File: pcapreader.py
+# Author: Luke Thomas
+# Date: April 17, 2018
+# Description: Minimal libpcap/pcapng reader for GrapeVine captures. Only the link, IPv4
+# and UDP headers and the packet type byte are decoded, which is all packetsuite uses, so
+# it is much faster than scapy's rdpcap. Standard library only because pcapsummary.py
+# runs it on the nodes.
+
+# System Imports
+from collections import namedtuple
+import gzip
+import mmap
+import struct
+
+# time: seconds since 1970 as a float, src: source IPv4 as a string or None for non IP
+# frames, length: captured frame length (len() of a scapy packet), protocol: IP protocol
+# number, sport/dport: UDP ports, packet_type: byte 3 of the UDP payload (scapy's
+# packet.load[3]) or None, src_ip: src as a 32-bit int or None
+PcapRecord = namedtuple("PcapRecord", ["time", "src", "length", "protocol", "sport", "dport",
+                                       "packet_type", "src_ip"])
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+ETHERTYPE_IP = 0x0800
+ETHERTYPE_VLAN = 0x8100
+ETHERTYPE_QINQ = 0x88a8
+IP_PROTO_UDP = 17
+DHCP_PORTS = (67, 68)
+
+# Bump when decoding changes what records come out, invalidates cached parses
+PARSER_VERSION = 1
+
+PCAP_MAGIC_MICRO = 0xa1b2c3d4
+PCAP_MAGIC_NANO = 0xa1b23c4d
+# File header, records start right after it
+PCAP_HEADER_SIZE = 24
+PCAPNG_SECTION_HEADER = 0x0a0d0d0a
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+PCAPNG_INTERFACE_DESCRIPTION = 1
+PCAPNG_OBSOLETE_PACKET = 2
+PCAPNG_ENHANCED_PACKET = 6
+PCAPNG_OPTION_TSRESOL = 9
+
+# Sequential reads give back mapped pages every MAP_RELEASE_BYTES
+MAP_RELEASE_BYTES = 32 * 1024 * 1024
+
+
+##### FILES #####
+
+def open_capture(pcap_path):
+    """Open a capture for reading, .gz captures are decompressed on the fly"""
+    if pcap_path.endswith(".gz"):
+        return gzip.open(pcap_path, "rb")
+    return open(pcap_path, "rb")
+
+
+def read_frames(pcap_path):
+    """Yield (time, linktype, frame) for every packet in a libpcap or pcapng file
+
+    A capture that ends mid record, e.g. because tcpdump is still writing it, just stops
+    at the last complete record.
+    """
+    if is_mappable(pcap_path):
+        capture = MappedCapture(pcap_path)
+        try:
+            for frame in capture.iter_frames():
+                yield frame
+        finally:
+            capture.close()
+        return
+    with open_capture(pcap_path) as file:
+        magic = file.read(4)
+        if len(magic) < 4:
+            return
+        if struct.unpack("<I", magic)[0] == PCAPNG_SECTION_HEADER:
+            frames = read_pcapng_frames(file, magic)
+        else:
+            frames = read_pcap_frames(file, magic, pcap_path)
+        for frame in frames:
+            yield frame
+
+
+def get_pcap_format(magic, pcap_path):
+    """Byte order and seconds per timestamp unit of a libpcap file from its magic number"""
+    for endian in ("<", ">"):
+        magic_number = struct.unpack(endian + "I", magic)[0]
+        if magic_number in (PCAP_MAGIC_MICRO, PCAP_MAGIC_NANO):
+            return endian, 1e-9 if magic_number == PCAP_MAGIC_NANO else 1e-6
+    raise ValueError(pcap_path + " is not a pcap or pcapng file")
+
+
+def read_pcap_frames(file, magic, pcap_path):
+    endian, resolution = get_pcap_format(magic, pcap_path)
+    header = file.read(20)
+    if len(header) < 20:
+        return
+    linktype = struct.unpack(endian + "I", header[16:20])[0] & 0x0fffffff
+    record_header = struct.Struct(endian + "IIII")
+    while True:
+        data = file.read(16)
+        if len(data) < 16:
+            return
+        seconds, fraction, caplen, length = record_header.unpack(data)
+        frame = file.read(caplen)
+        if len(frame) < caplen:
+            return
+        yield seconds + fraction * resolution, linktype, frame
+
+
+def read_pcapng_frames(file, magic):
+    endian = "<"
+    # interfaces[interface_id] = (linktype, seconds per timestamp unit) for this section
+    interfaces = []
+    block_type = PCAPNG_SECTION_HEADER
+    while True:
+        if block_type == PCAPNG_SECTION_HEADER:
+            data = file.read(8)
+            if len(data) < 8:
+                return
+            endian = "<" if struct.unpack("<I", data[4:8])[0] == PCAPNG_BYTE_ORDER_MAGIC \
+                else ">"
+            block_length = struct.unpack(endian + "I", data[:4])[0]
+            body = file.read(block_length - 12)
+            if len(body) < block_length - 12:
+                return
+            interfaces = []
+        else:
+            data = file.read(4)
+            if len(data) < 4:
+                return
+            block_length = struct.unpack(endian + "I", data)[0]
+            body = file.read(block_length - 8)
+            if len(body) < block_length - 8:
+                return
+            # body ends with the repeated block length
+            body = body[:-4]
+            if block_type == PCAPNG_INTERFACE_DESCRIPTION:
+                linktype = struct.unpack(endian + "H", body[:2])[0]
+                interfaces.append((linktype, get_tsresol(body[8:], endian)))
+            elif block_type == PCAPNG_ENHANCED_PACKET:
+                interface_id, high, low, caplen = struct.unpack(endian + "IIII", body[:16])
+                linktype, resolution = interfaces[interface_id]
+                yield ((high << 32) | low) * resolution, linktype, body[20:20 + caplen]
+            elif block_type == PCAPNG_OBSOLETE_PACKET:
+                interface_id, drops, high, low, caplen = struct.unpack(endian + "HHIII",
+                                                                       body[:16])
+                linktype, resolution = interfaces[interface_id]
+                yield ((high << 32) | low) * resolution, linktype, body[20:20 + caplen]
+            # Simple packet blocks have no timestamp and are skipped with everything else
+
+        magic = file.read(4)
+        if len(magic) < 4:
+            return
+        block_type = struct.unpack(endian + "I", magic)[0]
+
+
+def get_tsresol(options, endian):
+    """Seconds per timestamp unit from an interface description's options, default 1e-6"""
+    offset = 0
+    while offset + 4 <= len(options):
+        code, length = struct.unpack(endian + "HH", options[offset:offset + 4])
+        if code == 0:
+            break
+        if code == PCAPNG_OPTION_TSRESOL and length >= 1:
+            value = options[offset + 4]
+            return 2.0 ** -(value & 0x7f) if value & 0x80 else 10.0 ** -value
+        offset += 4 + (length + 3) // 4 * 4
+    return 1e-6
+
+
+##### MAPPED #####
+
+def is_mappable(pcap_path):
+    """Uncompressed libpcap files are read through MappedCapture"""
+    if pcap_path.endswith(".gz"):
+        return False
+    with open(pcap_path, "rb") as file:
+        header = file.read(24)
+    if len(header) < 24:
+        return False
+    return struct.unpack("<I", header[:4])[0] in (PCAP_MAGIC_MICRO, PCAP_MAGIC_NANO) or \
+        struct.unpack(">I", header[:4])[0] in (PCAP_MAGIC_MICRO, PCAP_MAGIC_NANO)
+
+
+class MappedCapture:
+    """libpcap file read through mmap, frames are memoryview slices of the map
+
+    Nothing is copied, so memory use doesn't grow with the file size and the kernel pages
+    the file in and out as needed. Views handed out must not be kept past close().
+    """
+    def __init__(self, pcap_path):
+        self.pcap_path = pcap_path
+        self.file = open(pcap_path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        self.endian, self.resolution = get_pcap_format(self.map[:4], pcap_path)
+        self.linktype = struct.unpack_from(self.endian + "I", self.map, 20)[0] & 0x0fffffff
+        self.record_header = struct.Struct(self.endian + "IIII")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read_frame_at(self, offset):
+        seconds, fraction, caplen, length = self.record_header.unpack_from(self.map, offset)
+        frame = self.view[offset + 16:offset + 16 + caplen]
+        return seconds + fraction * self.resolution, self.linktype, frame
+
+    def iter_offsets(self, start_offset=PCAP_HEADER_SIZE):
+        """Offset of every complete record, a partly written last record is left out
+
+        :param start_offset: offset of the first record to yield, must be a record boundary
+        (PCAP_HEADER_SIZE is the first record, see read_appended_records)
+        """
+        size = len(self.map)
+        unpack_from = self.record_header.unpack_from
+        offset = start_offset
+        released = start_offset - start_offset % mmap.PAGESIZE
+        while offset + 16 <= size:
+            caplen = unpack_from(self.map, offset)[2]
+            if offset + 16 + caplen > size:
+                return
+            yield offset
+            offset += 16 + caplen
+            if offset - released >= MAP_RELEASE_BYTES:
+                released = self.release_pages(released, offset)
+
+    def release_pages(self, start, end):
+        """Drop the mapped pages in [start, end) from our resident set after a sequential
+        pass, they are paged back in from the file if touched again
+
+        :return: offset up to which pages were released
+        """
+        end -= end % mmap.PAGESIZE
+        if hasattr(self.map, "madvise") and end > start:
+            self.map.madvise(mmap.MADV_DONTNEED, start, end - start)
+        return end
+
+    def iter_frames(self):
+        for offset in self.iter_offsets():
+            yield self.read_frame_at(offset)
+
+    def close(self):
+        try:
+            self.view.release()
+            self.map.close()
+        except BufferError:
+            # A caller still holds a frame, the map closes when that is collected
+            pass
+        self.file.close()
+
+
+##### STREAMING #####
+
+class StreamParser:
+    """Push parser for a libpcap stream that is still being written, e.g. tcpdump -w -
+    read over ssh
+
+    feed() takes bytes as they arrive, in pieces of any size, and returns the records they
+    complete. Incomplete records wait in the buffer for the next feed().
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.record_header = None
+        self.resolution = None
+        self.linktype = None
+
+    def feed(self, data):
+        """:return: list of PcapRecord for every record completed by data"""
+        self.buffer += data
+        offset = 0
+        if self.record_header is None:
+            if len(self.buffer) < PCAP_HEADER_SIZE:
+                return []
+            endian, self.resolution = get_pcap_format(bytes(self.buffer[:4]), "pcap stream")
+            self.linktype = struct.unpack_from(endian + "I", self.buffer, 20)[0] & 0x0fffffff
+            self.record_header = struct.Struct(endian + "IIII")
+            offset = PCAP_HEADER_SIZE
+        records = []
+        size = len(self.buffer)
+        while offset + 16 <= size:
+            seconds, fraction, caplen, length = self.record_header.unpack_from(self.buffer,
+                                                                               offset)
+            if offset + 16 + caplen > size:
+                break
+            frame = bytes(self.buffer[offset + 16:offset + 16 + caplen])
+            records.append(decode_frame(seconds + fraction * self.resolution, self.linktype,
+                                        frame))
+            offset += 16 + caplen
+        del self.buffer[:offset]
+        return records
+
+
+##### DECODING #####
+
+def get_ip_packet(linktype, frame):
+    """Return the IPv4 packet inside a frame, or None"""
+    if linktype == LINKTYPE_ETHERNET:
+        offset = 12
+        if len(frame) < 14:
+            return None
+        ethertype = (frame[12] << 8) | frame[13]
+        while ethertype in (ETHERTYPE_VLAN, ETHERTYPE_QINQ) and len(frame) >= offset + 6:
+            offset += 4
+            ethertype = (frame[offset] << 8) | frame[offset + 1]
+        if ethertype != ETHERTYPE_IP:
+            return None
+        packet = frame[offset + 2:]
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if len(frame) < 16 or (frame[14] << 8) | frame[15] != ETHERTYPE_IP:
+            return None
+        packet = frame[16:]
+    elif linktype == LINKTYPE_NULL:
+        packet = frame[4:]
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4):
+        packet = frame
+    else:
+        return None
+    if len(packet) < 20 or packet[0] >> 4 != 4:
+        return None
+    # Drop the ethernet padding after short packets
+    total_length = (packet[2] << 8) | packet[3]
+    if 20 <= total_length < len(packet):
+        packet = packet[:total_length]
+    return packet
+
+
+def decode_frame(time, linktype, frame):
+    """Decode one frame into a PcapRecord"""
+    packet = get_ip_packet(linktype, frame)
+    if packet is None:
+        return PcapRecord(time, None, len(frame), None, None, None, None, None)
+    src = "%d.%d.%d.%d" % (packet[12], packet[13], packet[14], packet[15])
+    src_ip = (packet[12] << 24) | (packet[13] << 16) | (packet[14] << 8) | packet[15]
+    protocol = packet[9]
+    if protocol != IP_PROTO_UDP:
+        return PcapRecord(time, src, len(frame), protocol, None, None, None, src_ip)
+    udp_offset = (packet[0] & 0x0f) * 4
+    if len(packet) < udp_offset + 8:
+        return PcapRecord(time, src, len(frame), protocol, None, None, None, src_ip)
+    sport = (packet[udp_offset] << 8) | packet[udp_offset + 1]
+    dport = (packet[udp_offset + 2] << 8) | packet[udp_offset + 3]
+    udp_end = udp_offset + max(8, (packet[udp_offset + 4] << 8) | packet[udp_offset + 5])
+    type_offset = udp_offset + 8 + 3
+    packet_type = packet[type_offset] if min(len(packet), udp_end) > type_offset else None
+    return PcapRecord(time, src, len(frame), protocol, sport, dport, packet_type, src_ip)
+
+
+def read_records(pcap_path):
+    """Yield a PcapRecord for every packet in a capture, in file order"""
+    for time, linktype, frame in read_frames(pcap_path):
+        yield decode_frame(time, linktype, frame)
+
+
+def read_appended_records(pcap_path, start_offset=PCAP_HEADER_SIZE):
+    """Yield (record, next_offset) for every complete record of a libpcap file from
+    start_offset on, where next_offset is where the following record starts
+
+    Lets a capture that is still growing be read a piece at a time: keep the last
+    next_offset and pass it back in once more has been written. Only for files where
+    is_mappable is True.
+    """
+    with MappedCapture(pcap_path) as capture:
+        for offset in capture.iter_offsets(start_offset):
+            time, linktype, frame = capture.read_frame_at(offset)
+            yield decode_frame(time, linktype, frame), offset + 16 + len(frame)
+            frame.release()
+
+
+def is_udp(record):
+    return record.sport is not None
+
+
+def is_dhcp(record):
+    """What scapy would dissect as DHCP, BOOTP on UDP ports 67/68"""
+    return record.sport in DHCP_PORTS and record.dport in DHCP_PORTS
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# File: pcapsummary.py
+# Author: Luke Thomas
+# Date: April 16, 2018
+# Description: Deployed to each node by Node.retrieve_pcap_summary and run there against
+# the node's own captures, so only per-second byte counts come back instead of the pcaps.
+# Reads the captures with pcapreader.py, which is deployed alongside it.
+#
+# Usage: python3 pcapsummary.py <node_number> <ipmap json> <pcap> [<pcap> ...]
+#
+# Output, one row per (second, direction, packet type):
+#   # pcapsummary 1 <node_number> <first_second> <last_second>
+#   <second> <tx|rx> <type> <bytes> <packets>
+#   # end
+# type is byte 3 of the UDP payload (the GrapeVine packet type) or - for anything else,
+# DHCP/BOOTP included.
+# Directions and sizes follow packetsuite.make_type_packets_dict: bytes are captured frame
+# lengths and packets from IPs that aren't in the ipmap are left out.
+
+# System Imports
+from json import loads
+import sys
+
+# Local Imports
+# Deployed next to this script
+import pcapreader
+
+SUMMARY_VERSION = 1
+
+
+def is_sender(source_ip, node_number, ipmap):
+    """True or False, None if the source isn't a node (packetsuite's "NOTVALID")"""
+    if not ipmap:
+        return source_ip.split(".")[-1] == str(node_number)
+    if source_ip not in ipmap:
+        return None
+    return str(ipmap[source_ip]) == str(node_number)
+
+
+def summarize(pcap_paths, node_number, ipmap):
+    """Return summary[(second, direction, type)] = [bytes, packets], first and last second"""
+    summary = {}
+    first_second = None
+    last_second = None
+    for pcap_path in pcap_paths:
+        for record in pcapreader.read_records(pcap_path):
+            seconds = int(record.time)
+            first_second = seconds if first_second is None else min(first_second, seconds)
+            last_second = seconds if last_second is None else max(last_second, seconds)
+            if record.src is None:
+                continue
+            sender = is_sender(record.src, node_number, ipmap)
+            if sender is None:
+                continue
+            # DHCP's byte 3 is the BOOTP hops count, not a GrapeVine type
+            if record.packet_type is None or pcapreader.is_dhcp(record):
+                packet_type = "-"
+            else:
+                packet_type = str(record.packet_type)
+            key = (seconds, "tx" if sender else "rx", packet_type)
+            if key not in summary:
+                summary[key] = [0, 0]
+            summary[key][0] += record.length
+            summary[key][1] += 1
+    return summary, first_second, last_second
+
+
+def write_summary(output, summary, node_number, first_second, last_second):
+    output.write("# pcapsummary " + str(SUMMARY_VERSION) + " " + str(node_number) + " " +
+                 str(first_second if first_second is not None else "-") + " " +
+                 str(last_second if last_second is not None else "-") + "\n")
+    for key in sorted(summary.keys()):
+        second, direction, packet_type = key
+        byte_count, packet_count = summary[key]
+        output.write(str(second) + " " + direction + " " + packet_type + " " +
+                     str(byte_count) + " " + str(packet_count) + "\n")
+    output.write("# end\n")
+
+
+def main():
+    if len(sys.argv) < 4:
+        sys.stderr.write("Usage: pcapsummary.py <node_number> <ipmap json> <pcap> ...\n")
+        return 2
+    node_number = sys.argv[1]
+    ipmap = loads(sys.argv[2])
+    summary, first_second, last_second = summarize(sys.argv[3:], node_number, ipmap)
+    write_summary(sys.stdout, summary, node_number, first_second, last_second)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
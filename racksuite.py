@@ -102,6 +102,8 @@ while(loop):
         commands.gvpki(node_objects)
     elif(arg == "gvpkipushload"):
         commands.gvpki_push_load(node_objects)
+    elif arg == "relaykey":
+        commands.setup_relay_key(node_objects)
     elif(arg == "gvpkiload"):
         for node in node_objects:
             node.load_certs(len(node_objects))
@@ -199,8 +201,14 @@ while(loop):
         commands.stats(save, len(nodes), iplist)
     elif(arg == "stats_events"):
         commands.stats_events(save, node_objects)
+    elif arg == "stats_events_incremental":
+        commands.stats_events(save, node_objects, incremental=True)
     elif(arg == "stats_tcpdump"):
         commands.stats_tcpdump(node_objects)
+    elif arg == "stats_tcpdump_full":
+        commands.stats_tcpdump(node_objects, full_pcaps=True)
+    elif arg == "stats_live":
+        commands.stats_live(node_objects)
     elif arg == "pull_logs":
         commands.pull_logfiles(node_objects)
     elif arg == "stats_packet_statistics":
@@ -255,7 +263,7 @@ while(loop):
     elif(arg == "delete"):
         commands.delete(save)
     elif(arg == "kill"):
-        commands.kill()
+        commands.kill(node_objects)
 
     ##### QUIT #####
     
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+# File: sshpool.py
+# Author: Luke Thomas
+# Date: April 12, 2018
+# Description: Process-wide pool of persistent paramiko connections, keyed by
+# (ip, user_name). Every remote_execute* call in functions.py goes through this
+# so a command only costs a channel open instead of a full ssh handshake.
+
+# System Imports
+from contextlib import contextmanager
+from os import path
+from time import time
+import atexit
+import socket
+import threading
+
+# Third Party Imports
+from paramiko import AutoAddPolicy, RSAKey, SSHClient, SSHException
+
+# Local Imports
+import config
+
+# Loaded once per process instead of once per command
+_ssh_key = None
+_key_lock = threading.Lock()
+
+# _pool[(ip, user_name)] = {"client", "lock", "last_used", "in_use"}
+_pool = {}
+_pool_lock = threading.Lock()
+
+
+def get_ssh_key():
+    global _ssh_key
+    with _key_lock:
+        if _ssh_key is None:
+            _ssh_key = RSAKey.from_private_key_file(path.expanduser(config.SSH_KEY_PATH))
+    return _ssh_key
+
+
+def open_connection(ip, user_name):
+    ssh = SSHClient()
+    ssh.set_missing_host_key_policy(AutoAddPolicy())
+    ssh.connect(ip, username=user_name, pkey=get_ssh_key(),
+                timeout=config.SSH_CONNECT_TIMEOUT_SECONDS)
+    ssh.get_transport().set_keepalive(config.SSH_KEEPALIVE_SECONDS)
+    return ssh
+
+
+def is_connection_alive(ssh):
+    if ssh is None:
+        return False
+    transport = ssh.get_transport()
+    if transport is None or not transport.is_active():
+        return False
+    try:
+        # Cheap round trip that the server ignores, fails fast on a dead socket
+        transport.send_ignore()
+    except (SSHException, EOFError, OSError):
+        return False
+    return True
+
+
+def evict_idle_connections():
+    """Close pooled connections nobody has used for SSH_IDLE_TIMEOUT_SECONDS
+
+    Must be called with _pool_lock held.
+    """
+    now = time()
+    for key in list(_pool.keys()):
+        entry = _pool[key]
+        idle_time = now - entry["last_used"]
+        if entry["in_use"] == 0 and idle_time > config.SSH_IDLE_TIMEOUT_SECONDS:
+            if entry["client"] is not None:
+                entry["client"].close()
+            del _pool[key]
+
+
+def checkout(ip, user_name):
+    key = (ip, user_name)
+    with _pool_lock:
+        evict_idle_connections()
+        if key not in _pool:
+            _pool[key] = {"client": None, "lock": threading.Lock(), "last_used": time(),
+                          "in_use": 0}
+        entry = _pool[key]
+        entry["in_use"] += 1
+
+    # Connect outside of _pool_lock so a slow host doesn't block the other nodes
+    try:
+        with entry["lock"]:
+            if not is_connection_alive(entry["client"]):
+                replace_client(entry, ip, user_name)
+            return entry["client"]
+    except Exception:
+        release(ip, user_name)
+        raise
+
+
+def release(ip, user_name):
+    with _pool_lock:
+        entry = _pool.get((ip, user_name))
+        if entry is not None:
+            entry["in_use"] -= 1
+            entry["last_used"] = time()
+
+
+def replace_client(entry, ip, user_name):
+    """Close the entry's client and connect a new one, must hold entry["lock"]"""
+    if entry["client"] is not None:
+        entry["client"].close()
+    entry["client"] = None
+    entry["client"] = open_connection(ip, user_name)
+
+
+def reconnect(ip, user_name, dead_client):
+    """Replace dead_client in the pool, unless another thread already did
+
+    Only call while holding a checkout of (ip, user_name).
+    """
+    with _pool_lock:
+        entry = _pool[(ip, user_name)]
+    with entry["lock"]:
+        if entry["client"] is dead_client or not is_connection_alive(entry["client"]):
+            replace_client(entry, ip, user_name)
+        return entry["client"]
+
+
+@contextmanager
+def connection(ip, user_name):
+    """Borrow the pooled SSHClient for (ip, user_name), connecting if necessary
+
+    The connection stays open after the with block so the next caller can reuse it, and
+    it is never evicted while borrowed.
+    """
+    ssh = checkout(ip, user_name)
+    try:
+        yield ssh
+    finally:
+        release(ip, user_name)
+
+
+def exec_command(ssh, ip, user_name, command):
+    """SSHClient.exec_command on a borrowed connection, reconnecting once if it died
+
+    Retrying is safe because a failed channel open means the command never reached the
+    node.
+
+    :param ssh: client yielded by connection(ip, user_name)
+    :return: stdin, stdout, stderr file objects of the channel
+    """
+    try:
+        return ssh.exec_command(command)
+    except (SSHException, EOFError, OSError):
+        ssh = reconnect(ip, user_name, ssh)
+        return ssh.exec_command(command)
+
+
+def open_session(ssh, ip, user_name):
+    """Open a raw channel on a borrowed connection, reconnecting once if it died
+
+    :param ssh: client yielded by connection(ip, user_name)
+    :return: paramiko Channel, caller must close it
+    """
+    try:
+        return ssh.get_transport().open_session()
+    except (SSHException, EOFError, OSError, AttributeError):
+        ssh = reconnect(ip, user_name, ssh)
+        return ssh.get_transport().open_session()
+
+
+class StderrReader:
+    """Reads a channel's stderr in a thread until it closes
+
+    A command writing more than the channel window to stderr would otherwise block while
+    we only read its stdout. The first limit bytes are kept for error messages, all of it
+    with limit None.
+    """
+    def __init__(self, channel, limit=4096):
+        self.channel = channel
+        self.limit = limit
+        self.output = b""
+        self.thread = threading.Thread(target=self.read)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def read(self):
+        while True:
+            try:
+                chunk = self.channel.recv_stderr(32768)
+            except socket.timeout:
+                # The channel has a timeout set for polling its stdout
+                if self.channel.closed:
+                    break
+                continue
+            if not chunk:
+                break
+            if self.limit is None:
+                self.output += chunk
+            elif len(self.output) < self.limit:
+                self.output += chunk[:self.limit - len(self.output)]
+
+    def get_output(self):
+        """stderr once the command closed it or the channel was closed"""
+        self.thread.join()
+        return self.output.decode(errors="replace").strip()
+
+
+def close_connection(ip, user_name):
+    with _pool_lock:
+        entry = _pool.pop((ip, user_name), None)
+    if entry is not None and entry["client"] is not None:
+        entry["client"].close()
+
+
+def close_all():
+    with _pool_lock:
+        entries = list(_pool.values())
+        _pool.clear()
+    for entry in entries:
+        if entry["client"] is not None:
+            entry["client"].close()
+
+
+atexit.register(close_all)
@@ -5,14 +5,13 @@
 
 # System Imports
 from glob import glob
-from os import path, system
+from os import path, stat, system
 from math import ceil
 from re import search, split
 from subprocess import Popen
 from sqlite3 import connect, IntegrityError, DatabaseError
 from time import gmtime, strftime, sleep
 import threading
-import queue
 
 # 3rd Party Imports
 from paramiko import AutoAddPolicy, RSAKey, SSHClient
@@ -20,6 +19,7 @@ import plotly
 import pickle
 
 # Local imports
+import functions
 from functions import create_dir
 import packetsuite
 
@@ -29,31 +29,139 @@ PACKET_BEACON = 1
 PACKET_GVINE = 2
 PACKET_HANDSHAKE = 3
 PACKET_BABEL = 4
+# Open EventStores by absolute database path, see get_event_store
+EVENT_STORES = {}
+# Per-second summaries of a merged event database, see make_event_summaries. Columns are
+# positions in the merged tables (nodeNumber is 0), as the row based functions read them.
+EVENT_SUMMARY_VERSION = 1
+EVENT_TIMESTAMP_COLUMNS = {
+    "loggableeventpacketsent": 5,
+    "loggableeventpacketreceived": 6,
+    "loggableeventrankrx": 6
+}
+# (summary table, event table, [(key column, position)], [(value column, aggregate, position)])
+EVENT_SUMMARIES = [
+    ("summary_packetsent", "loggableeventpacketsent",
+     [("packetType", 3)],
+     [("bytes", "SUM", 4), ("packets", "COUNT", None)]),
+    ("summary_packetreceived", "loggableeventpacketreceived",
+     [("senderNode", 2), ("packetType", 4)],
+     [("bytes", "SUM", 5), ("packets", "COUNT", None)]),
+    ("summary_rankrx", "loggableeventrankrx",
+     [("fragIndex", 3)],
+     [("rank", "MAX", 2)])
+]
 
 
 ##### General SQLITE Functions #####
 
 def get_sql_data(path_to_db, table_name):
-    main_connection = connect(path_to_db)
-    cursor = main_connection.cursor()
-    select_stmt = "select * from " + table_name + ";"
-    try:
-        cursor.execute(select_stmt)
-    except(Exception):
-        print("There is no data for " + table_name + " at " + path_to_db)
-    rows = cursor.fetchall()
-    return rows
+    return get_event_store(path_to_db).select_all(table_name)
 
 
 def queary_sql_db(path_to_db, query):
-    main_connection = connect(path_to_db)
-    cursor = main_connection.cursor()
+    return get_event_store(path_to_db).query(query)
+
+
+class EventStore:
+    """Queries of one event database over a connection kept open between calls
+
+    Get one with get_event_store rather than making one, so every function reading the
+    same database shares it. Values are passed as parameters, which lets sqlite3 reuse
+    the statements it compiled on the connection, and the aggregates run inside SQLite
+    instead of over fetched rows.
+    """
+    def __init__(self, path_to_db):
+        self.path = path_to_db
+        self.connection = connect(path_to_db)
+        self.inode = get_inode(path_to_db)
+
+    def select_all(self, table_name):
+        """Every row of a table, none (and a message) if there is no such table"""
+        try:
+            return self.connection.execute('SELECT * FROM "' + table_name + '";').fetchall()
+        except DatabaseError:
+            print("There is no data for " + table_name + " at " + self.path)
+            return []
+
+    def query(self, query, parameters=()):
+        """Rows of a query, none (and a message) if the database can't answer it"""
+        try:
+            return self.connection.execute(query, parameters).fetchall()
+        except DatabaseError:
+            print("There is no data for " + query + " at " + self.path)
+            return []
+
+    def execute(self, statement, parameters=()):
+        """Run a statement that writes, errors are raised, see commit"""
+        return self.connection.execute(statement, parameters)
+
+    def commit(self):
+        self.connection.commit()
+
+    def has_table(self, table_name):
+        return table_name in get_table_names(self.connection)
+
+    def get_column_name(self, table_name, column):
+        """:param column: column name or position, as rows from select_all are indexed"""
+        if isinstance(column, int):
+            return get_column_names(self.connection, table_name)[column]
+        return column
+
+    def get_aggregate(self, function, table_name, column="*", where=None, parameters=()):
+        """MIN, MAX, COUNT or SUM of a column (name or position) computed by SQLite
+
+        :param where: optional WHERE condition, with ? for its parameters
+        :return: the value, None for an empty or missing table
+        """
+        if function not in ("MIN", "MAX", "COUNT", "SUM"):
+            raise ValueError("Unsupported aggregate " + function)
+        if not self.has_table(table_name):
+            return None
+        if column != "*":
+            column = '"' + self.get_column_name(table_name, column) + '"'
+        query = "SELECT " + function + "(" + column + ') FROM "' + table_name + '"'
+        if where:
+            query += " WHERE " + where
+        return self.connection.execute(query + ";", parameters).fetchone()[0]
+
+    def get_metadata(self):
+        """run_metadata of a merged event database, see make_event_summaries"""
+        return get_run_metadata(self.connection)
+
+    def close(self):
+        self.connection.close()
+
+
+def get_event_store(path_to_db):
+    """The EventStore of a database, opened on first use and kept until close_event_stores
+
+    A store whose file was replaced since it was opened (e.g. deleted and combined again)
+    is reopened.
+    """
+    key = path.abspath(path_to_db)
+    store = EVENT_STORES.get(key)
+    if store is not None and store.inode != get_inode(path_to_db):
+        store.close()
+        store = None
+    if store is None:
+        store = EventStore(path_to_db)
+        EVENT_STORES[key] = store
+    return store
+
+
+def close_event_stores():
+    """Close every open EventStore, the next get_event_store opens its database again"""
+    for store in EVENT_STORES.values():
+        store.close()
+    EVENT_STORES.clear()
+
+
+def get_inode(path_to_db):
     try:
-        cursor.execute(query)
-    except(Exception):
-        print("There is no data for " + query + " at " + path_to_db)
-    data = cursor.fetchall()
-    return data
+        return stat(path_to_db).st_ino
+    except OSError:
+        return None
 
 
 ##### Delays from SQL #####
@@ -138,8 +246,8 @@ def extract_transfer_delays(path_to_input, path_to_output, save_file, num_nodes)
         "saveFile TEXT, messageId TEXT, timestamp TEXT, " +
         "unique(receiverNumber, messageId));"
     )
-    main_connection = connect(path_to_output)
-    main_connection.execute(table_schema)
+    output_store = get_event_store(path_to_output)
+    output_store.execute(table_schema)
 
     # Get the delay data for each test and insert into output database
     list_of_nodes = [node[0] for node in data_rows]
@@ -161,19 +269,17 @@ def extract_transfer_delays(path_to_input, path_to_output, save_file, num_nodes)
         #gvine_version = input("Gvine version? : ")
         insert_stmt = (
             "INSERT INTO TRANSFERDELAYS (receiverNumber, senderNumber, " +
-            "delay, messageSizeBytes, saveFile, messageId, timestamp) VALUES ('" +
-            node_name + "', '" + sender_name + "', " + str(delay) + ", " +
-            str(msg_size) + ", '" + save_file + "', '" + message_id + "', '" +
-            str(timestamp) + "')"
+            "delay, messageSizeBytes, saveFile, messageId, timestamp) VALUES " +
+            "(?, ?, ?, ?, ?, ?, ?)"
         )
         try:
-            main_connection.execute(insert_stmt)
+            output_store.execute(insert_stmt, (node_name, sender_name, delay, msg_size,
+                                               save_file, message_id, str(timestamp)))
         except(IntegrityError) as err:
             print("Duplicate receiverNumber: " + node_name + ", messageId: " + message_id)
 
-    # Commit then close output database
-    main_connection.commit()
-    main_connection.close()
+    # Commit the output database
+    output_store.commit()
 
 
 def calc_avg_hop_transfer_delay(path_to_input, node_hops_dict, nodes, rack_to_topo_names):
@@ -223,19 +329,17 @@ def extract_node_delays(path_to_input, path_to_output, save_file):
         "delay INTEGER, messageSizeBytes INTEGER, saveFile TEXT, " +
         "messageId TEXT, timestamp TEXT, unique(nodeNumber, messageId));"
     )
-    main_connection = connect(path_to_output)
-    main_connection.execute(table_schema)
+    output_store = get_event_store(path_to_output)
+    output_store.execute(table_schema)
 
-    # Get the delay data
+    # Get the delay data, last minus first fragment time of each node
+    input_store = get_event_store(path_to_input)
     delays_dict = {}
-    # Set comprehension to get unique node values
-    nodes = {row[0] for row in frag_rows}
-    for node in nodes:
-        times_ms = [row[5] for row in frag_rows if row[0] == node]
-        early = min(times_ms)
-        late = max(times_ms)
-        delay = late - early
-        delays_dict[node] = delay
+    if frag_rows:
+        time_column = input_store.get_column_name("loggableeventfragment", 5)
+        delays_dict = dict(input_store.query(
+            'SELECT nodeNumber, MAX("' + time_column + '") - MIN("' + time_column + '") ' +
+            "FROM loggableeventfragment GROUP BY nodeNumber;"))
 
     # Get the message size data
     msg_sizes_dict = get_message_sizes(path_to_input)
@@ -258,17 +362,16 @@ def extract_node_delays(path_to_input, path_to_output, save_file):
         insert_stmt = (
             "INSERT INTO NODEDELAYS " +
             "(nodeNumber, delay, messageSizeBytes, saveFile, messageId, timestamp) " +
-            "VALUES ('" + node_number + "', " + str(delay) + ", " + str(message_size_bytes) +
-            ", '" + save_file + "', '" + message_id + "', '" + timestamp + "')"
+            "VALUES (?, ?, ?, ?, ?, ?)"
         )
         try:
-            main_connection.execute(insert_stmt)
+            output_store.execute(insert_stmt, (node_number, delay, message_size_bytes,
+                                               save_file, message_id, timestamp))
         except(IntegrityError) as err:
             print("Duplicate nodeNumber: " + node_number + ", messageId: " + message_id)
 
-    # Commit then close output database
-    main_connection.commit()
-    main_connection.close()
+    # Commit the output database
+    output_store.commit()
 
 ##### Overhead #####
 
@@ -291,17 +394,13 @@ def extract_link_loads():
 ##### SENT PACKETS ANALYSIS #####
 
 def make_packets_sent_buckets(path_to_input, bucket_increment_seconds):
-    earliest_packet_time = get_earliest_of_all_packets(path_to_input)
-    packet_rows = get_sql_data(path_to_input, "loggableeventpacketsent")
+    bucket_rows = get_event_summaries(path_to_input).query(
+        "SELECT nodeNumber, packetType, CAST(second / ? AS INTEGER), SUM(bytes), "
+        "SUM(packets) FROM summary_packetsent GROUP BY 1, 2, 3;",
+        (bucket_increment_seconds,))
 
     buckets_dict = {}
-    for row in packet_rows:
-        sender_node = row[0]
-        packet_id = row[3]
-        num_bytes = row[4]
-        time_stamp_millis = row[5]
-        relative_time = int((time_stamp_millis - earliest_packet_time) / 1000)
-        bucket_index = int(relative_time / bucket_increment_seconds)
+    for sender_node, packet_id, bucket_index, num_bytes, num_packets in bucket_rows:
         packet_type = get_packet_type(packet_id)
 
         if(packet_type not in buckets_dict.keys()):
@@ -315,7 +414,7 @@ def make_packets_sent_buckets(path_to_input, bucket_increment_seconds):
 
         buckets_dict[packet_type][sender_node][str(bucket_index)]['bytes'] += int(num_bytes /
                                                                 bucket_increment_seconds)
-        buckets_dict[packet_type][sender_node][str(bucket_index)]['packets'] += 1
+        buckets_dict[packet_type][sender_node][str(bucket_index)]['packets'] += num_packets
     return buckets_dict
 
 
@@ -387,18 +486,14 @@ def plot_packets_sent_data(buckets_dict, bucket_increment_seconds, last_second):
 ##### Received Packets #####
 
 def make_packets_received_buckets(path_to_input, bucket_size_seconds):
-    earliest_packet_time = get_earliest_of_all_packets(path_to_input)
-    packet_rows = get_sql_data(path_to_input, "loggableeventpacketreceived")
+    bucket_rows = get_event_summaries(path_to_input).query(
+        "SELECT nodeNumber, senderNode, packetType, CAST(second / ? AS INTEGER), SUM(bytes), "
+        "SUM(packets) FROM summary_packetreceived GROUP BY 1, 2, 3, 4;",
+        (bucket_size_seconds,))
 
     buckets_dict = {}
-    for row in packet_rows:
-        receiver_node = row[0]
-        sender_node = row[2]
-        packet_id = row[4]
-        num_bytes = row[5]
-        time_stamp_millis = row[6]
-        relative_time = int((time_stamp_millis - earliest_packet_time) / 1000)
-        bucket_index = int(relative_time / bucket_size_seconds)
+    for receiver_node, sender_node, packet_id, bucket_index, num_bytes, num_packets in \
+            bucket_rows:
         packet_type = get_packet_type(packet_id)
 
         if(packet_type not in buckets_dict.keys()):
@@ -414,7 +509,7 @@ def make_packets_received_buckets(path_to_input, bucket_size_seconds):
 
         buckets_dict[packet_type][receiver_node][sender_node][str(bucket_index)]['bytes'] += int(num_bytes /
                                                                            bucket_size_seconds)
-        buckets_dict[packet_type][receiver_node][sender_node][str(bucket_index)]['packets'] += 1
+        buckets_dict[packet_type][receiver_node][sender_node][str(bucket_index)]['packets'] += num_packets
     return buckets_dict
 
 
@@ -494,31 +589,17 @@ def plot_packets_received_data(buckets_dict, bucket_size_seconds, last_second):
 ##### Rank Progress Graph #####
 
 def make_rank_buckets(path_to_input, bucket_size_seconds):
-        earliest_packet_time = get_earliest_of_all_packets(path_to_input)
-        rank_rows = get_sql_data(path_to_input, "loggableeventrankrx")
+        bucket_rows = get_event_summaries(path_to_input).query(
+            "SELECT nodeNumber, fragIndex, CAST(second / ? AS INTEGER), MAX(rank) "
+            "FROM summary_rankrx GROUP BY 1, 2, 3;", (bucket_size_seconds,))
 
         buckets_dict = {}
-        for row in rank_rows:
-            receiver_node = row[0]
-            event_id = row[1]
-            current_rank = row[2]
-            frag_index = row[3]
-            message_id = row[4]
-            max_rank = row[5]
-            time_stamp_millis = row[6]
-            relative_time = int((time_stamp_millis - earliest_packet_time) / 1000)
-            bucket_index = int(relative_time / bucket_size_seconds)
-
+        for receiver_node, frag_index, bucket_index, current_rank in bucket_rows:
             if(receiver_node not in buckets_dict.keys()):
                 buckets_dict[receiver_node] = {}
             if(str(frag_index) not in buckets_dict[receiver_node].keys()):
                 buckets_dict[receiver_node][str(frag_index)] = {}
-            if(str(bucket_index) not in buckets_dict[receiver_node][str(frag_index)].keys()):
-                buckets_dict[receiver_node][str(frag_index)][str(bucket_index)] = current_rank
-            else:
-                same_bucket = buckets_dict[receiver_node][str(frag_index)][str(bucket_index)]
-                buckets_dict[receiver_node][str(frag_index)][str(bucket_index)] = max(same_bucket,
-                                                                           current_rank)
+            buckets_dict[receiver_node][str(frag_index)][str(bucket_index)] = current_rank
         return buckets_dict
 
 
@@ -637,44 +718,35 @@ def print_delay_data(path_to_input):
                   str(row[4]/1000) + " seconds")
 
 
-def get_earliest_packet_time(packet_rows, index_of_timestamp):
-    if(packet_rows):
-        return min([row[index_of_timestamp] for row in packet_rows])
-
-
 def get_earliest_of_all_packets(path_to_input):
-    sent_packet_rows = get_sql_data(path_to_input, "loggableeventpacketsent")
-    received_packet_rows = get_sql_data(path_to_input, "loggableeventpacketreceived")
-    earliest_sent = get_earliest_packet_time(sent_packet_rows, 5)
-    earliest_received = get_earliest_packet_time(received_packet_rows, 6)
-    compare_arr = []
-    if(earliest_sent):
-        compare_arr.append(earliest_sent)
-    if(earliest_received):
-        compare_arr.append(earliest_received)
-    if(not compare_arr):
+    earliest_time = get_packets_time_bound(path_to_input, "MIN", "earliest_timestamp")
+    if(earliest_time is None):
         print("NO SENT OR RECEIVED PACKETS IN DATABASE")
-    return min(compare_arr)
-
-
-def get_latest_packet_time(packet_rows, index_of_timestamp):
-    if(packet_rows):
-        return max([row[index_of_timestamp] for row in packet_rows])
+    return earliest_time
 
 
 def get_latest_of_all_packets(path_to_input):
-    sent_packet_rows = get_sql_data(path_to_input, "loggableeventpacketsent")
-    received_packet_rows = get_sql_data(path_to_input, "loggableeventpacketreceived")
-    latest_sent = get_latest_packet_time(sent_packet_rows, 5)
-    latest_received = get_latest_packet_time(received_packet_rows, 6)
-    compare_arr = []
-    if(latest_sent):
-        compare_arr.append(latest_sent)
-    if(latest_received):
-        compare_arr.append(latest_received)
-    if(not compare_arr):
+    latest_time = get_packets_time_bound(path_to_input, "MAX", "latest_timestamp")
+    if(latest_time is None):
         print("NO SENT OR RECEIVED PACKETS IN DATABASE")
-    return min(compare_arr)
+    return latest_time
+
+
+def get_packets_time_bound(path_to_input, function, metadata_name):
+    """Earliest (MIN) or latest (MAX) timestamp of the sent and received packets
+
+    Read from run_metadata if the database was summarized, computed by SQLite otherwise.
+    """
+    store = get_event_store(path_to_input)
+    metadata = store.get_metadata()
+    if metadata.get("summary_version") == EVENT_SUMMARY_VERSION:
+        return metadata.get(metadata_name)
+    times = [store.get_aggregate(function, table_name, EVENT_TIMESTAMP_COLUMNS[table_name])
+             for table_name in ("loggableeventpacketsent", "loggableeventpacketreceived")]
+    times = [timestamp for timestamp in times if timestamp]
+    if not times:
+        return None
+    return min(times) if function == "MIN" else max(times)
 
 
 def get_missing_node(list_of_nodes):
@@ -881,61 +953,48 @@ def copy_event_dbs(iplist, path_to_db, dest_path):
         system(command)
 
 
-def combine_event_dbs(input_dir, output_dir):
-    # Make a new database named by timestamp
-    date_time = strftime("%Y-%m-%d_%H:%M:%S", gmtime())
-    new_db_name = output_dir + "/" + date_time + ".db"
+def combine_event_dbs(input_dir, output_dir, db_name=None):
+    """Merge the node event databases in input_dir into one database in output_dir
+
+    :param db_name: merge incrementally into output_dir/db_name.db, kept across pulls of
+    the same test run, instead of making a new database named by timestamp. Only events
+    past each node's and table's watermark are copied and the summaries are updated
+    rather than rebuilt.
+    :return: path of the combined database
+    """
+    if db_name is None:
+        # Make a new database named by timestamp
+        date_time = strftime("%Y-%m-%d_%H:%M:%S", gmtime())
+        new_db_name = output_dir + "/" + date_time + ".db"
+    else:
+        new_db_name = output_dir + "/" + db_name + ".db"
     print("Opening main connection to " + new_db_name)
     main_connection = connect(new_db_name)
     # Get the database names for each separate database we want to combine
     print("Getting db names")
     db_names = [name for name in glob(input_dir + "*.db") if "eventsql" in name]
-    # Get the table names and schemas needed to create the new database
-    print("Getting tables names and schemas")
-    table_names, schemas = gather_table_schemas(input_dir, db_names)
-    # Create the tables in the new database
-    print("Creating db tables")
-    create_db_tables(main_connection, schemas)
-    # Insert data from all the databases into the new database
+    # Insert data from all the databases into the new database, creating the tables of
+    # each node database the combined one doesn't have yet
     print("Inserting db data")
-    insert_db_data(main_connection, db_names, table_names)
+    watermarks = insert_db_data(main_connection, db_names)
+    # Index and summarize the packet and rank events for the analysis functions
+    if db_name is None:
+        print("Building db indexes and summaries")
+        make_event_summaries(main_connection)
+    else:
+        print("Updating db summaries")
+        update_event_summaries(main_connection, watermarks)
     # Save the changes made to the new database
     print("Committing main connection")
     main_connection.commit()
     # Close the database connection
     print("Closing main connection")
     main_connection.close()
+    # Drop the connections earlier reads left open, the next reads reopen the merged data
+    close_event_stores()
     return new_db_name
 
 
-def gather_table_schemas(path_to_dbs, db_names):
-    table_names = []
-    schemas = []
-    for db_name in db_names:
-        conn = connect(db_name)
-        cursor = conn.cursor()
-        try:
-            cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        except DatabaseError:
-            print("""There was an error while querying the database, this is probably because
-                you pulled the databases down from the nodes while grapevine was still running""")
-            exit()
-
-        tables = cursor.fetchall()
-
-        # Loop through and add non-duplicate table names
-        for table in tables:
-            table = table[0]
-            if table not in table_names:
-                table_names.append(table)
-            schema = conn.execute("SELECT sql FROM sqlite_master where type='table' and name='" +
-                                  table + "'").fetchall()[0][0]
-            if schema not in schemas:
-                schemas.append(schema)
-        conn.close()
-    return table_names, schemas
-
-
 def create_db_tables(main_connection, schemas):
     for schema in schemas:
         schema = schema.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS")
@@ -946,30 +1005,78 @@ def create_db_tables(main_connection, schemas):
         cursor = main_connection.execute(schema)
 
 
-def insert_db_data(main_connection, db_names, table_names):
+def insert_db_data(main_connection, db_names):
+    """Copy the rows of every node database into the combined database
+
+    The copy happens inside SQLite: each node database is attached and every table is
+    copied with a single INSERT ... SELECT, in one transaction per node database (SQLite
+    can't detach a database that the open transaction has read). Only events with an
+    eventId past the node's and table's watermark in merge_watermarks are copied, so
+    merging the same node databases again only adds what they gained since.
+
+    :return: watermarks[table_name][node_name], the watermarks before this merge
+    """
+    main_connection.execute("CREATE TABLE IF NOT EXISTS merge_watermarks (nodeNumber TEXT, "
+                            "tableName TEXT, maxEventId INTEGER, "
+                            "PRIMARY KEY (nodeNumber, tableName));")
+    main_connection.commit()
     sorted_names = natural_sort(db_names)
+    watermarks = {}
 
     for index in range(1, len(sorted_names) + 1):
         db_name = sorted_names[index - 1]
-        conn = connect(db_name)
-        cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-
-        for table in tables:
-            table_name = table[0]
-            cursor = conn.execute("SELECT * FROM " + table_name + ";")
-            table_data = cursor.fetchall()
-            column_names = [description[0] for description in cursor.description]
-
-            # Insert the data
-            for row in table_data:
-                insert_sql = create_insert_stmt(table_name, column_names, index, row)
-                try:
-                    main_connection.execute(insert_sql)
-                except IntegrityError:
-                    # This is caused by a duplicate input, ignore it and dont insert
-                    pass
-        conn.close()
+        # eventsqlN.db is node N, see Node.copy_event_db
+        node_number = get_trailing_number(path.basename(db_name)[:-len(".db")])
+        node_name = "node" + str(index if node_number is None else node_number)
+        main_connection.execute("ATTACH DATABASE ? AS node_db;", (db_name,))
+        try:
+            with main_connection:
+                schemas = main_connection.execute(
+                    "SELECT name, sql FROM node_db.sqlite_master WHERE type='table';").fetchall()
+                table_names = get_table_names(main_connection)
+                create_db_tables(main_connection, [schema for table_name, schema in schemas
+                                                   if table_name not in table_names])
+                for table_name, schema in schemas:
+                    cursor = main_connection.execute(
+                        'PRAGMA node_db.table_info("' + table_name + '");')
+                    column_names = [column[1] for column in cursor.fetchall()]
+                    watermark = get_watermark(main_connection, node_name, table_name)
+                    watermarks.setdefault(table_name, {})[node_name] = watermark
+                    if "eventId" not in column_names:
+                        main_connection.execute(create_copy_stmt(table_name, column_names),
+                                                (node_name,))
+                        continue
+                    main_connection.execute(create_copy_stmt(table_name, column_names) +
+                                            " WHERE eventId > ?;", (node_name, watermark))
+                    main_connection.execute(
+                        "INSERT OR REPLACE INTO merge_watermarks "
+                        "(nodeNumber, tableName, maxEventId) VALUES (?, ?, MAX(?, "
+                        'IFNULL((SELECT MAX(eventId) FROM node_db."' + table_name +
+                        '"), -1)));', (node_name, table_name, watermark))
+        except DatabaseError:
+            print("""There was an error while querying """ + db_name + """, this is probably
+                because you pulled the databases down from the nodes while grapevine was
+                still running""")
+        finally:
+            main_connection.execute("DETACH DATABASE node_db;")
+    return watermarks
+
+
+def get_watermark(connection, node_name, table_name):
+    """Largest eventId of a node and table merged so far, -1 before any
+
+    Combined databases from before merge_watermarks fall back to the merged events.
+    """
+    row = connection.execute("SELECT maxEventId FROM merge_watermarks "
+                             "WHERE nodeNumber=? AND tableName=?;",
+                             (node_name, table_name)).fetchone()
+    if row is not None:
+        return row[0]
+    if "eventId" not in get_column_names(connection, table_name):
+        return -1
+    row = connection.execute('SELECT MAX(eventId) FROM "' + table_name + '" WHERE nodeNumber=?;',
+                             (node_name,)).fetchone()
+    return -1 if row[0] is None else row[0]
 
 
 # Sort strings based on the numbers inside them, look up "natural sorting"
@@ -979,38 +1086,186 @@ def natural_sort(l):
     return sorted(l, key=alphanum_key)
 
 
-def create_insert_stmt(table_name, column_names, node_index, row_data):
-    insert_stmt = "INSERT INTO " + table_name + " (nodeNumber"
-    for column_name in column_names:
-        insert_stmt += ", " + column_name
-    insert_stmt += ") VALUES ('node" + str(node_index) + "'"
-    for data_value in row_data:
-        # Insert it as a string or integer
-        try:
-            if(data_value is None):
-                insert_stmt += ", NULL"
-            else:
-                insert_stmt += ", '" + data_value + "'"
-        except TypeError:
-            insert_stmt += ", " + str(data_value)
-    insert_stmt += ")"
-    return insert_stmt
+def create_copy_stmt(table_name, column_names):
+    """INSERT OR IGNORE ... SELECT of a table of the attached node_db, the node name is the
+    first parameter. Left open for a WHERE clause."""
+    columns = ", ".join('"' + column_name + '"' for column_name in column_names)
+    return ('INSERT OR IGNORE INTO main."' + table_name + '" (nodeNumber, ' + columns + ") " +
+            "SELECT ?, " + columns + ' FROM node_db."' + table_name + '"')
+
+
+##### Event Summaries #####
+
+def make_event_summaries(connection):
+    """Index and summarize the packet and rank events of a merged event database
+
+    The packet and rank tables are indexed on (nodeNumber, timestamp) and summarized per
+    node, second and type in the EVENT_SUMMARIES tables, seconds counted from the earliest
+    sent or received packet. run_metadata holds that earliest timestamp, the latest one
+    and EVENT_SUMMARY_VERSION. Rebuilds the summaries if they are already there.
+    """
+    with connection:
+        table_names = get_table_names(connection)
+        timestamp_columns = {}
+        for table_name, column_index in EVENT_TIMESTAMP_COLUMNS.items():
+            if table_name not in table_names:
+                continue
+            timestamp_columns[table_name] = get_column_names(connection, table_name)[column_index]
+            connection.execute('CREATE INDEX IF NOT EXISTS "' + table_name + '_node_time" ON "' +
+                               table_name + '" (nodeNumber, "' + timestamp_columns[table_name] +
+                               '");')
+
+        packet_tables = [table_name for table_name in ("loggableeventpacketsent",
+                                                       "loggableeventpacketreceived")
+                         if table_name in timestamp_columns]
+        earliest_time = None
+        latest_time = None
+        for table_name in packet_tables:
+            table_min, table_max = connection.execute(
+                'SELECT MIN("' + timestamp_columns[table_name] + '"), MAX("' +
+                timestamp_columns[table_name] + '") FROM "' + table_name + '";').fetchone()
+            if table_min is not None:
+                earliest_time = table_min if earliest_time is None else min(earliest_time,
+                                                                            table_min)
+                latest_time = table_max if latest_time is None else max(latest_time, table_max)
+
+        for summary_name, table_name, key_columns, value_columns in EVENT_SUMMARIES:
+            columns = ["nodeNumber", "second"] + [name for name, index in key_columns]
+            connection.execute('DROP TABLE IF EXISTS "' + summary_name + '";')
+            connection.execute(
+                'CREATE TABLE "' + summary_name + '" (' + ", ".join(columns) + ", " +
+                ", ".join(name for name, aggregate, index in value_columns) +
+                ", PRIMARY KEY (" + ", ".join(columns) + "));")
+            if table_name not in timestamp_columns or earliest_time is None:
+                continue
+            connection.execute(create_summary_stmt(connection, summary_name, table_name,
+                                                   key_columns, value_columns,
+                                                   timestamp_columns[table_name]),
+                               (earliest_time,))
+
+        connection.execute("CREATE TABLE IF NOT EXISTS run_metadata "
+                           "(name TEXT PRIMARY KEY, value);")
+        connection.executemany("INSERT OR REPLACE INTO run_metadata (name, value) VALUES (?, ?);",
+                               [("earliest_timestamp", earliest_time),
+                                ("latest_timestamp", latest_time),
+                                ("summary_version", EVENT_SUMMARY_VERSION)])
+
+
+def update_event_summaries(connection, watermarks):
+    """Add the events merged past watermarks to the summaries of make_event_summaries
+
+    Summary rows of seconds that already had events are added to (or maxed) in place.
+    Everything is rebuilt instead if there are no summaries yet or the new events start
+    before the earliest packet, which every summarized second is counted from.
+
+    :param watermarks: watermarks[table_name][node_name] from insert_db_data
+    """
+    metadata = get_run_metadata(connection)
+    earliest_time = metadata.get("earliest_timestamp")
+    if metadata.get("summary_version") != EVENT_SUMMARY_VERSION or earliest_time is None:
+        make_event_summaries(connection)
+        return
+    table_names = get_table_names(connection)
+    latest_time = metadata.get("latest_timestamp")
+    for table_name in ("loggableeventpacketsent", "loggableeventpacketreceived"):
+        if table_name not in table_names:
+            continue
+        timestamp_column = get_column_names(connection, table_name)[
+            EVENT_TIMESTAMP_COLUMNS[table_name]]
+        for node_name, watermark in watermarks.get(table_name, {}).items():
+            new_min, new_max = connection.execute(
+                'SELECT MIN("' + timestamp_column + '"), MAX("' + timestamp_column + '") FROM "' +
+                table_name + '" WHERE nodeNumber=? AND eventId > ?;',
+                (node_name, watermark)).fetchone()
+            if new_min is None:
+                continue
+            if new_min < earliest_time:
+                make_event_summaries(connection)
+                return
+            latest_time = new_max if latest_time is None else max(latest_time, new_max)
+
+    with connection:
+        for summary_name, table_name, key_columns, value_columns in EVENT_SUMMARIES:
+            if table_name not in table_names:
+                continue
+            timestamp_column = get_column_names(connection, table_name)[
+                EVENT_TIMESTAMP_COLUMNS[table_name]]
+            update_stmt = create_summary_stmt(connection, summary_name, table_name, key_columns,
+                                              value_columns, timestamp_column, incremental=True)
+            for node_name, watermark in watermarks.get(table_name, {}).items():
+                connection.execute(update_stmt, (earliest_time, node_name, watermark))
+        connection.execute("INSERT OR REPLACE INTO run_metadata (name, value) VALUES (?, ?);",
+                           ("latest_timestamp", latest_time))
+
+
+def create_summary_stmt(connection, summary_name, table_name, key_columns, value_columns,
+                        timestamp_column, incremental=False):
+    """INSERT ... SELECT ... GROUP BY filling a summary table, the earliest timestamp is the
+    first parameter
+
+    :param incremental: only summarize the events of one node past a watermark, the node
+    name and the watermark are the next parameters, and add them to the summary rows
+    already there
+    """
+    column_names = get_column_names(connection, table_name)
+    second = 'CAST(("' + timestamp_column + '" - ?) / 1000.0 AS INTEGER)'
+    keys = ["nodeNumber", second] + ['"' + column_names[index] + '"'
+                                     for name, index in key_columns]
+    values = [aggregate + "(*)" if index is None else
+              aggregate + '("' + column_names[index] + '")'
+              for name, aggregate, index in value_columns]
+    key_names = ["nodeNumber", "second"] + [name for name, index in key_columns]
+    value_names = [name for name, aggregate, index in value_columns]
+    stmt = ('INSERT INTO "' + summary_name + '" (' + ", ".join(key_names + value_names) + ") " +
+            "SELECT " + ", ".join(keys + values) + ' FROM "' + table_name + '" ')
+    if incremental:
+        stmt += "WHERE nodeNumber=? AND eventId > ? "
+    stmt += "GROUP BY " + ", ".join(str(index + 1) for index in range(len(keys)))
+    if incremental:
+        updates = [name + " = MAX(" + name + ", excluded." + name + ")" if aggregate == "MAX"
+                   else name + " = " + name + " + excluded." + name
+                   for name, aggregate, index in value_columns]
+        stmt += (" ON CONFLICT (" + ", ".join(key_names) + ") DO UPDATE SET " +
+                 ", ".join(updates))
+    return stmt + ";"
+
+
+def get_event_summaries(path_to_db):
+    """EventStore of a merged event database, summarizing it first if it was combined
+    before make_event_summaries existed"""
+    store = get_event_store(path_to_db)
+    if store.get_metadata().get("summary_version") != EVENT_SUMMARY_VERSION:
+        make_event_summaries(store.connection)
+    return store
+
+
+def get_run_metadata(connection):
+    """:return: run_metadata as a dict, empty if the database has none"""
+    if "run_metadata" not in get_table_names(connection):
+        return {}
+    return dict(connection.execute("SELECT name, value FROM run_metadata;").fetchall())
+
+
+def get_table_names(connection):
+    cursor = connection.execute("SELECT name FROM sqlite_master WHERE type='table';")
+    return [table[0] for table in cursor.fetchall()]
+
+
+def get_column_names(connection, table_name):
+    cursor = connection.execute('PRAGMA table_info("' + table_name + '");')
+    return [column[1] for column in cursor.fetchall()]
 
 
 ##### TESTING FUNCTIONS #####
 
 
 def check_packet_sent_timestamps(path_to_input):
-    packet_rows = get_sql_data(path_to_input, "loggableeventpacketsent")
-
+    store = get_event_store(path_to_input)
     nodes_dict = {}
-    for row in packet_rows:
-        sender_node = row[0]
-        timestamp = row[4]
-        if(sender_node not in nodes_dict.keys()):
-            nodes_dict[sender_node] = 9999999999999
-        if(timestamp < nodes_dict[sender_node]):
-            nodes_dict[sender_node] = timestamp
+    if store.has_table("loggableeventpacketsent"):
+        time_column = store.get_column_name("loggableeventpacketsent", 4)
+        nodes_dict = dict(store.query('SELECT nodeNumber, MIN("' + time_column + '") ' +
+                                      "FROM loggableeventpacketsent GROUP BY nodeNumber;"))
 
     for sender_node in nodes_dict.keys():
         print("Earliest time for " + sender_node + ": " + str(nodes_dict[sender_node]))
@@ -1031,22 +1286,33 @@ def copy_dump_files(node_objects, output_dir):
     return folder_name
 
 
+def copy_dump_summaries(node_objects, output_dir):
+    """Like copy_dump_files but each node summarizes its own captures, see pcapsummary.py"""
+    date_time = strftime("%Y-%m-%d_%H:%M:%S", gmtime())
+    folder_name = output_dir + "/" + date_time + "/"
+    create_dir(folder_name)
+    ipmap = make_ipmap(node_objects, folder_name + "ipmap")
+    results = functions.run_on_nodes(node_objects, "retrieve_pcap_summary",
+                                     args=(folder_name, ipmap))
+    functions.print_node_results(results, "pcap summary")
+    return folder_name
+
+
 def make_ipmap(node_objects, map_path):
-    ipmap = {}
-    threads = []
-    return_queue = queue.Queue()
-    for node in node_objects:
-        new_thread = threading.Thread(target=lambda q: q.put(node.get_ipmap()),
-                                      args=(return_queue,))
-        threads.append(new_thread)
-        new_thread.start()
-    for t in threads:
-        t.join()
-    while not return_queue.empty():
-        rtn_val = return_queue.get()
-        ipmap.update(rtn_val)
+    ipmap = get_ipmap(node_objects)
     with open(map_path, "wb") as file:
         pickle.dump(ipmap, file)
+    return ipmap
+
+
+def get_ipmap(node_objects):
+    """:return: ipmap[ip] = node id of every interface of every node"""
+    ipmap = {}
+    results = functions.run_on_nodes(node_objects, "get_ipmap")
+    for result in results.values():
+        if result["status"] == "ok":
+            ipmap.update(result["value"])
+    return ipmap
 
 
 def read_ipmap(map_path):
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+# File: telemetry.py
+# Author: Luke Thomas
+# Date: April 20, 2018
+# Description: Live traffic view while a test runs. Each node's emane interfaces are
+# captured with tcpdump -w - over ssh and parsed as the bytes arrive (pcapreader's
+# StreamParser), keeping rolling per-second tx/rx bytes by GrapeVine packet type for the
+# whole cluster in memory. stats_tcpdump still gives the exact numbers after the test.
+
+# System Imports
+from time import sleep, time
+import sys
+import threading
+
+# Third Party Imports
+
+# Local Imports
+import pcapreader
+import pcapsummary
+from config import TELEMETRY_WINDOW, TELEMETRY_REFRESH
+from constants import PACKET_TYPES
+from histograms import OTHER_TYPE, get_type_index
+
+TYPE_NAMES = PACKET_TYPES + [OTHER_TYPE]
+CLEAR_SCREEN = "\033[H\033[J"
+
+
+##### COUNTERS #####
+
+class TrafficCounters:
+    """Rolling per-second byte counts of every node, safe to update from many threads
+
+    Packets are counted in the second they reached us rather than by their capture
+    timestamp, so skew between the nodes' clocks doesn't matter.
+    """
+    def __init__(self, window=TELEMETRY_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        # seconds[node_name][second][(direction, type_name)] = bytes
+        self.seconds = {}
+        # status[node_name][iface] = "connecting", "streaming" or the error that ended it
+        self.status = {}
+
+    def add(self, node_name, second, direction, type_name, length):
+        with self.lock:
+            node_seconds = self.seconds.setdefault(node_name, {})
+            if second not in node_seconds:
+                for old_second in [s for s in node_seconds if s <= second - self.window]:
+                    del node_seconds[old_second]
+                node_seconds[second] = {}
+            counts = node_seconds[second]
+            key = (direction, type_name)
+            counts[key] = counts.get(key, 0) + length
+
+    def set_status(self, node_name, iface, status):
+        with self.lock:
+            self.status.setdefault(node_name, {})[iface] = status
+
+    def get_rates(self, node_name, now):
+        """Bytes in the last complete second and average bytes per second over the window
+
+        :return: last[(direction, type_name)], average[(direction, type_name)]
+        """
+        last = {}
+        average = {}
+        with self.lock:
+            node_seconds = self.seconds.get(node_name, {})
+            for second, counts in node_seconds.items():
+                # The current second is still filling up
+                if second >= now or second < now - self.window:
+                    continue
+                for key, byte_count in counts.items():
+                    average[key] = average.get(key, 0) + byte_count / self.window
+                    if second == now - 1:
+                        last[key] = byte_count
+        return last, average
+
+    def get_status(self, node_name):
+        with self.lock:
+            return dict(self.status.get(node_name, {}))
+
+
+##### CAPTURE #####
+
+def get_type_name(record):
+    """Type name of a PcapRecord as the histograms count it, DHCP/BOOTP is other"""
+    if pcapreader.is_dhcp(record):
+        return OTHER_TYPE
+    return TYPE_NAMES[get_type_index(record.packet_type, len(PACKET_TYPES))]
+
+
+def count_capture(node, iface, ipmap, counters, stop_event):
+    """Stream one interface of one node into counters until stop_event is set"""
+    counters.set_status(node.name, iface, "connecting")
+    parser = pcapreader.StreamParser()
+    try:
+        for chunk in node.stream_capture(iface, stop_event):
+            counters.set_status(node.name, iface, "streaming")
+            second = int(time())
+            for record in parser.feed(chunk):
+                if record.src is None:
+                    continue
+                sender = pcapsummary.is_sender(record.src, node.id, ipmap)
+                if sender is None:
+                    continue
+                counters.add(node.name, second, "tx" if sender else "rx",
+                             get_type_name(record), record.length)
+        counters.set_status(node.name, iface, "stopped")
+    except Exception as e:
+        counters.set_status(node.name, iface, "error: " + str(e))
+
+
+def start_captures(node_objects, ipmap, counters, stop_event):
+    """Start a count_capture thread for every interface of every node"""
+    threads = []
+    for node in node_objects:
+        for iface in node.get_capture_ifaces():
+            thread = threading.Thread(target=count_capture,
+                                      args=(node, iface, ipmap, counters, stop_event))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+    return threads
+
+
+##### VIEW #####
+
+def format_bytes(byte_count):
+    for unit in ("B", "KB", "MB"):
+        if byte_count < 1024:
+            return str(int(byte_count)) + unit
+        byte_count /= 1024
+    return "{:.1f}GB".format(byte_count)
+
+
+def format_cluster_view(counters, node_objects, now):
+    """Table of every node's tx/rx bytes/s, last second and window average, and tx by type"""
+    columns = ["node", "tx/s", "rx/s", "tx avg", "rx avg"] + \
+              [type_name + " tx" for type_name in TYPE_NAMES] + ["capture"]
+    rows = []
+    totals = {}
+    for node in node_objects:
+        last, average = counters.get_rates(node.name, now)
+        last_tx = sum(v for (direction, t), v in last.items() if direction == "tx")
+        last_rx = sum(v for (direction, t), v in last.items() if direction == "rx")
+        avg_tx = sum(v for (direction, t), v in average.items() if direction == "tx")
+        avg_rx = sum(v for (direction, t), v in average.items() if direction == "rx")
+        values = [last_tx, last_rx, avg_tx, avg_rx] + \
+                 [average.get(("tx", type_name), 0) for type_name in TYPE_NAMES]
+        for index, value in enumerate(values):
+            totals[index] = totals.get(index, 0) + value
+        status = counters.get_status(node.name)
+        streaming = sum(1 for s in status.values() if s == "streaming")
+        capture = str(streaming) + "/" + str(len(status))
+        errors = [s for s in status.values() if s.startswith("error")]
+        if errors:
+            capture += " " + errors[0]
+        rows.append([node.name] + [format_bytes(value) for value in values] + [capture])
+    rows.append(["total"] + [format_bytes(totals.get(index, 0))
+                             for index in range(len(columns) - 2)] + [""])
+
+    widths = [max(len(str(row[index])) for row in [columns] + rows)
+              for index in range(len(columns))]
+    lines = ["Live traffic, bytes in the last second and averaged over the last " +
+             str(counters.window) + "s (Ctrl-C to stop)", ""]
+    for row in [columns] + rows:
+        lines.append("  ".join(str(value).rjust(widths[index]) if index else
+                               str(value).ljust(widths[index])
+                               for index, value in enumerate(row)))
+    return "\n".join(lines)
+
+
+def watch_cluster(node_objects, ipmap, duration=None, refresh=TELEMETRY_REFRESH):
+    """Show a continuously updating view of the cluster's traffic
+
+    Runs until Ctrl-C or for duration seconds, the captures are stopped either way.
+
+    :param ipmap: ipmap[ip] = node id, see statsuite.get_ipmap
+    :return: the TrafficCounters, for a final look at the numbers
+    """
+    counters = TrafficCounters()
+    stop_event = threading.Event()
+    threads = start_captures(node_objects, ipmap, counters, stop_event)
+    start_time = time()
+    try:
+        while duration is None or time() - start_time < duration:
+            sys.stdout.write(CLEAR_SCREEN + format_cluster_view(counters, node_objects,
+                                                                int(time())) + "\n")
+            sys.stdout.flush()
+            sleep(refresh)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join(5)
+    return counters
@@ -0,0 +1,641 @@
+#!/usr/bin/env python3
+
+# File: transfer.py
+# Author: Luke Thomas
+# Date: April 12, 2018
+# Description: In-process file transfers to and from nodes over SFTP on the pooled ssh
+# connections from sshpool.py, used instead of forking scp for every file.
+
+# System Imports
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from glob import glob
+from os import makedirs, path, remove, replace, stat, walk
+from pickle import load, dump
+from shlex import quote
+from stat import S_ISDIR
+import hashlib
+import posixpath
+import threading
+import zlib
+
+# Third Party Imports
+from paramiko import RSAKey
+from paramiko.agent import AgentRequestHandler
+
+# Local Imports
+import config
+import sshpool
+
+
+##### PATHS #####
+
+def normalize_remote_path(remote_path):
+    """SFTP doesn't expand ~, but it starts in the home directory so make ~ paths relative"""
+    if remote_path == "~" or remote_path == "~/":
+        return "."
+    if remote_path.startswith("~/"):
+        return remote_path[2:]
+    return remote_path
+
+
+def is_remote_dir(sftp, remote_path):
+    try:
+        return S_ISDIR(sftp.stat(remote_path).st_mode)
+    except IOError:
+        return False
+
+
+def resolve_remote_dest(sftp, local_path, remote_path):
+    """Mimic scp, copying into remote_path if it is a directory"""
+    remote_path = normalize_remote_path(remote_path)
+    if remote_path.endswith("/") or is_remote_dir(sftp, remote_path):
+        return posixpath.join(remote_path, path.basename(local_path))
+    return remote_path
+
+
+def resolve_local_dest(remote_path, local_path):
+    if local_path.endswith("/") or path.isdir(local_path):
+        return path.join(local_path, posixpath.basename(remote_path))
+    return local_path
+
+
+def remote_makedirs(sftp, remote_dir):
+    if remote_dir in ("", ".", "/") or is_remote_dir(sftp, remote_dir):
+        return
+    remote_makedirs(sftp, posixpath.dirname(remote_dir.rstrip("/")))
+    try:
+        sftp.mkdir(remote_dir)
+    except IOError:
+        # Another stream may have made it first
+        if not is_remote_dir(sftp, remote_dir):
+            raise
+
+
+def expand_remote_glob(sftp, remote_pattern):
+    """Expand a glob in the last path component, e.g. /home/emane-01/data/stats/*"""
+    remote_pattern = normalize_remote_path(remote_pattern)
+    remote_dir, pattern = posixpath.split(remote_pattern)
+    if not any(char in pattern for char in "*?["):
+        return [remote_pattern]
+    names = sorted(sftp.listdir(remote_dir if remote_dir else "."))
+    return [posixpath.join(remote_dir, name) for name in names if fnmatch(name, pattern)]
+
+
+def expand_local_glob(local_pattern):
+    matches = sorted(glob(local_pattern))
+    if not matches:
+        raise IOError("No local files match " + local_pattern)
+    return matches
+
+
+##### PROGRESS #####
+
+def make_progress_tracker(total_bytes, progress):
+    """Combine paramiko's per-file callbacks into progress(bytes_done, total_bytes)"""
+    if progress is None:
+        return lambda file_key: None
+    done = {}
+    lock = threading.Lock()
+
+    def file_callback(file_key):
+        def callback(transferred, file_total):
+            with lock:
+                done[file_key] = transferred
+                bytes_done = sum(done.values())
+            progress(bytes_done, total_bytes)
+        return callback
+    return file_callback
+
+
+def print_progress(label, step_percent=10):
+    """Return a progress callback that prints every step_percent of the transfer"""
+    last_printed = [-step_percent]
+
+    def progress(bytes_done, total_bytes):
+        percent = 100 if total_bytes == 0 else int(bytes_done * 100 / total_bytes)
+        if percent >= last_printed[0] + step_percent:
+            last_printed[0] = percent - percent % step_percent
+            print(label + ": " + str(percent) + "% of " + str(total_bytes) + " bytes")
+    return progress
+
+
+##### TRANSFERS #####
+
+def split_into_streams(file_pairs, sizes, num_streams):
+    """Spread files over num_streams lists with roughly equal bytes in each"""
+    streams = [[] for index in range(max(1, min(num_streams, len(file_pairs))))]
+    stream_bytes = [0] * len(streams)
+    order = sorted(range(len(file_pairs)), key=lambda index: sizes[index], reverse=True)
+    for index in order:
+        smallest = stream_bytes.index(min(stream_bytes))
+        streams[smallest].append(file_pairs[index])
+        stream_bytes[smallest] += sizes[index]
+    return streams
+
+
+def run_streams(ip, user_name, streams, stream_function):
+    """Run stream_function(sftp, file_pairs) for each stream on its own SFTP channel"""
+    with sshpool.connection(ip, user_name) as ssh:
+        def run_stream(file_pairs):
+            sftp = ssh.open_sftp()
+            try:
+                return stream_function(sftp, file_pairs)
+            finally:
+                sftp.close()
+
+        with ThreadPoolExecutor(max_workers=len(streams)) as executor:
+            futures = [executor.submit(run_stream, stream) for stream in streams]
+            # result() re-raises any failed transfer
+            return [result for future in futures for result in future.result()]
+
+
+def put_files(ip, user_name, file_pairs, num_streams=None, progress=None):
+    """Upload files to a node, returning once every file is completely written
+
+    :param file_pairs: list of (local_path, remote_path), a remote directory (or a path
+    ending in "/") receives the file under its local name like scp
+    :param num_streams: parallel SFTP channels (default config.TRANSFER_STREAMS)
+    :param progress: function called as progress(bytes_done, total_bytes)
+    :return: list of remote paths written
+    """
+    if not file_pairs:
+        return []
+    num_streams = config.TRANSFER_STREAMS if num_streams is None else num_streams
+    sizes = [stat(local_path).st_size for local_path, remote_path in file_pairs]
+    file_callback = make_progress_tracker(sum(sizes), progress)
+
+    def put_stream(sftp, stream_pairs):
+        written = []
+        for local_path, remote_path in stream_pairs:
+            remote_path = resolve_remote_dest(sftp, local_path, remote_path)
+            # confirm=True stats the remote file and raises IOError on a size mismatch
+            sftp.put(local_path, remote_path, callback=file_callback(local_path),
+                     confirm=True)
+            # scp keeps the permission bits, emane_start.sh has to stay executable
+            sftp.chmod(remote_path, stat(local_path).st_mode & 0o777)
+            written.append(remote_path)
+        return written
+
+    streams = split_into_streams(file_pairs, sizes, num_streams)
+    return run_streams(ip, user_name, streams, put_stream)
+
+
+def get_files(ip, user_name, file_pairs, num_streams=None, progress=None):
+    """Download files from a node, returning once every file is completely written
+
+    :param file_pairs: list of (remote_path, local_path), the remote path may end in a glob
+    and a local directory (or a path ending in "/") receives files under their remote names
+    :return: list of local paths written
+    """
+    if not file_pairs:
+        return []
+    num_streams = config.TRANSFER_STREAMS if num_streams is None else num_streams
+    with sshpool.connection(ip, user_name) as ssh:
+        sftp = ssh.open_sftp()
+        try:
+            expanded_pairs = []
+            for remote_pattern, local_path in file_pairs:
+                for remote_path in expand_remote_glob(sftp, remote_pattern):
+                    expanded_pairs.append((remote_path, local_path))
+            sizes = [sftp.stat(remote_path).st_size for remote_path, local_path in
+                     expanded_pairs]
+        finally:
+            sftp.close()
+    if not expanded_pairs:
+        return []
+    file_callback = make_progress_tracker(sum(sizes), progress)
+
+    def get_stream(sftp, stream_pairs):
+        written = []
+        for remote_path, local_path in stream_pairs:
+            local_path = resolve_local_dest(remote_path, local_path)
+            remote_size = sftp.stat(remote_path).st_size
+            sftp.get(remote_path, local_path, callback=file_callback(remote_path))
+            if path.getsize(local_path) != remote_size:
+                raise IOError("Size mismatch copying " + remote_path + " from " + ip)
+            written.append(local_path)
+        return written
+
+    streams = split_into_streams(expanded_pairs, sizes, num_streams)
+    return run_streams(ip, user_name, streams, get_stream)
+
+
+def put_dir(ip, user_name, local_dir, remote_dir, num_streams=None, progress=None,
+            sync=False):
+    """Upload the contents of local_dir into remote_dir, like scp -r local_dir/. remote_dir
+
+    :param sync: only upload files that changed since the last sync, see sync_files
+    """
+    remote_dir = normalize_remote_path(remote_dir)
+    file_pairs = []
+    remote_dirs = [remote_dir]
+    for dir_path, dir_names, file_names in walk(local_dir):
+        relative_dir = path.relpath(dir_path, local_dir)
+        remote_sub_dir = remote_dir if relative_dir == "." else \
+            posixpath.join(remote_dir, *relative_dir.split(path.sep))
+        remote_dirs.append(remote_sub_dir)
+        for file_name in file_names:
+            file_pairs.append((path.join(dir_path, file_name),
+                               posixpath.join(remote_sub_dir, file_name)))
+
+    with sshpool.connection(ip, user_name) as ssh:
+        sftp = ssh.open_sftp()
+        try:
+            for remote_sub_dir in remote_dirs:
+                remote_makedirs(sftp, remote_sub_dir)
+        finally:
+            sftp.close()
+    if sync:
+        return sync_files(ip, user_name, file_pairs, num_streams, progress)
+    return put_files(ip, user_name, file_pairs, num_streams, progress)
+
+
+def get_dir(ip, user_name, remote_dir, local_dir, num_streams=None, progress=None):
+    """Download the contents of remote_dir into local_dir, like scp -r host:remote_dir/. dir"""
+    remote_dir = normalize_remote_path(remote_dir)
+    file_pairs = []
+    with sshpool.connection(ip, user_name) as ssh:
+        sftp = ssh.open_sftp()
+        try:
+            pending_dirs = [(remote_dir, local_dir)]
+            while pending_dirs:
+                remote_sub_dir, local_sub_dir = pending_dirs.pop()
+                makedirs(local_sub_dir, exist_ok=True)
+                for attributes in sftp.listdir_attr(remote_sub_dir):
+                    remote_path = posixpath.join(remote_sub_dir, attributes.filename)
+                    local_path = path.join(local_sub_dir, attributes.filename)
+                    if S_ISDIR(attributes.st_mode):
+                        pending_dirs.append((remote_path, local_path))
+                    else:
+                        file_pairs.append((remote_path, local_path))
+        finally:
+            sftp.close()
+    return get_files(ip, user_name, file_pairs, num_streams, progress)
+
+
+##### COMPRESSED #####
+
+def get_compressed_file(ip, user_name, remote_path, local_path, decompress=False,
+                        chunk_size=262144):
+    """Gzip remote_path on the node and stream it down without a temporary file there
+
+    :param decompress: inflate the stream on the fly and write the original file, otherwise
+    local_path receives the .gz data as is
+    :return: local path written
+    """
+    remote_path = normalize_remote_path(remote_path)
+    local_path = resolve_local_dest(remote_path + ("" if decompress else ".gz"), local_path)
+    command = "gzip -c -" + str(config.TRANSFER_COMPRESS_LEVEL) + " " + quote(remote_path)
+    # gzip header and trailer are checked when decompressing
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if decompress else None
+    part_path = local_path + ".part"
+    try:
+        with sshpool.connection(ip, user_name) as ssh:
+            channel = sshpool.open_session(ssh, ip, user_name)
+            stderr_reader = None
+            try:
+                channel.exec_command(command)
+                stderr_reader = sshpool.StderrReader(channel)
+                with open(part_path, 'wb') as file:
+                    chunk = channel.recv(chunk_size)
+                    while chunk:
+                        file.write(decompressor.decompress(chunk) if decompress else chunk)
+                        chunk = channel.recv(chunk_size)
+                    if decompress:
+                        file.write(decompressor.flush())
+                exit_status = channel.recv_exit_status()
+            finally:
+                channel.close()
+                error = stderr_reader.get_output() if stderr_reader is not None else ""
+        if exit_status != 0 or (decompress and not decompressor.eof):
+            raise IOError("Compressed copy of " + remote_path + " from " + ip + " failed: " +
+                          error)
+    except BaseException:
+        # Nothing half written is left behind, whatever interrupted the download
+        if path.exists(part_path):
+            remove(part_path)
+        raise
+    replace(part_path, local_path)
+    return local_path
+
+
+def get_compressed_files(ip, user_name, file_pairs, decompress=False, num_streams=None):
+    """get_compressed_file for each (remote_path, local_path), num_streams at a time"""
+    if not file_pairs:
+        return []
+    num_streams = config.TRANSFER_STREAMS if num_streams is None else num_streams
+    with ThreadPoolExecutor(max_workers=max(1, min(num_streams, len(file_pairs)))) as executor:
+        futures = [executor.submit(get_compressed_file, ip, user_name, remote_path, local_path,
+                                   decompress) for remote_path, local_path in file_pairs]
+        return [future.result() for future in futures]
+
+##### RELAY #####
+
+def is_relay_configured(targets):
+    """Whether the targets can log into each other, with our forwarded agent or because
+    deploy_relay_key installed the current relay key on every one of them
+
+    :param targets: list of (ip, user_name, ...), as relay_files takes them
+    """
+    if config.RELAY_FORWARD_AGENT:
+        return True
+    key_path = path.expanduser(config.RELAY_KEY_PATH)
+    if not path.isfile(key_path):
+        return False
+    key_hash = hash_local_file(key_path)
+    for target in targets:
+        entry = get_node_manifest(target[0], target[1]).get(config.RELAY_REMOTE_KEY_PATH)
+        if entry is None or entry["hash"] != key_hash:
+            return False
+    return True
+
+
+def make_relay_key():
+    """Create the relay key pair at RELAY_KEY_PATH if it doesn't exist yet
+
+    :return: the public key, an authorized_keys line
+    """
+    key_path = path.expanduser(config.RELAY_KEY_PATH)
+    if not path.isfile(key_path):
+        key = RSAKey.generate(2048)
+        key.write_private_key_file(key_path)
+        with open(key_path + ".pub", "w") as file:
+            file.write(key.get_name() + " " + key.get_base64() + " grapevine-relay\n")
+    with open(key_path + ".pub", "r") as file:
+        return file.read().strip()
+
+
+def deploy_relay_key(ip, user_name, public_key):
+    """Install the relay key on a node, so it can scp to the other nodes and they to it
+
+    The sync manifest's entry for the key is what is_relay_configured checks, so it is
+    only kept once the key is usable.
+
+    :param public_key: from make_relay_key
+    """
+    sync_files(ip, user_name, [(path.expanduser(config.RELAY_KEY_PATH),
+                                config.RELAY_REMOTE_KEY_PATH)])
+    command = "chmod 600 " + quote(config.RELAY_REMOTE_KEY_PATH) + \
+              " && (grep -qxF " + quote(public_key) + " .ssh/authorized_keys 2>/dev/null" + \
+              " || echo " + quote(public_key) + " >> .ssh/authorized_keys)"
+    with sshpool.connection(ip, user_name) as ssh:
+        stdin, stdout, stderr = sshpool.exec_command(ssh, ip, user_name, command)
+        exit_status = stdout.channel.recv_exit_status()
+        error = stderr.read().decode().strip()
+    if exit_status != 0:
+        forget_remote_path(ip, user_name, config.RELAY_REMOTE_KEY_PATH)
+        raise IOError("Couldn't install the relay key on " + ip + ": " + error)
+
+
+def relay_destinations(local_paths, remote_path):
+    """Remote path of each local file, remote_path is a directory if it ends in / or there
+    is more than one file"""
+    remote_path = normalize_remote_path(remote_path)
+    if remote_path.endswith("/") or len(local_paths) > 1:
+        return [posixpath.join(remote_path, path.basename(local_path))
+                for local_path in local_paths]
+    return [remote_path]
+
+
+def relay_to_peer(holder, peer, local_paths, dest_paths):
+    """Have holder scp its copies to peer, pushing from here instead if that fails
+
+    :param holder: (ip, user_name, remote_path) of a node that already has the files
+    :param peer: (ip, user_name, remote_path) of a node that doesn't
+    :return: "relay" or "direct"
+    """
+    holder_ip, holder_user = holder[:2]
+    peer_ip, peer_user = peer[:2]
+    scp_options = config.RELAY_SCP_OPTIONS
+    if not config.RELAY_FORWARD_AGENT:
+        scp_options += " -i " + quote(config.RELAY_REMOTE_KEY_PATH)
+    copies = []
+    for source_path, dest_path in zip(dest_paths[holder[:2]], dest_paths[peer[:2]]):
+        copies.append("scp -q " + scp_options + " " + quote(source_path) + " " +
+                      quote(peer_user + "@" + peer_ip + ":" + dest_path))
+    with sshpool.connection(holder_ip, holder_user) as ssh:
+        channel = sshpool.open_session(ssh, holder_ip, holder_user)
+        agent_handler = None
+        try:
+            if config.RELAY_FORWARD_AGENT:
+                # Lets the holder log into the peer with this machine's keys
+                agent_handler = AgentRequestHandler(channel)
+            channel.exec_command(" && ".join(copies))
+            exit_status = channel.recv_exit_status()
+            error = channel.recv_stderr(4096).decode().strip() if \
+                channel.recv_stderr_ready() else ""
+        finally:
+            if agent_handler is not None:
+                agent_handler.close()
+            channel.close()
+    if exit_status == 0:
+        return "relay"
+    print("Relay " + holder_ip + " -> " + peer_ip + " failed, pushing directly: " + error)
+    put_files(peer_ip, peer_user, list(zip(local_paths, dest_paths[peer[:2]])))
+    return "direct"
+
+
+def relay_files(targets, local_paths):
+    """Upload local_paths to every target while sending them over our own uplink only once
+
+    The first target is seeded over SFTP, then every node that has the files copies them to
+    one that doesn't, doubling the holders each round, so N nodes take about log2(N) rounds
+    over the nodes' own network. A failed hop falls back to a direct push.
+
+    :param targets: list of (ip, user_name, remote_path), remote_path is a directory if it
+    ends in / and is created beforehand, like with scp
+    :return: OrderedDict[ip] = "seed", "relay" or "direct"
+    """
+    methods = OrderedDict()
+    if not targets or not local_paths:
+        return methods
+    dest_paths = {target[:2]: relay_destinations(local_paths, target[2]) for target in targets}
+    seed = targets[0]
+    written = put_files(seed[0], seed[1], list(zip(local_paths, dest_paths[seed[:2]])))
+    if written != dest_paths[seed[:2]]:
+        # remote_path named an existing directory without the trailing /
+        dest_paths = {target[:2]: relay_destinations(local_paths, target[2] + "/")
+                      for target in targets}
+    methods[seed[0]] = "seed"
+
+    holders = [seed]
+    pending = list(targets[1:])
+    while pending:
+        round_pairs = list(zip(holders, pending))
+        pending = pending[len(round_pairs):]
+        with ThreadPoolExecutor(max_workers=len(round_pairs)) as executor:
+            futures = [executor.submit(relay_to_peer, holder, peer, local_paths, dest_paths)
+                       for holder, peer in round_pairs]
+            for (holder, peer), future in zip(round_pairs, futures):
+                methods[peer[0]] = future.result()
+                holders.append(peer)
+    return methods
+
+##### SYNC #####
+
+# _manifest[user_name + "@" + ip][remote_path] = {"hash", "size", "mtime"}, the content
+# last written there and the remote size and mtime right after writing it
+_manifest = None
+_manifest_lock = threading.Lock()
+
+# _local_hashes[local_path] = (size, mtime, hash) so a jar pushed to every node is hashed once
+_local_hashes = {}
+_local_hashes_lock = threading.Lock()
+
+
+def load_manifest():
+    """Must be called with _manifest_lock held"""
+    global _manifest
+    if _manifest is None:
+        _manifest = {}
+        if path.isfile(config.SYNC_MANIFEST_PATH):
+            with open(config.SYNC_MANIFEST_PATH, 'rb') as file:
+                _manifest = load(file)
+    return _manifest
+
+
+def save_manifest():
+    """Must be called with _manifest_lock held"""
+    temp_path = config.SYNC_MANIFEST_PATH + ".tmp"
+    with open(temp_path, 'wb') as file:
+        dump(_manifest, file)
+    replace(temp_path, config.SYNC_MANIFEST_PATH)
+
+
+def get_node_manifest(ip, user_name):
+    with _manifest_lock:
+        return dict(load_manifest().get(user_name + "@" + ip, {}))
+
+
+def update_node_manifest(ip, user_name, entries):
+    if not entries:
+        return
+    with _manifest_lock:
+        load_manifest().setdefault(user_name + "@" + ip, {}).update(entries)
+        save_manifest()
+
+
+def forget_node(ip, user_name):
+    """Drop a node's manifest so the next sync uploads everything, e.g. after a rebuild"""
+    with _manifest_lock:
+        if load_manifest().pop(user_name + "@" + ip, None) is not None:
+            save_manifest()
+
+
+def forget_remote_path(ip, user_name, remote_path):
+    """Drop one file from a node's manifest, the next sync uploads it"""
+    with _manifest_lock:
+        node_manifest = load_manifest().get(user_name + "@" + ip, {})
+        if node_manifest.pop(remote_path, None) is not None:
+            save_manifest()
+
+
+def hash_local_file(local_path):
+    file_stat = stat(local_path)
+    with _local_hashes_lock:
+        cached = _local_hashes.get(local_path)
+    if cached is not None and cached[:2] == (file_stat.st_size, file_stat.st_mtime):
+        return cached[2]
+    sha1 = hashlib.sha1()
+    with open(local_path, 'rb') as file:
+        for block in iter(lambda: file.read(1048576), b""):
+            sha1.update(block)
+    with _local_hashes_lock:
+        _local_hashes[local_path] = (file_stat.st_size, file_stat.st_mtime, sha1.hexdigest())
+    return sha1.hexdigest()
+
+
+def hash_remote_files(ip, user_name, remote_paths):
+    """sha1sum files on the node in one command, returns {remote_path: hash}"""
+    if not remote_paths:
+        return {}
+    command = "sha1sum " + " ".join(quote(remote_path) for remote_path in remote_paths)
+    with sshpool.connection(ip, user_name) as ssh:
+        stdin, stdout, stderr = sshpool.exec_command(ssh, ip, user_name, command)
+        output = stdout.read().decode()
+    remote_hashes = {}
+    for line in output.splitlines():
+        # "<40 hex digits>  <path>"
+        if len(line) > 42:
+            remote_hashes[line[42:]] = line[:40]
+    return remote_hashes
+
+
+def stat_remote_files(ip, user_name, file_pairs):
+    """Resolve each remote destination like put_files and stat it
+
+    :return: list of (local_path, remote_path) and {remote_path: SFTPAttributes} for the
+    destinations that already exist
+    """
+    with sshpool.connection(ip, user_name) as ssh:
+        sftp = ssh.open_sftp()
+        try:
+            resolved_pairs = [(local_path, resolve_remote_dest(sftp, local_path, remote_path))
+                              for local_path, remote_path in file_pairs]
+            remote_stats = {}
+            for local_path, remote_path in resolved_pairs:
+                try:
+                    remote_stats[remote_path] = sftp.stat(remote_path)
+                except IOError:
+                    pass
+        finally:
+            sftp.close()
+    return resolved_pairs, remote_stats
+
+
+def sync_files(ip, user_name, file_pairs, num_streams=None, progress=None):
+    """Upload only the files whose content differs from what is on the node, like rsync
+
+    A file is skipped when the manifest says we wrote the same content there and the remote
+    size and mtime haven't changed since. Files the manifest doesn't know about (first
+    sync, or pushed some other way) are hashed on the node with one sha1sum instead.
+
+    :param file_pairs: same as put_files
+    :return: list of remote paths written, unchanged files are left out
+    """
+    if not file_pairs:
+        return []
+    node_manifest = get_node_manifest(ip, user_name)
+    resolved_pairs, remote_stats = stat_remote_files(ip, user_name, file_pairs)
+
+    changed_pairs = []
+    unknown_pairs = []
+    new_entries = {}
+    local_hashes = {}
+    for local_path, remote_path in resolved_pairs:
+        local_hash = hash_local_file(local_path)
+        local_hashes[local_path] = local_hash
+        remote_stat = remote_stats.get(remote_path)
+        entry = node_manifest.get(remote_path)
+        if remote_stat is None or remote_stat.st_size != stat(local_path).st_size:
+            changed_pairs.append((local_path, remote_path))
+        elif entry is None or entry["size"] != remote_stat.st_size or \
+                entry["mtime"] != remote_stat.st_mtime:
+            # Touched on the node since we wrote it, only the content can tell
+            unknown_pairs.append((local_path, remote_path))
+        elif entry["hash"] != local_hash:
+            changed_pairs.append((local_path, remote_path))
+
+    remote_hashes = hash_remote_files(ip, user_name,
+                                      [remote_path for local_path, remote_path in unknown_pairs])
+    for local_path, remote_path in unknown_pairs:
+        local_hash = local_hashes[local_path]
+        if remote_hashes.get(remote_path) == local_hash:
+            remote_stat = remote_stats[remote_path]
+            new_entries[remote_path] = {"hash": local_hash, "size": remote_stat.st_size,
+                                        "mtime": remote_stat.st_mtime}
+        else:
+            changed_pairs.append((local_path, remote_path))
+
+    written = put_files(ip, user_name, changed_pairs, num_streams, progress)
+    if changed_pairs:
+        resolved_pairs, remote_stats = stat_remote_files(ip, user_name, changed_pairs)
+        for local_path, remote_path in resolved_pairs:
+            remote_stat = remote_stats[remote_path]
+            new_entries[remote_path] = {"hash": local_hashes[local_path],
+                                        "size": remote_stat.st_size,
+                                        "mtime": remote_stat.st_mtime}
+    update_node_manifest(ip, user_name, new_entries)
+    return written